@@ -0,0 +1,425 @@
+# c12_18_access.py - python module for scanning which tables each C12.18
+# user number can read.
+#
+# Copyright (c) 2011, InGuardians, Inc. <consulting@inguardians.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Point Of Contact:    Don C. Weber <don@inguardians.com>
+
+# The scan fills a user x table matrix of two bit cells: not tested, <ok>,
+# <isc>, or <sns>. Time on the link is saved four ways:
+#   1. Users after the first are logged off and on again inside the session
+#      the ident and negotiate opened, if the meter allows it
+#   2. Access is tested with a one byte partial read, not a full table read
+#   3. A table the meter does not have (<sns>) is not tried for other users
+#   4. Each distinct row is a privilege class. Tables some class can read are
+#      read first. Once a user is refused a table a class can read, the user is
+#      below that class, and tables the class cannot read are not read. Those
+#      cells are marked as inferred. Nothing is inferred from a user reading
+#      what a class reads, a partial row cannot show the user is not higher.
+#      This holds for meters whose access levels nest, as C12.19 password
+#      levels do; set prune off for meters where they do not.
+# Finished rows are appended to a journal so a scan can be resumed.
+#
+# Journal lines:
+#   # <header>
+#   <user> <cells hex> <inferred hex>
+
+import os, time
+import array
+import hashlib
+import binascii
+import c12_18_checkpoint as c12checkpoint
+
+######################################
+# VARIABLES - These values will not change
+######################################
+# Cell values
+CELL_UNKNOWN  = 0           # Not tested or the meter did not give a clear answer
+CELL_OK       = 1
+CELL_ISC      = 2
+CELL_SNS      = 3
+CELL_NAMES    = ('-', 'ok', 'isc', 'sns')
+
+# Response codes
+CODE_OK       = 0
+CODE_SNS      = 2
+CODE_ISC      = 3
+
+RELOGON_TRIES = 3           # Logon attempts per user after a dropped session
+######################################
+
+class ACCESS_MATRIX:
+    def __init__(self, users, tables):
+        '''
+        User x table matrix of two bit cells, four cells to a byte. users and tables are
+        lists of numbers. inferred has one bit per cell for cells that were not read.
+        '''
+        self.users    = list(users)
+        self.tables   = list(tables)
+        self.user_idx = dict([(user, cnt) for cnt, user in enumerate(self.users)])
+        self.rowlen   = (len(self.tables) + 3) / 4
+        self.cells    = array.array('B', [0]) * (self.rowlen * len(self.users))
+        self.flaglen  = (len(self.tables) + 7) / 8
+        self.inferred = array.array('B', [0]) * (self.flaglen * len(self.users))
+
+    def get(self, user, tidx):
+        '''Return the cell of user for the table at tidx in tables.'''
+        pos = self.user_idx[user] * self.rowlen + tidx / 4
+        return (self.cells[pos] >> ((tidx % 4) * 2)) & 3
+
+    def set(self, user, tidx, cell, inferred = False):
+        pos   = self.user_idx[user] * self.rowlen + tidx / 4
+        shift = (tidx % 4) * 2
+        self.cells[pos] = (self.cells[pos] & ~(3 << shift) & 0xff) | (cell << shift)
+        pos = self.user_idx[user] * self.flaglen + tidx / 8
+        if inferred:
+            self.inferred[pos] |= 1 << (tidx % 8)
+        else:
+            self.inferred[pos] &= ~(1 << (tidx % 8)) & 0xff
+
+    def is_inferred(self, user, tidx):
+        pos = self.user_idx[user] * self.flaglen + tidx / 8
+        return bool(self.inferred[pos] & (1 << (tidx % 8)))
+
+    def row(self, user):
+        '''Return the cells of user as a tuple, one per table.'''
+        return tuple([self.get(user, tidx) for tidx in range(len(self.tables))])
+
+    def row_bytes(self, user):
+        '''Return the packed cells and inferred flags of user.'''
+        idx = self.user_idx[user]
+        return (self.cells[idx * self.rowlen:(idx + 1) * self.rowlen].tostring(),
+                self.inferred[idx * self.flaglen:(idx + 1) * self.flaglen].tostring())
+
+    def set_row_bytes(self, user, cells, inferred):
+        idx = self.user_idx[user]
+        self.cells[idx * self.rowlen:(idx + 1) * self.rowlen] = array.array('B', cells)
+        self.inferred[idx * self.flaglen:(idx + 1) * self.flaglen] = array.array('B', inferred)
+
+    def classes(self, users = None):
+        '''Return [row, [users]] for each distinct row, in order of first appearance.'''
+        found = []
+        index = {}
+        if users == None:
+            users = self.users
+        for user in users:
+            row = self.row(user)
+            if row not in index:
+                index[row] = len(found)
+                found.append([row, []])
+            found[index[row]][1].append(user)
+        return found
+
+def user_ranges(users):
+    '''Return a list of users as ranges: 0-15,20,30-31.'''
+    ranges = []
+    for user in sorted(users):
+        if ranges and ranges[-1][1] == user - 1:
+            ranges[-1][1] = user
+        else:
+            ranges.append([user, user])
+    return ','.join([str(e[0]) if e[0] == e[1] else '%d-%d' % (e[0], e[1]) for e in ranges])
+
+class ACCESS_SCAN:
+    def __init__(self, packet, ser_conn, passwd, users, tables, journal_dir = None, meter = '', onf = None):
+        '''
+        Access matrix scan of users x tables with one security code. run() scans the users not
+        in the journal and returns the ACCESS_MATRIX.
+        '''
+        self.packet    = packet
+        self.ser_conn  = ser_conn
+        self.passwd    = passwd
+        self.matrix    = ACCESS_MATRIX(users, tables)
+        self.meter     = meter
+        self.onf       = onf
+        self.debug     = False
+        self.prune     = True       # Infer cells from the privilege classes found so far
+        self.relogon   = True       # Logoff and logon in one session, cleared if the meter refuses it
+        self.partial   = None       # One byte partial reads work, None until tested
+        self.session   = False      # Logged on
+        self.ready     = False      # Ident and negotiate done
+        self.done      = set()      # Users with a finished row
+        self.rows      = {}         # Privilege classes: distinct finished rows
+        self.sns       = set()      # Table indices the meter does not have
+        self.reads     = 0          # Table reads sent
+        self.pruned    = 0          # Cells inferred without a read
+        self.denied    = []         # Users the meter would not log on
+        self.journal   = None
+        self.jnf       = None
+        if journal_dir:
+            key = c12checkpoint.journal_key(meter, user_ranges(users), hashlib.sha1(','.join([str(e) for e in tables])).hexdigest())
+            self.journal = os.path.join(journal_dir, 'access_' + key + c12checkpoint.JOURNAL_EXT)
+
+    def log(self, line):
+        print line
+        if self.onf: self.onf.write(line + "\n")
+
+    def load(self):
+        '''Read finished rows from the journal. Returns the number of users already scanned.'''
+        if not self.journal or not os.path.isfile(self.journal):
+            return 0
+        inf = open(self.journal, 'rb')
+        for line in inf:
+            # A crash can leave a torn last line without its newline
+            if not line.endswith('\n') or line.startswith('#'):
+                continue
+            fields = line.split()
+            if len(fields) != 3:
+                continue
+            try:
+                user     = int(fields[0])
+                cells    = binascii.a2b_hex(fields[1])
+                inferred = binascii.a2b_hex(fields[2])
+            except (ValueError, TypeError):
+                continue
+            if user not in self.matrix.user_idx or len(cells) != self.matrix.rowlen or len(inferred) != self.matrix.flaglen:
+                continue
+            self.matrix.set_row_bytes(user, cells, inferred)
+            self.done.add(user)
+        inf.close()
+        for user in self.done:
+            row = self.matrix.row(user)
+            self.rows[row] = True
+            for tidx in range(len(row)):
+                if row[tidx] == CELL_SNS:
+                    self.sns.add(tidx)
+        return len(self.done)
+
+    def record(self, user):
+        '''Append the row of user to the journal.'''
+        self.done.add(user)
+        if user not in self.denied:
+            self.rows[self.matrix.row(user)] = True
+        if not self.journal:
+            return
+        if not self.jnf:
+            new = not os.path.isfile(self.journal)
+            self.jnf = open(self.journal, 'ab')
+            if new:
+                self.jnf.write('# C12.18 access matrix journal meter=%s users=%s tables=%s started=%s\n' % (self.meter,
+                        user_ranges(self.matrix.users), ','.join([str(e) for e in self.matrix.tables]), time.strftime('%Y%m%d%H%M%S')))
+        cells, inferred = self.matrix.row_bytes(user)
+        self.jnf.write('%d %s %s\n' % (user, binascii.b2a_hex(cells), binascii.b2a_hex(inferred)))
+        self.jnf.flush()
+        os.fsync(self.jnf.fileno())
+
+    def remove(self):
+        '''Delete the journal and forget the rows read from it to start the scan over.'''
+        self.close()
+        if self.journal and os.path.isfile(self.journal):
+            os.remove(self.journal)
+        self.matrix = ACCESS_MATRIX(self.matrix.users, self.matrix.tables)
+        self.done   = set()
+        self.rows   = {}
+        self.sns    = set()
+
+    def close(self):
+        if self.jnf:
+            self.jnf.close()
+            self.jnf = None
+
+    def logon(self, user):
+        '''Log on as user, inside the open session if the meter allows it. Returns success (True),
+            refused (False), or no answer (None).'''
+        retry = False
+        if self.session and self.relogon:
+            if self.packet.send_logoff(self.ser_conn):
+                self.session = False
+                if self.packet.login_seq_passwd(self.ser_conn, user, self.passwd):
+                    self.session = True
+                    return True
+                # Could be the user or the meter, a new session tells which
+                retry = self.packet.last_result.code != None
+            else:
+                self.relogon = False
+        if self.session or self.ready:
+            self.packet.send_terminate(self.ser_conn)
+            self.session = False
+            self.ready = False
+        if not self.packet.login_setup(self.ser_conn):
+            return None
+        self.ready = True
+        if self.packet.login_seq_passwd(self.ser_conn, user, self.passwd):
+            self.session = True
+            if retry:
+                self.log("access: meter refuses a second logon in one session, starting a session per user")
+                self.relogon = False
+            return True
+        if self.packet.last_result.code == None:
+            return None
+        return False
+
+    def test(self, table):
+        '''Read table and return its cell, or None if the meter did not answer.'''
+        self.reads += 1
+        if self.partial != False:
+            result = self.packet.partial_table_read(self.ser_conn, table, 0, 1)
+            if result.code in (CODE_OK, CODE_ISC):
+                self.partial = True
+                return (CELL_OK, CELL_ISC)[result.code == CODE_ISC]
+            if self.partial == None and result.code != None:
+                # Table 01 is in every meter, see if partial reads are the problem
+                check = self.packet.partial_table_read(self.ser_conn, 1, 0, 1)
+                self.partial = check.code in (CODE_OK, CODE_ISC)
+                if self.debug: print "access: partial reads", ("off", "on")[self.partial]
+            if result.code == None:
+                return None
+        # Empty tables and meters without partial reads need the whole table
+        result = self.packet.full_table_read(self.ser_conn, table)
+        if result.code == None:
+            return None
+        return {CODE_OK:CELL_OK, CODE_ISC:CELL_ISC, CODE_SNS:CELL_SNS}.get(result.code, CELL_UNKNOWN)
+
+    def order(self, classes):
+        '''Return table indices to read: tables some class can read first, so the classes this
+            user is below are known before anything is pruned.'''
+        ntables = len(self.matrix.tables)
+        readable = [tidx for tidx in range(ntables) if [row for row in classes if row[tidx] == CELL_OK]]
+        return readable + [tidx for tidx in range(ntables) if tidx not in readable]
+
+    def covered(self, classes, row, tidx):
+        '''Return True if a class that cannot read tidx can read a table row was refused. With
+            nested access levels row is below that class and cannot read tidx either.'''
+        for known in classes:
+            if known[tidx] != CELL_ISC:
+                continue
+            for cnt in range(len(known)):
+                if known[cnt] == CELL_OK and row[cnt] == CELL_ISC:
+                    return True
+        return False
+
+    def scan_user(self, user):
+        '''Fill the row of user. Returns False if the meter stopped answering.'''
+        for cnt in range(RELOGON_TRIES):
+            ok = self.logon(user)
+            if ok != None:
+                break
+            self.session = False
+            self.ready = False
+            self.packet.end_session(self.ser_conn)
+        if ok == None:
+            return False
+        if not ok:
+            # Refused with this security code, the user cannot read anything
+            self.denied.append(user)
+            for tidx in range(len(self.matrix.tables)):
+                self.matrix.set(user, tidx, CELL_ISC, tidx not in self.sns)
+            return True
+
+        classes  = []
+        if self.prune:
+            classes = self.rows.keys()
+        for tidx in self.order(classes):
+            if tidx in self.sns:
+                self.matrix.set(user, tidx, CELL_SNS, True)
+                continue
+            if self.prune and self.covered(classes, self.matrix.row(user), tidx):
+                self.matrix.set(user, tidx, CELL_ISC, True)
+                self.pruned += 1
+                continue
+            cell = self.test(self.matrix.tables[tidx])
+            if cell == None:
+                # Dropped the session, log on again and carry on with this table
+                self.session = False
+                self.ready = False
+                self.packet.end_session(self.ser_conn)
+                if not self.logon(user):
+                    return False
+                cell = self.test(self.matrix.tables[tidx])
+                if cell == None:
+                    return False
+            self.matrix.set(user, tidx, cell)
+            if cell == CELL_SNS:
+                self.sns.add(tidx)
+        return True
+
+    def run(self, ready = False):
+        '''Scan every user not in the journal. ready means ident and negotiate were sent.
+            Returns the ACCESS_MATRIX.'''
+        self.ready = ready
+        try:
+            for user in self.matrix.users:
+                if user in self.done:
+                    continue
+                if self.debug: print "access: user", user
+                if not self.scan_user(user):
+                    self.log("access: meter stopped answering at user %d" % user)
+                    break
+                self.record(user)
+        except KeyboardInterrupt:
+            self.log("access: stopped")
+        if self.session or self.ready:
+            self.packet.send_terminate(self.ser_conn)
+            self.session = False
+            self.ready = False
+        self.close()
+        return self.matrix
+
+    def report(self):
+        '''Return printable lines: one line per privilege class.'''
+        lines = ["Access: %d users, %d tables, %d reads, %d cells inferred" % (len(self.done), len(self.matrix.tables), self.reads, self.pruned)]
+        if self.denied:
+            lines.append("    Logon refused: %s" % user_ranges(self.denied))
+        users = [user for user in self.matrix.users if user in self.done]
+        for row, members in self.matrix.classes(users):
+            lines.append("    Users %s" % user_ranges(members))
+            for cell in (CELL_OK, CELL_ISC, CELL_SNS, CELL_UNKNOWN):
+                tables = [str(self.matrix.tables[tidx]) for tidx in range(len(row)) if row[tidx] == cell]
+                if tables:
+                    lines.append("        %-3s: %s" % (CELL_NAMES[cell], ','.join(tables)))
+        return lines
+
+if __name__ == "__main__":
+
+    # Check pruning against a meter with nested access levels: users 0-15, level is user / 4,
+    # table n needs level n / 2. Every cell, read or inferred, must match the meter.
+    class RESULT:
+        def __init__(self, code):
+            self.code = code
+
+    class NESTED:
+        def __init__(self):
+            self.level = None
+            self.last_result = RESULT(CODE_OK)
+        def login_setup(self, ser_conn):
+            return True
+        def login_seq_passwd(self, ser_conn, user, passwd):
+            self.level = user / 4
+            return True
+        def send_logoff(self, ser_conn):
+            self.level = None
+            return True
+        def send_terminate(self, ser_conn):
+            self.level = None
+        def end_session(self, ser_conn):
+            self.level = None
+        def full_table_read(self, ser_conn, table):
+            return RESULT((CODE_OK, CODE_ISC)[table / 2 > self.level])
+        partial_table_read = lambda self, ser_conn, table, offset, count: self.full_table_read(ser_conn, table)
+
+    # Lowest users first finds nothing to prune, highest first prunes the lower levels
+    tables = range(8)
+    for users in (range(16), range(15, -1, -1)):
+        scan = ACCESS_SCAN(NESTED(), None, '', users, tables)
+        matrix = scan.run(ready = True)
+        wrong = 0
+        for user in matrix.users:
+            for tidx in range(len(tables)):
+                if matrix.get(user, tidx) != (CELL_OK, CELL_ISC)[tables[tidx] / 2 > user / 4]:
+                    wrong += 1
+        for line in scan.report():
+            print line
+        print "Wrong cells:", wrong
@@ -0,0 +1,143 @@
+# c12_18_catalog.py - python module for caching the tables and procedures a
+# meter lists in its Configuration Table (Table 00).
+#
+# Copyright (c) 2011, InGuardians, Inc. <consulting@inguardians.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Point Of Contact:    Don C. Weber <don@inguardians.com>
+
+# Table 00 lists the standard and manufacturer tables and procedures a meter
+# implements. The catalog keeps those lists for each meter, keyed by the
+# manufacturer and serial number from Table 01, so Table 00 is read once per
+# meter and the multi-table and procedure actions can skip everything the
+# meter has already said it does not implement. Catalogs are saved with the
+# pacing and lockout profiles in the log directory.
+
+import os, time
+import json
+import c12_18_table00_parser as c12tbl00
+
+######################################
+# VARIABLES - These values will not change
+######################################
+CATALOGS = {}
+######################################
+
+class CATALOG:
+    def __init__(self, meter):
+        '''
+        Tables and procedures one meter lists in Table 00.
+        '''
+        self.meter      = meter
+        self.tables     = set()     # Standard and manufacturer tables used
+        self.procs      = set()     # Standard and manufacturer procedures used
+        self.writable   = set()     # Tables that can be written
+        self.version    = None      # [std_version_no, std_revision_no]
+        self.read_time  = 0         # When Table 00 was read
+
+    def load_table00(self, table00):
+        '''Fill the catalog from a decoded TABLE00.'''
+        self.tables    = table00.tables
+        self.procs     = table00.procs
+        self.writable  = table00.writable
+        self.version   = [table00['std_version_no'], table00['std_revision_no']]
+        self.read_time = time.time()
+
+    def is_readable(self, table):
+        return table in self.tables
+
+    def is_writable(self, table):
+        return table in self.writable
+
+    def is_proc(self, proc):
+        return proc in self.procs
+
+    def filter_tables(self, tables):
+        '''Return [listed, skipped] for a list of table numbers.'''
+        return [[e for e in tables if e in self.tables], [e for e in tables if e not in self.tables]]
+
+    def filter_procs(self, procs):
+        '''Return [listed, skipped] for a list of procedure numbers.'''
+        return [[e for e in procs if e in self.procs], [e for e in procs if e not in self.procs]]
+
+    def profile(self):
+        '''Return the catalog as a dictionary for saving.'''
+        return {'tables':sorted(self.tables), 'procs':sorted(self.procs), 'writable':sorted(self.writable),
+                'version':self.version, 'read_time':self.read_time}
+
+    def load(self, profile):
+        '''Restore a saved catalog.'''
+        self.tables    = set(profile.get('tables', []))
+        self.procs     = set(profile.get('procs', []))
+        self.writable  = set(profile.get('writable', []))
+        self.version   = profile.get('version')
+        self.read_time = profile.get('read_time', 0)
+
+def get_catalog(meter):
+    '''Return the catalog for a meter identity or None if Table 00 has not been read.'''
+    return CATALOGS.get(meter)
+
+def add_catalog(meter, data):
+    '''Build and keep the catalog for a meter from Table 00 data. Returns the catalog or None
+        if the data does not parse or lists no tables.'''
+    table00 = c12tbl00.parse_table00(data)
+    if not table00 or not table00.tables:
+        return None
+    catalog = CATALOG(meter)
+    catalog.load_table00(table00)
+    CATALOGS[meter] = catalog
+    return catalog
+
+def read_catalog(packet, ser_conn, meter, refresh = False):
+    '''Return the catalog for meter, reading Table 00 the first time the meter is seen or when
+        refresh is set. Returns None if the meter is not known and Table 00 cannot be read.'''
+    if not meter:
+        return None
+    catalog = get_catalog(meter)
+    if catalog and not refresh:
+        return catalog
+    results = packet.full_table_read(ser_conn, 0)
+    if not results[0]:
+        return catalog
+    return add_catalog(meter, packet.parse_rtn_data(results[1])[2]) or catalog
+
+def load_catalogs(filename):
+    '''Load saved catalogs. Returns success (1) or failure (0)'''
+    if not os.path.isfile(filename):
+        return 0
+    try:
+        catalogs = json.load(open(filename, 'r'))
+    except (IOError, ValueError):
+        print "load_catalogs: Could not parse catalogs:", filename
+        return 0
+    for meter in catalogs:
+        catalog = CATALOG(meter)
+        catalog.load(catalogs[meter])
+        CATALOGS[meter] = catalog
+    return 1
+
+def save_catalogs(filename):
+    '''Save catalogs. Returns success (1) or failure (0)'''
+    catalogs = {}
+    for meter in CATALOGS.keys():
+        catalogs[meter] = CATALOGS[meter].profile()
+    try:
+        onf = open(filename, 'w')
+        json.dump(catalogs, onf, indent = 1, sort_keys = True)
+        onf.close()
+    except (IOError, ValueError):
+        print "save_catalogs: Could not write catalogs:", filename
+        return 0
+    return 1
@@ -0,0 +1,179 @@
+# c12_18_checkpoint.py - python module for saving and resuming the progress
+# of brute force logon runs.
+#
+# Copyright (c) 2011, InGuardians, Inc. <consulting@inguardians.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Point Of Contact:    Don C. Weber <don@inguardians.com>
+
+# Every attempt is appended to a journal file named from the meter identity,
+# the user number, and the digest of the password list. The journal is
+# flushed and fsync'd every few attempts, so after a crash, a serial hiccup,
+# or a Ctrl-C the run can continue from the last attempt written. A line
+# torn by a crash is ignored when the journal is read back. Attempts that
+# ended in a communication error were not tested, resume() tries them again
+# before going on past the last attempt.
+#
+# Journal lines:
+#   # <header>
+#   <index> <result> <password hex> <control toggle>
+
+import os, time
+import hashlib
+import binascii
+
+######################################
+# VARIABLES - These values will not change
+######################################
+JOURNAL_BATCH = 16          # Attempts between fsyncs
+JOURNAL_EXT   = '.journal'
+
+# Attempt results
+ATTEMPT_FAIL  = 'fail'      # Meter refused the password
+ATTEMPT_OK    = 'ok'        # Meter accepted the password
+ATTEMPT_ERR   = 'err'       # Communication error, the password was not tested
+######################################
+
+def list_digest(filename, blocksize = 65536):
+    '''Return the SHA1 digest of a password list file.'''
+    digest = hashlib.sha1()
+    inf = open(filename, 'rb')
+    while True:
+        data = inf.read(blocksize)
+        if not data:
+            break
+        digest.update(data)
+    inf.close()
+    return digest.hexdigest()
+
+def journal_key(meter, user, digest):
+    '''Return the journal name for a meter, user number, and password list digest.'''
+    return hashlib.sha1('%s|%s|%s' % (meter, user, digest)).hexdigest()[:16]
+
+class CHECKPOINT:
+    def __init__(self, directory, meter, user, digest, batch = JOURNAL_BATCH):
+        '''
+        Journal of a brute force run against one meter and user with one password list.
+        load() returns the index after the last attempt, resume() yields the passwords
+        still to try, and record() adds an attempt.
+        '''
+        self.meter     = meter
+        self.user      = user
+        self.digest    = digest
+        self.batch     = batch
+        self.filename  = os.path.join(directory, 'brute_' + journal_key(meter, user, digest) + JOURNAL_EXT)
+        self.cursor    = 0          # Index after the last attempt
+        self.errors    = set()      # Indexes below cursor that were not tested
+        self.seq       = None       # Control toggle after the last attempt
+        self.found     = None       # Password that worked
+        self.attempts  = 0          # Attempts in the journal
+        self.pending   = 0          # Attempts written since the last fsync
+        self.onf       = None
+
+    def load(self):
+        '''Read the journal if there is one. Returns the index after the last attempt.'''
+        if not os.path.isfile(self.filename):
+            return self.cursor
+        inf = open(self.filename, 'rb')
+        for line in inf:
+            # A crash can leave a torn last line without its newline
+            if not line.endswith('\n') or line.startswith('#'):
+                continue
+            fields = line.split()
+            if len(fields) != 4:
+                continue
+            try:
+                idx = int(fields[0])
+                seq = int(fields[3])
+                passwd = binascii.a2b_hex(fields[2])
+            except (ValueError, TypeError):
+                continue
+            self.attempts += 1
+            self.note(idx, fields[1])
+            self.seq = seq
+            if fields[1] == ATTEMPT_OK:
+                self.found = passwd
+        inf.close()
+        return self.cursor
+
+    def note(self, idx, result):
+        '''Move the cursor past an attempt. An attempt that was not tested is kept to try again.'''
+        if result == ATTEMPT_ERR:
+            self.errors.add(idx)
+        else:
+            self.errors.discard(idx)
+        self.cursor = max(self.cursor, idx + 1)
+
+    def resume(self, source):
+        '''Yield [idx, password] from a source: first the attempts that were not tested,
+            then everything after the last attempt.'''
+        for idx in sorted(self.errors):
+            for entry in source.iterate(idx, idx + 1):
+                yield entry
+        for entry in source.iterate(self.cursor):
+            yield entry
+
+    def open(self):
+        '''Open the journal for appending. Writes a header for a new journal.'''
+        new = not os.path.isfile(self.filename)
+        self.onf = open(self.filename, 'ab')
+        if new:
+            self.onf.write('# C12.18 brute force journal meter=%s user=%s digest=%s started=%s\n' % (self.meter, self.user, self.digest, time.strftime('%Y%m%d%H%M%S')))
+        else:
+            self.onf.write('# resumed=%s cursor=%d\n' % (time.strftime('%Y%m%d%H%M%S'), self.cursor))
+        self.sync()
+
+    def record(self, idx, passwd, result, seq):
+        '''Add an attempt to the journal. The journal is fsync'd every batch attempts and
+            whenever a password works.'''
+        if not self.onf:
+            self.open()
+        self.onf.write('%d %s %s %d\n' % (idx, result, binascii.b2a_hex(passwd), seq))
+        self.attempts += 1
+        self.pending  += 1
+        self.seq       = seq
+        self.note(idx, result)
+        if result == ATTEMPT_OK:
+            self.found = passwd
+            self.sync()
+        elif self.pending >= self.batch:
+            self.sync()
+
+    def sync(self):
+        '''Flush the journal to disk.'''
+        if not self.onf:
+            return
+        self.onf.flush()
+        os.fsync(self.onf.fileno())
+        self.pending = 0
+
+    def close(self):
+        '''Flush and close the journal.'''
+        if not self.onf:
+            return
+        self.sync()
+        self.onf.close()
+        self.onf = None
+
+    def remove(self):
+        '''Delete the journal to start the run over.'''
+        self.close()
+        if os.path.isfile(self.filename):
+            os.remove(self.filename)
+        self.cursor   = 0
+        self.errors   = set()
+        self.seq      = None
+        self.found    = None
+        self.attempts = 0
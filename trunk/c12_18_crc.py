@@ -0,0 +1,151 @@
+# c12_18_crc.py - python module for computing the C12.18 packet CRC.
+#
+# Copyright (c) 2011, InGuardians, Inc. <consulting@inguardians.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Point Of Contact:    Don C. Weber <don@inguardians.com>
+
+# C12.18 uses the CRC-16 X.25 settings (same as crcmod.predefined 'x-25'):
+#   reflected polynomial 0x8408, initial value 0xffff, final xor 0xffff
+# The CRC is sent Little Endian after the <data> of the packet.
+
+import struct
+
+######################################
+# VARIABLES - These values will not change
+######################################
+CRC_POLY    = 0x8408    # Reflected 0x1021
+CRC_INIT    = 0xffff
+CRC_XOROUT  = 0xffff
+# Running a packet's CRC over the packet AND its Little Endian CRC
+# always leaves this value in the register (before the final xor).
+CRC_RESIDUE = 0xf0b8
+######################################
+
+def _build_table():
+    '''Precompute the 256 entry lookup table for the reflected polynomial.'''
+    table = []
+    for byte in range(256):
+        crc = byte
+        for cnt in range(8):
+            if crc & 1:
+                crc = (crc >> 1) ^ CRC_POLY
+            else:
+                crc >>= 1
+        table.append(crc)
+    return tuple(table)
+
+CRC_TABLE = _build_table()
+
+def crc_init():
+    '''Return the starting value of a CRC register.'''
+    return CRC_INIT
+
+def crc_update(crc, data, start = 0, end = None):
+    '''Run data through the CRC register and return the new register value. Data can
+    be a string, bytearray, or anything bytearray() accepts. Strings are not copied when
+    start and end select a region of a bytearray.'''
+    if not isinstance(data, bytearray):
+        data = bytearray(data)
+    if end == None:
+        end = len(data)
+    table = CRC_TABLE
+    for cnt in xrange(start, end):
+        crc = (crc >> 8) ^ table[(crc ^ data[cnt]) & 0xff]
+    return crc
+
+def crc_final(crc):
+    '''Return the CRC value for a CRC register.'''
+    return crc ^ CRC_XOROUT
+
+def crc16(*bufs):
+    '''Return the C12.18 CRC value of one or more buffers without joining them.'''
+    crc = CRC_INIT
+    for buf in bufs:
+        crc = crc_update(crc, buf)
+    return crc ^ CRC_XOROUT
+
+def crc_bytes(*bufs):
+    '''Return the C12.18 CRC of one or more buffers packed in Little Endian order.'''
+    return struct.pack('<H', crc16(*bufs))
+
+class CRC16:
+    def __init__(self, data = None):
+        '''
+        Incremental C12.18 CRC. Update with the header, data, and segment buffers
+        as they become available and read the value at the end.
+        '''
+        self.reg = CRC_INIT
+        if data != None:
+            self.update(data)
+
+    def reset(self):
+        '''Start a new CRC.'''
+        self.reg = CRC_INIT
+
+    def update(self, data, start = 0, end = None):
+        '''Add data to the CRC.'''
+        self.reg = crc_update(self.reg, data, start, end)
+        return self
+
+    def value(self):
+        '''Return the CRC value.'''
+        return self.reg ^ CRC_XOROUT
+
+    def digest(self):
+        '''Return the CRC packed in Little Endian order, as sent in a packet.'''
+        return struct.pack('<H', self.reg ^ CRC_XOROUT)
+
+    def copy(self):
+        '''Return a CRC with the same register value. Used to keep precomputed headers.'''
+        tmp = CRC16()
+        tmp.reg = self.reg
+        return tmp
+
+def check_frame(frame):
+    '''Test a full packet (header, data, and CRC). Returns success (1) or failure (0)'''
+    if len(frame) < 3:
+        return 0
+    if crc_update(CRC_INIT, frame) == CRC_RESIDUE:
+        return 1
+    return 0
+
+def check_frames(frames):
+    '''Test a list of full packets (header, data, and CRC) such as captured packets.
+    Returns a list with success (1) or failure (0) for each packet.'''
+    table   = CRC_TABLE
+    results = []
+    for frame in frames:
+        if len(frame) < 3:
+            results.append(0)
+            continue
+        crc = CRC_INIT
+        for byte in bytearray(frame):
+            crc = (crc >> 8) ^ table[(crc ^ byte) & 0xff]
+        if crc == CRC_RESIDUE:
+            results.append(1)
+        else:
+            results.append(0)
+    return results
+
+if __name__ == "__main__":
+
+    # Verify against the known packets in c12_18_tables.py
+    import c12_18_tables as c12tables
+    import byte_tools as bt
+
+    frames = c12tables.ident + c12tables.nego + c12tables.logoff + c12tables.term + c12tables.ok_r
+    for frame, result in zip(frames, check_frames(frames)):
+        print bt.print_data(frame), result
@@ -0,0 +1,458 @@
+# c12_18_fuzzer.py - python module for mutation fuzzing C12.18 services.
+#
+# Copyright (c) 2011, InGuardians, Inc. <consulting@inguardians.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Point Of Contact:    Don C. Weber <don@inguardians.com>
+
+# Each family of mutations is a generator of request data and the session
+# state it has to be sent in: right after ident and negotiate, logged on as
+# a user, or fully authenticated. Every response is reduced to a signature
+# of service, response code, response length, and timing bucket. A family
+# that keeps producing signatures already seen is picked less often, one
+# that finds a new signature is picked more, so the run spends its time
+# where the meter behaves differently. The first request to produce each
+# signature is kept as the example for that cluster.
+#
+# Table and procedure families run in one authenticated session that is kept
+# for the whole run. A request that gets no answer is followed by a wait
+# request: if the meter answers it only ignored the request (a hang) and the
+# session goes on, otherwise the meter reset and is logged on again before
+# fuzzing continues.
+
+import time
+import math
+import random
+import struct
+import byte_tools as bt
+import c12_18_packet as c12packet
+
+######################################
+# VARIABLES - These values will not change
+######################################
+# Session state a family needs
+STATE_DIRTY   = 0           # Session open in an unknown state
+STATE_SETUP   = 1           # After ident and negotiate
+STATE_USER    = 2           # After logon
+STATE_AUTH    = 3           # After logon and security
+
+# Family weights
+WEIGHT_START  = 1.0
+WEIGHT_NEW    = 2.0         # Added when a family finds a new signature
+WEIGHT_DECAY  = 0.8         # Multiplied when a family repeats a signature
+WEIGHT_MIN    = 0.02        # Families never drop out completely
+
+# Response timing buckets, upper bounds as multiples of the usual response time. Serial
+# timing jitters too much for absolute buckets to mean anything.
+TIME_BUCKETS  = (2.0, 5.0)
+TIME_AVERAGE  = 0.1         # Weight of each answer in the usual response time
+
+FUZZ_RETRIES  = 1           # Resends per fuzz request, silence is a result not a glitch
+FUZZ_SILENT   = 2           # Read timeouts before a request counts as unanswered
+MAX_FUZZ_LEN  = 255         # Longest mutated field
+FUZZ_ATTEMPTS = 1000        # Default number of mutations per run
+REPORT_EVERY  = 50          # Attempts between throughput reports
+RECOVER_TRIES = 5           # Logon attempts after a reset or hang
+RECOVER_WAIT  = 2.0         # First wait between recovery attempts, doubles
+
+# Response codes that leave the session as it was
+KEEP_CODES    = (1, 2, 3, 4, 5, 6, 7, 8)   # err, sns, isc, onp, iar, bsy, dnr, dlk
+
+# Interesting values
+INT_BYTES     = '\x00\x01\x20\x30\x7f\x80\xfe\xff'
+INT_WORDS     = (0, 1, 2, 3, 0x7f, 0x80, 0xff, 0x100, 0x7fff, 0x8000, 0xfffe, 0xffff)
+INT_OFFSETS   = (0, 1, 0x7f, 0x80, 0xff, 0x100, 0x7fff, 0x8000, 0xffff, 0x10000, 0x7fffff, 0x800000, 0xfffffe, 0xffffff)
+INT_STRINGS   = ('', ' ' * 10, '\x00' * 10, '\xff' * 10, '%s%s%s%n', 'A' * 32, '0123456789', '\x20\x00' * 5)
+######################################
+
+def time_bucket(elapsed, usual):
+    '''Return the timing bucket of a response compared to the usual response time.'''
+    if not usual:
+        return 0
+    for cnt in range(len(TIME_BUCKETS)):
+        if elapsed < usual * TIME_BUCKETS[cnt]:
+            return cnt
+    return len(TIME_BUCKETS)
+
+def length_bucket(length):
+    '''Return a length class: exact for short responses, powers of two above that.'''
+    if length <= 4:
+        return length
+    return 1 << int(math.ceil(math.log(length, 2)))
+
+def signature(service, result, usual = None):
+    '''Return the signature of a response: service, response code, length, and timing.'''
+    if result.code == None:
+        return (service, 'none', 0, 0)
+    return (service, result.code_abbr(), length_bucket(len(result.data)), time_bucket(result.elapsed, usual))
+
+class FAMILY:
+    def __init__(self, name, service, state, generator, once = False):
+        '''
+        A family of mutations. generator yields request data (p_data). once means a request
+        leaves the session unusable for the next one, such as a second logon.
+        '''
+        self.name      = name
+        self.service   = service
+        self.state     = state
+        self.generator = generator
+        self.once      = once
+        self.weight    = WEIGHT_START
+        self.sent      = 0
+        self.found     = 0      # New signatures found
+
+class CLUSTER:
+    def __init__(self, sig, family, data, result):
+        '''
+        Responses with one signature and the first request that produced it.
+        '''
+        self.sig     = sig
+        self.family  = family
+        self.data    = data
+        self.resp    = result.data
+        self.count   = 1
+        self.first   = time.time()
+
+class FUZZER:
+    def __init__(self, packet, ser_conn, user = 2, passwd = c12packet.space_passwd, seed = None, onf = None):
+        '''
+        Mutation fuzzer. add() families, then run(). Families are picked by weight.
+        '''
+        self.packet    = packet
+        self.ser_conn  = ser_conn
+        self.user      = user
+        self.passwd    = passwd
+        self.rand      = random.Random(seed)
+        self.families  = []
+        self.clusters  = {}         # Signature -> CLUSTER
+        self.state     = None       # Current session state
+        self.attempts  = 0
+        self.usual     = None       # Moving average of the time to an answer
+        self.resets    = 0          # Times the meter stopped answering and had to be logged on again
+        self.hangs     = 0          # Requests ignored by a meter that kept the session
+        self.started   = None
+        self.onf       = onf
+        self.debug     = False
+
+    def add(self, family):
+        self.families.append(family)
+
+    def log(self, line):
+        print line
+        if self.onf: self.onf.write(line + "\n")
+
+    def pick(self):
+        '''Pick a family at random by weight.'''
+        total = sum([family.weight for family in self.families])
+        point = self.rand.random() * total
+        for family in self.families:
+            point -= family.weight
+            if point <= 0:
+                return family
+        return self.families[-1]
+
+    def reach(self, state):
+        '''Get the session to state, starting over if it is past it. Returns success (True) or
+            failure (False)'''
+        if self.state == state:
+            return True
+        if self.state != None:
+            self.packet.send_terminate(self.ser_conn)
+            self.state = None
+        if not self.packet.login_setup(self.ser_conn):
+            return False
+        self.state = STATE_SETUP
+        if state >= STATE_USER:
+            if not self.packet.login_user(self.ser_conn, self.user):
+                return False
+            self.state = STATE_USER
+        if state >= STATE_AUTH:
+            if not self.packet.login_passwd(self.ser_conn, self.passwd):
+                return False
+            self.state = STATE_AUTH
+        return True
+
+    def recover(self, state):
+        '''The meter reset or hung. Keep trying to get back to state with growing waits.
+            Returns success (True) or failure (False)'''
+        self.resets += 1
+        wait = RECOVER_WAIT
+        for cnt in range(RECOVER_TRIES):
+            self.state = None
+            self.packet.end_session(self.ser_conn)
+            if self.reach(state):
+                self.log("fuzz: meter recovered after %d tries" % (cnt + 1))
+                return True
+            time.sleep(wait)
+            wait *= 2
+        return False
+
+    def alive(self):
+        '''Return True if the meter still answers in the current session.'''
+        return self.packet.send_wait(self.ser_conn, silent = FUZZ_SILENT)
+
+    def send(self, family, data):
+        '''Send one mutated request and return its C1218_result.'''
+        self.packet.reset_packet(ctrl = self.packet.seq)
+        self.packet.p_data = data
+        return self.packet.execute(self.ser_conn, family.service, retries = FUZZ_RETRIES, silent = FUZZ_SILENT)
+
+    def classify(self, family, data, result):
+        '''Cluster a response and adjust the family weight. Returns True for a new signature.'''
+        sig = signature(family.service, result, self.usual)
+        if result.code != None and result.attempts == 1:
+            if self.usual == None:
+                self.usual = result.elapsed
+            else:
+                self.usual += (result.elapsed - self.usual) * TIME_AVERAGE
+        if sig in self.clusters:
+            self.clusters[sig].count += 1
+            family.weight = max(WEIGHT_MIN, family.weight * WEIGHT_DECAY)
+            return False
+        self.clusters[sig] = CLUSTER(sig, family.name, data, result)
+        family.found += 1
+        family.weight += WEIGHT_NEW
+        self.log("fuzz: new signature %s from %s: %s" % (sig, family.name, bt.print_data(data)))
+        return True
+
+    def step(self):
+        '''Send one mutation. Returns False when the meter cannot be recovered.'''
+        family = self.pick()
+        if not self.reach(family.state) and not self.recover(family.state):
+            return False
+        data = family.generator.next()
+        result = self.send(family, data)
+        self.attempts += 1
+        family.sent += 1
+        self.classify(family, data, result)
+        if result.code == None:
+            # Hung or reset, make sure it answers before the next mutation
+            self.log("fuzz: no response to %s: %s" % (family.name, bt.print_data(data)))
+            if not family.once and self.alive():
+                self.hangs += 1
+            elif not self.recover(family.state):
+                return False
+        elif result.ok and family.state == STATE_AUTH:
+            # Table and procedure requests leave the session as it was
+            pass
+        elif family.once or result.code not in KEEP_CODES:
+            # Session state is unknown, start over before the next one
+            self.state = STATE_DIRTY
+        return True
+
+    def rate(self):
+        '''Return attempts per minute.'''
+        elapsed = time.time() - self.started
+        if not elapsed:
+            return 0
+        return self.attempts * 60 / elapsed
+
+    def run(self, attempts = None, seconds = None):
+        '''Fuzz until attempts or seconds run out or Ctrl-C. Returns the clusters.'''
+        self.started = time.time()
+        try:
+            while True:
+                if attempts != None and self.attempts >= attempts:
+                    break
+                if seconds != None and time.time() - self.started >= seconds:
+                    break
+                if not self.step():
+                    self.log("fuzz: meter did not recover, stopping")
+                    break
+                if self.attempts % REPORT_EVERY == 0:
+                    self.log("fuzz: %d attempts, %.1f per minute, %d signatures, %d hangs, %d resets" % (self.attempts, self.rate(), len(self.clusters), self.hangs, self.resets))
+        except KeyboardInterrupt:
+            self.log("fuzz: stopped")
+        if self.state != None:
+            self.packet.send_terminate(self.ser_conn)
+            self.state = None
+        return self.clusters
+
+    def report(self):
+        '''Return printable lines for the clusters, rarest first.'''
+        lines = ["Fuzz: %d attempts, %.1f per minute, %d signatures, %d hangs, %d resets" % (self.attempts, self.rate(), len(self.clusters), self.hangs, self.resets)]
+        for family in self.families:
+            lines.append("    Family %s: %d sent, %d new signatures, weight %.2f" % (family.name, family.sent, family.found, family.weight))
+        for cluster in sorted(self.clusters.values(), key = lambda e: e.count):
+            lines.append("    %s x%d first from %s" % (cluster.sig, cluster.count, cluster.family))
+            lines.append("        Request:  %s" % bt.print_data(cluster.data))
+            lines.append("        Response: %s" % bt.print_data(cluster.resp))
+        return lines
+
+######################################
+# Security (51H) and logon (50H) mutations
+######################################
+def mutate_length(rand, base, pad = '\x20'):
+    '''Return base cut short or grown past its length.'''
+    if rand.random() < 0.5:
+        return base[:rand.randint(0, len(base))]
+    grow = rand.randint(1, max(1, MAX_FUZZ_LEN - len(base)))
+    return base + rand.choice((pad * grow, ''.join([chr(rand.randint(0, 255)) for cnt in range(grow)])))
+
+def mutate_bytes(rand, base):
+    '''Return base with a few bytes flipped or set to interesting values.'''
+    data = list(base)
+    if not data:
+        return rand.choice(INT_BYTES)
+    for cnt in range(rand.randint(1, 3)):
+        pos = rand.randrange(len(data))
+        if rand.random() < 0.5:
+            data[pos] = chr(ord(data[pos]) ^ (1 << rand.randrange(8)))
+        else:
+            data[pos] = rand.choice(INT_BYTES)
+    return ''.join(data)
+
+def mutate_padding(rand, base, pad = '\x20'):
+    '''Return base with its padding replaced by another byte.'''
+    body = base.rstrip(pad)
+    return body + rand.choice(INT_BYTES) * (len(base) - len(body) or rand.randint(1, 20))
+
+def security_lengths(rand, passwd):
+    while True:
+        yield '\x51' + mutate_length(rand, passwd)
+
+def security_padding(rand, passwd):
+    while True:
+        yield '\x51' + mutate_padding(rand, passwd)
+
+def security_bytes(rand, passwd):
+    while True:
+        yield '\x51' + mutate_bytes(rand, passwd)
+
+def logon_users(rand, user_str = '\x30\x31\x32\x33\x34\x35\x36\x37\x38\x39'):
+    while True:
+        if rand.random() < 0.7:
+            user = rand.choice(INT_WORDS)
+        else:
+            user = rand.randint(0, 0xffff)
+        yield '\x50' + struct.pack('>H', user) + user_str
+
+def logon_strings(rand, user = 2):
+    while True:
+        choice = rand.random()
+        if choice < 0.4:
+            user_str = rand.choice(INT_STRINGS)
+        elif choice < 0.7:
+            user_str = mutate_length(rand, '\x30\x31\x32\x33\x34\x35\x36\x37\x38\x39')
+        else:
+            user_str = mutate_bytes(rand, '\x30\x31\x32\x33\x34\x35\x36\x37\x38\x39')
+        yield '\x50' + struct.pack('>H', user) + user_str
+
+def logon_fields(rand):
+    while True:
+        # Truncated or missing user id
+        yield '\x50' + ''.join([chr(rand.randint(0, 255)) for cnt in range(rand.randint(0, 1))])
+
+def security_families(rand, passwd):
+    '''Return the security service mutation families.'''
+    return [FAMILY('security-length', 'security', STATE_USER, security_lengths(rand, passwd)),
+            FAMILY('security-padding', 'security', STATE_USER, security_padding(rand, passwd)),
+            FAMILY('security-bytes', 'security', STATE_USER, security_bytes(rand, passwd))]
+
+def logon_families(rand, user):
+    '''Return the logon service mutation families.'''
+    return [FAMILY('logon-user', 'logon', STATE_SETUP, logon_users(rand), once = True),
+            FAMILY('logon-string', 'logon', STATE_SETUP, logon_strings(rand, user), once = True),
+            FAMILY('logon-fields', 'logon', STATE_SETUP, logon_fields(rand), once = True)]
+
+######################################
+# Table read (30H, 3xH), write (40H, 4FH), and procedure (Table 07) mutations
+######################################
+def int_word(rand):
+    if rand.random() < 0.7:
+        return rand.choice(INT_WORDS)
+    return rand.randint(0, 0xffff)
+
+def int_offset(rand):
+    if rand.random() < 0.7:
+        return rand.choice(INT_OFFSETS)
+    return rand.randint(0, 0xffffff)
+
+def mutate_tail(rand, data):
+    '''Return data cut inside its last field or with bytes left over.'''
+    if rand.random() < 0.5:
+        return data[:rand.randint(1, len(data) - 1)]
+    return data + ''.join([chr(rand.randint(0, 255)) for cnt in range(rand.randint(1, 8))])
+
+def table_data(rand, packet, data, malformed = True):
+    '''Return <count><data><cksum> for data. Malformed blocks always have a wrong count, a
+        wrong checksum, or both, so a meter that checks them will not store the data.'''
+    count = len(data)
+    crc   = packet.table_crc(data) or '\x00'
+    if malformed:
+        choice = rand.random()
+        if choice < 0.7:
+            count = rand.choice([e for e in INT_WORDS + (count + 1, count - 1) if e != len(data) and 0 <= e <= 0xffff])
+        if choice > 0.3:
+            crc = chr(ord(crc) ^ rand.randint(1, 255))
+    return struct.pack('>H', count) + data + crc
+
+def fuzz_data(rand):
+    '''Return table or parameter data: random bytes or interesting fills.'''
+    size = rand.choice((0, 1, 2, rand.randint(3, 64)))
+    if rand.random() < 0.5:
+        return rand.choice(INT_BYTES) * size
+    return ''.join([chr(rand.randint(0, 255)) for cnt in range(size)])
+
+def read_tables(rand):
+    while True:
+        data = '\x30' + struct.pack('>H', int_word(rand))
+        if rand.random() < 0.2:
+            data = mutate_tail(rand, data)
+        yield data
+
+def read_partials(rand, tables):
+    while True:
+        table = rand.choice(tables)
+        if rand.random() < 0.7:
+            data = '\x3f' + struct.pack('>H', table) + struct.pack('>L', int_offset(rand))[1:] + struct.pack('>H', int_word(rand))
+        else:
+            # Read by index, 1 to 9 indices
+            nbr = rand.randint(1, 9)
+            data = chr(0x30 + nbr) + struct.pack('>H', table) + ''.join([struct.pack('>H', int_word(rand)) for cnt in range(nbr)]) + struct.pack('>H', int_word(rand))
+        if rand.random() < 0.2:
+            data = mutate_tail(rand, data)
+        yield data
+
+def write_tables(rand, packet, table):
+    while True:
+        if rand.random() < 0.5:
+            data = '\x40' + struct.pack('>H', table) + table_data(rand, packet, fuzz_data(rand))
+        else:
+            data = '\x4f' + struct.pack('>H', table) + struct.pack('>L', int_offset(rand))[1:] + table_data(rand, packet, fuzz_data(rand))
+        if rand.random() < 0.2:
+            data = mutate_tail(rand, data)
+        yield data
+
+def proc_params(rand, packet, procs):
+    while True:
+        # Table 07: <proc number><sequence><parameters>
+        params = struct.pack('<H', rand.choice(procs)) + chr(rand.randint(0, 255)) + fuzz_data(rand)
+        data = '\x40' + struct.pack('>H', 7) + table_data(rand, packet, params, rand.random() < 0.5)
+        if rand.random() < 0.2:
+            data = mutate_tail(rand, data)
+        yield data
+
+def table_families(rand, packet, tables = (0, 1), write_table = None, procs = ()):
+    '''Return the table and procedure mutation families. Writes are only sent with a
+        write_table and are always malformed. Procedures are only run from procs and are
+        sent well formed half the time, so only list procedures that are safe to run.'''
+    families = [FAMILY('read-table', 'read', STATE_AUTH, read_tables(rand)),
+                FAMILY('read-partial', 'pread', STATE_AUTH, read_partials(rand, tables))]
+    if write_table != None:
+        families.append(FAMILY('write-table', 'write', STATE_AUTH, write_tables(rand, packet, write_table)))
+    if procs:
+        families.append(FAMILY('proc-params', 'proc', STATE_AUTH, proc_params(rand, packet, procs)))
+    return families
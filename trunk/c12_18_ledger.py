@@ -0,0 +1,223 @@
+# c12_18_ledger.py - python module for keeping every security code attempt
+# across runs so known failures are not sent again.
+#
+# Copyright (c) 2011, InGuardians, Inc. <consulting@inguardians.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Point Of Contact:    Don C. Weber <don@inguardians.com>
+
+# The ledger is a SQLite file of (meter fingerprint, user, security code) ->
+# outcome. The fingerprint is the manufacturer, model, and hardware and
+# firmware versions from Table 01, so meters of one model share history.
+# For the fingerprint and user being attacked, the known failures are loaded
+# into a Bloom filter. A candidate the filter has never seen is sent without
+# touching the database; only a filter hit is confirmed with a lookup, so a
+# false positive can never skip the right code. Ledgers from different
+# workstations are merged with merge() or from the command line:
+#   python c12_18_ledger.py <ledger> <other ledger> [<other ledger> ...]
+
+import os, sys, time
+import math
+import struct
+import array
+import socket
+import sqlite3
+import threading
+import hashlib
+import c12_18_checkpoint as c12checkpoint
+import c12_18_schema as c12schema
+
+######################################
+# VARIABLES - These values will not change
+######################################
+LEDGER_BATCH   = 64         # Attempts between commits
+LEDGER_TIMEOUT = 30         # Seconds to wait for another probe's commit
+BLOOM_ERROR    = 0.001      # Bloom filter false positive rate
+BLOOM_MIN      = 65536      # Smallest number of failures the filter is sized for
+
+# Outcome precedence when ledgers disagree, an accepted code always wins
+OUTCOME_RANK   = {c12checkpoint.ATTEMPT_ERR:0, c12checkpoint.ATTEMPT_FAIL:1, c12checkpoint.ATTEMPT_OK:2}
+
+LEDGER_SCHEMA  = '''CREATE TABLE IF NOT EXISTS attempts (
+    fingerprint TEXT NOT NULL,
+    user        INTEGER NOT NULL,
+    passwd      BLOB NOT NULL,
+    outcome     TEXT NOT NULL,
+    tries       INTEGER NOT NULL DEFAULT 1,
+    first       REAL NOT NULL,
+    last        REAL NOT NULL,
+    station     TEXT NOT NULL,
+    PRIMARY KEY (fingerprint, user, passwd))'''
+######################################
+
+def meter_fingerprint(data):
+    '''Return manufacturer, model, and versions from Table 01 data, None if it does not decode.'''
+    table01 = c12schema.decode(1, data)
+    if not table01:
+        return None
+    versions = '.'.join([str(table01[e]) for e in ('hw_version_nm', 'hw_revision_nm', 'fw_version_nm', 'fw_revision_nm')])
+    return '%s-%s-%s' % (table01['manufacturer'].strip(), table01['ed_model'].strip(), versions)
+
+class BLOOM:
+    def __init__(self, capacity = BLOOM_MIN, error = BLOOM_ERROR):
+        '''
+        Bloom filter sized for capacity entries at the error false positive rate.
+        '''
+        capacity   = max(1, capacity)
+        self.bits  = int(math.ceil(-capacity * math.log(error) / (math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.bits * math.log(2) / capacity)))
+        self.table = array.array('B', [0]) * ((self.bits + 7) / 8)
+        self.count = 0
+
+    def positions(self, key):
+        '''Return the bit positions for key, double hashing one MD5.'''
+        h1, h2 = struct.unpack('<QQ', hashlib.md5(key).digest())
+        h2 |= 1
+        return [(h1 + cnt * h2) % self.bits for cnt in range(self.hashes)]
+
+    def add(self, key):
+        for pos in self.positions(key):
+            self.table[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        for pos in self.positions(key):
+            if not self.table[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+class LEDGER:
+    def __init__(self, filename, station = None, batch = LEDGER_BATCH):
+        '''
+        Attempt ledger. scope() picks the fingerprint and user, known_bad() tests a candidate,
+        and record() adds an attempt.
+        '''
+        self.filename    = filename
+        self.station     = station or socket.gethostname()
+        self.batch       = batch
+        self.pending     = 0            # Attempts since the last commit
+        self.fingerprint = None
+        self.user        = None
+        self.bloom       = None
+        self.skipped     = 0            # Candidates skipped as known failures
+        self.lookups     = 0            # Filter hits confirmed in the database
+        self.lock        = threading.RLock()    # Candidates are checked and recorded from different threads
+        self.conn        = sqlite3.connect(filename, timeout = LEDGER_TIMEOUT, check_same_thread = False)
+        self.conn.text_factory = str
+        self.conn.execute(LEDGER_SCHEMA)
+        self.conn.commit()
+
+    def scope(self, fingerprint, user):
+        '''Load the known failures of user on meters with fingerprint into the Bloom filter.
+            Returns the number of known failures.'''
+        self.sync()
+        self.fingerprint = fingerprint
+        self.user        = user
+        count = self.conn.execute('SELECT COUNT(*) FROM attempts WHERE fingerprint = ? AND user = ? AND outcome = ?',
+                (fingerprint, user, c12checkpoint.ATTEMPT_FAIL)).fetchone()[0]
+        self.bloom = BLOOM(max(BLOOM_MIN, count * 2))
+        for row in self.conn.execute('SELECT passwd FROM attempts WHERE fingerprint = ? AND user = ? AND outcome = ?',
+                (fingerprint, user, c12checkpoint.ATTEMPT_FAIL)):
+            self.bloom.add(str(row[0]))
+        return count
+
+    def outcome(self, passwd):
+        '''Return the recorded outcome of passwd in the current scope, None if never tried.'''
+        with self.lock:
+            row = self.conn.execute('SELECT outcome FROM attempts WHERE fingerprint = ? AND user = ? AND passwd = ?',
+                    (self.fingerprint, self.user, sqlite3.Binary(passwd))).fetchone()
+        if row:
+            return row[0]
+        return None
+
+    def known_bad(self, passwd):
+        '''Return True if passwd has already failed in the current scope.'''
+        if self.bloom == None or passwd not in self.bloom:
+            return False
+        self.lookups += 1
+        if self.outcome(passwd) == c12checkpoint.ATTEMPT_FAIL:
+            self.skipped += 1
+            return True
+        return False
+
+    def known_good(self):
+        '''Return the codes that have worked in the current scope.'''
+        return [str(row[0]) for row in self.conn.execute('SELECT passwd FROM attempts WHERE fingerprint = ? AND user = ? AND outcome = ?',
+                (self.fingerprint, self.user, c12checkpoint.ATTEMPT_OK))]
+
+    def record(self, passwd, outcome, when = None):
+        '''Add an attempt in the current scope. Commits every batch attempts and whenever a code
+            works.'''
+        with self.lock:
+            self.upsert(self.fingerprint, self.user, passwd, outcome, 1, when or time.time(), when or time.time(), self.station)
+            if outcome == c12checkpoint.ATTEMPT_FAIL and self.bloom != None:
+                self.bloom.add(passwd)
+            self.pending += 1
+            if outcome == c12checkpoint.ATTEMPT_OK or self.pending >= self.batch:
+                self.sync()
+
+    def upsert(self, fingerprint, user, passwd, outcome, tries, first, last, station):
+        '''Insert an attempt or fold it into the one already recorded.'''
+        passwd = sqlite3.Binary(passwd)
+        row = self.conn.execute('SELECT outcome, tries, first, last FROM attempts WHERE fingerprint = ? AND user = ? AND passwd = ?',
+                (fingerprint, user, passwd)).fetchone()
+        if not row:
+            self.conn.execute('INSERT INTO attempts VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (fingerprint, user, passwd, outcome, tries, first, last, station))
+            return
+        if OUTCOME_RANK.get(row[0], 0) > OUTCOME_RANK.get(outcome, 0):
+            outcome = row[0]
+        self.conn.execute('UPDATE attempts SET outcome = ?, tries = ?, first = ?, last = ? WHERE fingerprint = ? AND user = ? AND passwd = ?',
+                (outcome, row[1] + tries, min(row[2], first), max(row[3], last), fingerprint, user, passwd))
+
+    def merge(self, filename):
+        '''Fold another ledger into this one. Returns the number of rows read.'''
+        other = sqlite3.connect(filename)
+        other.text_factory = str
+        cnt = 0
+        for row in other.execute('SELECT fingerprint, user, passwd, outcome, tries, first, last, station FROM attempts'):
+            self.upsert(row[0], row[1], str(row[2]), row[3], row[4], row[5], row[6], row[7])
+            cnt += 1
+        other.close()
+        self.conn.commit()
+        self.pending = 0
+        if self.fingerprint != None:
+            self.scope(self.fingerprint, self.user)
+        return cnt
+
+    def sync(self):
+        '''Commit recorded attempts.'''
+        with self.lock:
+            if self.pending:
+                self.conn.commit()
+                self.pending = 0
+
+    def close(self):
+        self.sync()
+        self.conn.close()
+
+if __name__ == "__main__":
+
+    if len(sys.argv) < 3:
+        print "Usage: %s <ledger> <other ledger> [<other ledger> ...]" % sys.argv[0]
+        print "    Merges the other ledgers into the first one."
+        sys.exit()
+    ledger = LEDGER(sys.argv[1])
+    for filename in sys.argv[2:]:
+        if not os.path.isfile(filename):
+            print "c12_18_ledger.py: No such ledger:", filename
+            continue
+        print "Merged %d attempts from %s" % (ledger.merge(filename), filename)
+    ledger.close()
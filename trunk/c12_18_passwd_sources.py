@@ -0,0 +1,418 @@
+# c12_18_passwd_sources.py - python module for streaming C12.18 security
+# codes from files and generators.
+#
+# Copyright (c) 2011, InGuardians, Inc. <consulting@inguardians.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Point Of Contact:    Don C. Weber <don@inguardians.com>
+
+# Every source works the same way:
+#   len(source)            number of candidates
+#   source[idx]            candidate at idx without reading the ones before it
+#   source.iterate(start)  yields [idx, candidate] from start
+#   source.digest()        identifies the source for checkpoints
+# Files are mmap'd so nothing is read until it is needed. Hex files with
+# lines of one length are indexed by arithmetic, other hex files keep the
+# offset of every INDEX_STEP'th line.
+
+import os
+import mmap
+import hashlib
+import binascii
+
+######################################
+# VARIABLES - These values will not change
+######################################
+PASSWD_LEN  = 20            # C12.18 security code length
+PASSWD_PAD  = '\x20'        # Security codes are padded with spaces
+INDEX_STEP  = 4096          # Lines between saved offsets in variable length hex files
+DIGEST_READ = 1 << 20       # Bytes hashed at a time
+
+# Mask character sets
+MASK_SETS = {
+    'd':'0123456789',
+    'l':'abcdefghijklmnopqrstuvwxyz',
+    'u':'ABCDEFGHIJKLMNOPQRSTUVWXYZ',
+    's':' !"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~',
+    'h':'0123456789abcdef',
+    'H':'0123456789ABCDEF',
+    'b':''.join([chr(e) for e in range(256)]),
+    }
+MASK_SETS['a'] = MASK_SETS['l'] + MASK_SETS['u'] + MASK_SETS['d'] + MASK_SETS['s']
+######################################
+
+def pad_passwd(passwd, size = PASSWD_LEN, pad = PASSWD_PAD):
+    '''Pad a security code to the C12.18 length. Longer codes are returned unchanged.'''
+    if len(passwd) < size:
+        return passwd + (pad * (size - len(passwd)))
+    return passwd
+
+class SOURCE:
+    '''Base for password sources. Subclasses provide __len__, get(), and describe().'''
+    pad = False
+
+    def get(self, idx):
+        raise NotImplementedError
+
+    def describe(self):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError(idx)
+        passwd = self.get(idx)
+        if self.pad:
+            passwd = pad_passwd(passwd)
+        return passwd
+
+    def iterate(self, start = 0, stop = None, step = 1):
+        '''Yield [idx, password] from start to stop, every step'th candidate.'''
+        if stop == None or stop > len(self):
+            stop = len(self)
+        for idx in xrange(start, stop, step):
+            yield idx, self[idx]
+
+    def __iter__(self):
+        for idx, passwd in self.iterate():
+            yield passwd
+
+    def digest(self):
+        '''Return a digest that identifies this source for checkpoints.'''
+        return hashlib.sha1(self.describe()).hexdigest()
+
+    def close(self):
+        pass
+
+class FILE_SOURCE(SOURCE):
+    '''mmap of a password file.'''
+    def __init__(self, filename):
+        self.filename = filename
+        self.size     = os.path.getsize(filename)
+        self.inf      = open(filename, 'rb')
+        self.map      = None
+        if self.size:
+            self.map = mmap.mmap(self.inf.fileno(), 0, access = mmap.ACCESS_READ)
+        self.file_digest = None
+
+    def describe(self):
+        return 'file:%s' % os.path.abspath(self.filename)
+
+    def digest(self):
+        '''Return the SHA1 of the file contents, same as c12_18_checkpoint.list_digest().'''
+        if self.file_digest == None:
+            digest = hashlib.sha1()
+            for pos in xrange(0, self.size, DIGEST_READ):
+                digest.update(self.map[pos:pos + DIGEST_READ])
+            self.file_digest = digest.hexdigest()
+        return self.file_digest
+
+    def close(self):
+        if self.map:
+            self.map.close()
+            self.map = None
+        self.inf.close()
+
+class HEX_FILE(FILE_SOURCE):
+    def __init__(self, filename, pad = False):
+        '''
+        File with one hex encoded security code per line.
+        '''
+        FILE_SOURCE.__init__(self, filename)
+        self.pad     = pad
+        self.reclen  = None     # Line length with newline when every line is the same length
+        self.offsets = []       # Offset of every INDEX_STEP'th line otherwise
+        self.count   = 0
+        self.index()
+
+    def index(self):
+        '''Work out how to find a line by number.'''
+        if not self.map:
+            return
+        first = self.map.find('\n')
+        if first < 0:
+            self.count = 1
+            self.offsets = [0]
+            return
+        reclen = first + 1
+        # Walk the file once, keep every INDEX_STEP'th offset and check whether every line
+        # ends at a multiple of the first line's length
+        same = self.size % reclen == 0
+        pos = 0
+        cnt = 0
+        while pos < self.size:
+            if cnt % INDEX_STEP == 0:
+                self.offsets.append(pos)
+            nxt = self.map.find('\n', pos)
+            if nxt < 0:
+                nxt = self.size
+            pos = nxt + 1
+            cnt += 1
+            if pos != cnt * reclen:
+                same = False
+        self.count = cnt
+        # Every line the same length: look lines up by arithmetic
+        if same:
+            self.reclen  = reclen
+            self.offsets = []
+
+    def __len__(self):
+        return self.count
+
+    def line_at(self, idx):
+        '''Return the raw line at idx.'''
+        if self.reclen:
+            pos = idx * self.reclen
+            return self.map[pos:pos + self.reclen]
+        pos = self.offsets[idx / INDEX_STEP]
+        for cnt in xrange(idx % INDEX_STEP):
+            pos = self.map.find('\n', pos) + 1
+        end = self.map.find('\n', pos)
+        if end < 0:
+            end = self.size
+        return self.map[pos:end]
+
+    def get(self, idx):
+        return binascii.a2b_hex(self.line_at(idx).strip())
+
+    def iterate(self, start = 0, stop = None, step = 1):
+        '''Yield [idx, password]. Variable length files are walked line by line instead of
+            looked up for each index.'''
+        if self.reclen or step != 1:
+            for e in SOURCE.iterate(self, start, stop, step):
+                yield e
+            return
+        if stop == None or stop > self.count:
+            stop = self.count
+        if start >= stop:
+            return
+        pos = self.offsets[start / INDEX_STEP]
+        for cnt in xrange(start % INDEX_STEP):
+            pos = self.map.find('\n', pos) + 1
+        for idx in xrange(start, stop):
+            end = self.map.find('\n', pos)
+            if end < 0:
+                end = self.size
+            passwd = binascii.a2b_hex(self.map[pos:end].strip())
+            if self.pad:
+                passwd = pad_passwd(passwd)
+            yield idx, passwd
+            pos = end + 1
+
+class BIN_FILE(FILE_SOURCE):
+    def __init__(self, filename, reclen = PASSWD_LEN):
+        '''
+        File of raw security codes, reclen bytes each.
+        '''
+        FILE_SOURCE.__init__(self, filename)
+        self.reclen = reclen
+
+    def __len__(self):
+        return self.size / self.reclen
+
+    def get(self, idx):
+        pos = idx * self.reclen
+        return self.map[pos:pos + self.reclen]
+
+class MASK(SOURCE):
+    def __init__(self, mask, pad = True):
+        '''
+        Every code that fits a mask. ?d, ?l, ?u, ?s, ?a, ?h, ?H, and ?b stand for the
+        character sets in MASK_SETS, ?? is a question mark, anything else is used as is.
+        The last position changes fastest.
+        '''
+        self.mask      = mask
+        self.pad       = pad
+        self.positions = []
+        idx = 0
+        while idx < len(mask):
+            if mask[idx] == '?' and idx + 1 < len(mask):
+                key = mask[idx + 1]
+                if key == '?':
+                    self.positions.append('?')
+                elif key in MASK_SETS:
+                    self.positions.append(MASK_SETS[key])
+                else:
+                    raise ValueError('Unknown mask character set: ?' + key)
+                idx += 2
+            else:
+                self.positions.append(mask[idx])
+                idx += 1
+        self.count = 1
+        for charset in self.positions:
+            self.count *= len(charset)
+
+    def __len__(self):
+        return self.count
+
+    def describe(self):
+        return 'mask:%s:%d' % (self.mask, self.pad)
+
+    def get(self, idx):
+        chars = []
+        for charset in reversed(self.positions):
+            idx, rem = divmod(idx, len(charset))
+            chars.append(charset[rem])
+        chars.reverse()
+        return ''.join(chars)
+
+class CHARSET(SOURCE):
+    def __init__(self, charset, min_len = 1, max_len = PASSWD_LEN, pad = True):
+        '''
+        Every code made from charset, shortest first, from min_len to max_len characters.
+        '''
+        if min_len < 0 or max_len < min_len:
+            raise ValueError('Bad lengths: %d-%d' % (min_len, max_len))
+        self.charset = charset
+        self.min_len = min_len
+        self.max_len = max_len
+        self.pad     = pad
+        # Number of codes before each length starts
+        self.starts  = []
+        total = 0
+        for length in range(min_len, max_len + 1):
+            self.starts.append(total)
+            total += len(charset) ** length
+        self.count = total
+
+    def __len__(self):
+        return self.count
+
+    def describe(self):
+        return 'charset:%s:%d:%d:%d' % (binascii.b2a_hex(self.charset), self.min_len, self.max_len, self.pad)
+
+    def get(self, idx):
+        # Find the length, at most max_len - min_len steps
+        length = self.max_len
+        for cnt in range(len(self.starts) - 1, -1, -1):
+            if idx >= self.starts[cnt]:
+                length = self.min_len + cnt
+                idx -= self.starts[cnt]
+                break
+        base  = len(self.charset)
+        chars = []
+        for cnt in range(length):
+            idx, rem = divmod(idx, base)
+            chars.append(self.charset[rem])
+        chars.reverse()
+        return ''.join(chars)
+
+class PIN(CHARSET):
+    def __init__(self, min_len = 4, max_len = 8, pad = True):
+        '''
+        Numeric PINs in ASCII, shortest first, padded to the 20-byte C12.18 security code.
+        '''
+        CHARSET.__init__(self, MASK_SETS['d'], min_len, max_len, pad)
+
+    def describe(self):
+        return 'pin:%d:%d:%d' % (self.min_len, self.max_len, self.pad)
+
+class SLICE(SOURCE):
+    def __init__(self, source, start = 0, stop = None, step = 1):
+        '''
+        Part of another source: every step'th candidate from start to stop. Indexes are the
+        slice's own, source_index() converts them back.
+        '''
+        if stop == None or stop > len(source):
+            stop = len(source)
+        self.source = source
+        self.start  = start
+        self.stop   = stop
+        self.step   = step
+        self.count  = max(0, (stop - start + step - 1) / step)
+
+    def __len__(self):
+        return self.count
+
+    def describe(self):
+        return 'slice:%s:%d:%d:%d' % (self.source.describe(), self.start, self.stop, self.step)
+
+    def digest(self):
+        '''Return a digest of the original source's digest and the slice.'''
+        return hashlib.sha1('%s:%d:%d:%d' % (self.source.digest(), self.start, self.stop, self.step)).hexdigest()
+
+    def source_index(self, idx):
+        '''Return the index in the original source.'''
+        return self.start + idx * self.step
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += self.count
+        if idx < 0 or idx >= self.count:
+            raise IndexError(idx)
+        return self.source[self.source_index(idx)]
+
+    def iterate(self, start = 0, stop = None, step = 1):
+        '''Yield [idx, password] using the original source's iterate(), which is faster than
+            looking up each index for streamed sources.'''
+        if stop == None or stop > self.count:
+            stop = self.count
+        if start >= stop:
+            return
+        for idx, passwd in self.source.iterate(self.source_index(start), self.source_index(stop - 1) + 1, self.step * step):
+            yield (idx - self.start) / self.step, passwd
+
+def partition(source, parts, part, interleave = False):
+    '''Return part (0 to parts-1) of a source split into parts slices that do not overlap.
+        Contiguous blocks by default, every parts'th candidate with interleave.'''
+    if interleave:
+        return SLICE(source, part, len(source), parts)
+    size  = len(source) / parts
+    extra = len(source) % parts
+    start = part * size + min(part, extra)
+    stop  = start + size
+    if part < extra:
+        stop += 1
+    return SLICE(source, start, stop)
+
+def open_source(spec):
+    '''
+    Return a source from a spec string:
+        mask:<mask>                   mask:?d?d?d?d
+        pin:<min>-<max>               pin:4-8
+        charset:<characters>:<min>-<max>
+        bin:<filename>                20-byte raw codes
+        <filename>                    hex codes, one per line
+    '''
+    if spec.startswith('mask:'):
+        return MASK(spec[5:])
+    if spec.startswith('pin:'):
+        lengths = spec[4:].split('-')
+        return PIN(int(lengths[0]), int(lengths[-1]))
+    if spec.startswith('charset:'):
+        charset, lengths = spec[8:].rsplit(':', 1)
+        lengths = lengths.split('-')
+        return CHARSET(charset, int(lengths[0]), int(lengths[-1]))
+    if spec.startswith('bin:'):
+        return BIN_FILE(spec[4:])
+    return HEX_FILE(spec)
+
+if __name__ == "__main__":
+
+    import sys
+    import byte_tools as bt
+
+    try:
+        source = open_source(sys.argv[1])
+    except IndexError:
+        print "c12_18_passwd_sources.py: No source provided"
+        sys.exit()
+    print "Candidates:", len(source)
+    for idx, passwd in source.iterate(0, 10):
+        print idx, bt.print_data(passwd)
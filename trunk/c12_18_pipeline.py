@@ -0,0 +1,178 @@
+# c12_18_pipeline.py - python module for keeping host work off the optical
+# link during brute force and fuzzing runs.
+#
+# Copyright (c) 2011, InGuardians, Inc. <consulting@inguardians.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Point Of Contact:    Don C. Weber <don@inguardians.com>
+
+# A run is three stages joined by bounded queues:
+#   1. PREFETCH reads candidates from the password source, checks them against
+#      the ledger, and builds the security packet for both control byte values
+#   2. The serial loop takes the next candidate, hands its packets to
+#      C1218_packet.set_prebuilt(), and sends it
+#   3. LOG_WRITER formats the output lines and writes the journal, ledger, and
+#      log file
+# The serial loop blocks on the port most of the time, which lets the other
+# threads run. A full queue stops the stage feeding it, so the producer never
+# gets more than a queue ahead and the writer never falls far behind.
+
+import Queue
+import threading
+import traceback
+import byte_tools as bt
+import c12_18_packet as c12packet
+
+######################################
+# VARIABLES - These values will not change
+######################################
+PREFETCH_SIZE = 256         # Candidates built ahead of the serial loop
+WRITER_SIZE   = 1024        # Log lines and records waiting for the writer
+POLL          = 0.5         # Seconds between checks for a stop while blocked on a queue
+######################################
+
+# Queue markers
+END   = ('end',)
+ERROR = ('error',)
+
+def security_frames(encoder, passwd):
+    '''Return the security request data for passwd and {ctrl:packet} for both control byte values.'''
+    data = '\x51' + passwd
+    frames = {}
+    for ctrl in c12packet.single_ctrl:
+        frame = encoder.encode(data, ctrl)
+        if not frame:
+            return data, None
+        frames[ctrl] = frame.tobytes()
+    return data, frames
+
+class PREFETCH:
+    def __init__(self, items, transform = None, size = PREFETCH_SIZE):
+        '''
+        Runs an iterator in a worker thread and hands out its items through a bounded queue.
+        transform is applied to each item in the worker. Items it returns None for are
+        dropped.
+        '''
+        self.queue     = Queue.Queue(size)
+        self.stop      = threading.Event()
+        self.error     = None
+        self.thread    = threading.Thread(target = self.produce, args = (items, transform))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, item):
+        '''Queue an item, giving up if the run stopped. Returns success (True) or failure (False)'''
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, True, POLL)
+                return True
+            except Queue.Full:
+                continue
+        return False
+
+    def produce(self, items, transform):
+        try:
+            for item in items:
+                if transform:
+                    item = transform(item)
+                    if item == None:
+                        continue
+                if not self.put(item):
+                    return
+            self.put(END)
+        except Exception:
+            self.error = traceback.format_exc()
+            self.put(ERROR)
+
+    def __iter__(self):
+        while True:
+            try:
+                item = self.queue.get(True, POLL)
+            except Queue.Empty:
+                # A timeout keeps Ctrl-C working while the worker catches up
+                continue
+            if item is END:
+                return
+            if item is ERROR:
+                print "PREFETCH: candidate generation failed"
+                print self.error
+                return
+            yield item
+
+    def close(self):
+        '''Stop the worker and drop anything it built ahead.'''
+        self.stop.set()
+        while self.thread.is_alive():
+            try:
+                self.queue.get(True, POLL)
+            except Queue.Empty:
+                pass
+        self.thread.join()
+
+class LOG_WRITER:
+    def __init__(self, onf = None, console = True, size = WRITER_SIZE):
+        '''
+        Background writer for the log file and the console. write() takes a format and the raw
+        values for it, formatting happens in the writer. call() runs any function, such as a
+        journal or ledger record, in the writer in order with the lines.
+        '''
+        self.onf     = onf
+        self.console = console
+        self.queue   = Queue.Queue(size)
+        self.thread  = threading.Thread(target = self.drain)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, line, *data):
+        '''Queue a line for the console and the log file. Each value in data is printed with
+            bt.print_data into a %s in line.'''
+        self.queue.put((None, line, data))
+
+    def show(self, line, *data):
+        '''Queue a line for the console only.'''
+        self.queue.put((False, line, data))
+
+    def call(self, func, *args):
+        '''Queue a function call.'''
+        self.queue.put((func, None, args))
+
+    def drain(self):
+        while True:
+            func, line, args = self.queue.get()
+            try:
+                if func == None and line == None:
+                    return
+                if func:
+                    func(*args)
+                else:
+                    if args:
+                        line = line % tuple([bt.print_data(e) for e in args])
+                    if self.console:
+                        print line
+                    if self.onf and func == None:
+                        self.onf.write(line + "\n")
+            except Exception:
+                traceback.print_exc()
+            finally:
+                self.queue.task_done()
+
+    def sync(self):
+        '''Wait for everything queued so far to be written.'''
+        self.queue.join()
+
+    def close(self):
+        '''Write everything queued and stop the writer.'''
+        self.queue.put((None, None, None))
+        self.thread.join()
@@ -0,0 +1,290 @@
+# c12_18_ranking.py - python module for ordering C12.18 security code
+# candidates by how likely they are to work.
+#
+# Copyright (c) 2011, InGuardians, Inc. <consulting@inguardians.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Point Of Contact:    Don C. Weber <don@inguardians.com>
+
+# Candidates are tried in three tiers:
+#   1. Known vendor defaults: test_passwds and meter_passwd.txt
+#   2. Strings that repeat inside firmware or memory dumps, most repeats first
+#   3. Everything else from the password sources, by structure: padding shape,
+#      printable or numeric content, repeated or counting bytes
+# Dump strings are counted in a count-min sketch so memory does not grow
+# with the dump, and only the strings that repeat the most are kept. Dumps
+# are read a piece at a time. Sources are ranked in blocks of a fixed size:
+# each block is read, sorted by score, and handed out before the next one
+# is read. Candidates that score well come out early without the whole list
+# ever being sorted or held in memory. A candidate already handed out as a
+# default or dump string is skipped in later tiers; its index is left out,
+# so lengths are an upper bound. The order only depends on the inputs and a
+# block starts at a fixed position in its source, so a run is resumed by
+# reading from the block that holds the position.
+
+import os
+import heapq
+import array
+import hashlib
+import c12_18_packet as c12packet
+import c12_18_passwd_sources as c12passwd
+
+######################################
+# VARIABLES - These values will not change
+######################################
+QUEUE_SIZE      = 65536     # Candidates ranked at a time
+DUMP_COUNTERS   = 4096      # Strings kept per dump and size
+SKETCH_WIDTH    = 4194301   # Counters per row of the count-min sketch used on dumps, prime
+SKETCH_DEPTH    = 4         # Rows of the count-min sketch
+DUMP_MIN        = 2         # Repeats needed to rank a dump string
+DUMP_SIZES      = (10, 10)  # Dump string sizes, same default as tools/c12_18_extract_keys.py
+DUMP_READ       = 1 << 20   # Dump bytes read at a time
+DEFAULTS_FILE   = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'meter_passwd.txt')
+
+# Structure scores
+SCORE_SPACE_PAD = 400       # Content followed by 0x20 padding
+SCORE_NULL_PAD  = 150       # Content followed by 0x00 padding
+SCORE_DIGITS    = 300       # Only ASCII digits
+SCORE_ALNUM     = 200       # Only ASCII letters and digits
+SCORE_PRINTABLE = 100       # Only printable ASCII
+SCORE_REPEAT    = 250       # One byte repeated
+SCORE_COUNT     = 250       # Counting bytes, such as 01 02 03
+SCORE_SHORT     = 10        # Per byte of content shorter than 20
+SCORE_BINARY    = -20       # Per byte outside printable ASCII
+SCORE_REPEATS   = 1000      # Per repeat of a dump string
+######################################
+
+def content(passwd):
+    '''Return the security code without its padding and the padding byte, '' if not padded.'''
+    for pad in (c12passwd.PASSWD_PAD, '\x00'):
+        body = passwd.rstrip(pad)
+        if body and len(body) < len(passwd):
+            return body, pad
+    return passwd, ''
+
+def counting(body):
+    '''Return True if every byte is one more than the byte before it.'''
+    if len(body) < 3:
+        return False
+    for cnt in range(1, len(body)):
+        if ord(body[cnt]) != (ord(body[cnt - 1]) + 1) & 0xff:
+            return False
+    return True
+
+def structure_score(passwd):
+    '''Score a security code by its shape. Higher is more likely.'''
+    body, pad = content(passwd)
+    score = 0
+    if pad == c12passwd.PASSWD_PAD:
+        score += SCORE_SPACE_PAD
+    elif pad == '\x00':
+        score += SCORE_NULL_PAD
+    if body.isdigit():
+        score += SCORE_DIGITS
+    elif body.isalnum():
+        score += SCORE_ALNUM
+    binary = len([e for e in body if e < ' ' or e > '~'])
+    if not binary:
+        score += SCORE_PRINTABLE
+    if len(set(passwd)) == 1:
+        score += SCORE_REPEAT
+    elif counting(body):
+        score += SCORE_COUNT
+    score += max(0, c12passwd.PASSWD_LEN - len(body)) * SCORE_SHORT
+    score += binary * SCORE_BINARY
+    return score
+
+def dump_strings(filename, size):
+    '''Yield every string of size bytes in a dump, reading DUMP_READ bytes at a time.'''
+    inf = open(filename, 'rb')
+    data = ''
+    while True:
+        chunk = inf.read(DUMP_READ)
+        if not chunk:
+            break
+        # Keep the tail of the last piece for the strings that cross into this one
+        data = data[len(data) - size + 1:] + chunk if data else chunk
+        for pos in xrange(len(data) - size + 1):
+            yield data[pos:pos + size]
+    inf.close()
+
+def dump_counts(filename, size, counters = DUMP_COUNTERS, repeats = DUMP_MIN):
+    '''Return {string:count} for at most counters strings of size bytes that repeat at least
+        repeats times in a dump, the ones that repeat the most.'''
+    sketch = [array.array('H', [0]) * SKETCH_WIDTH for row in range(SKETCH_DEPTH)]
+    # First pass counts every string in the sketch, fixed memory however big the dump
+    for key in dump_strings(filename, size):
+        h1 = hash(key)
+        h2 = hash(key[::-1]) | 1
+        for row in range(SKETCH_DEPTH):
+            col = (h1 + row * h2) % SKETCH_WIDTH
+            if sketch[row][col] < 0xffff:
+                sketch[row][col] += 1
+    # Second pass keeps the strings that repeat the most by their sketch count and counts
+    # them exactly from their first appearance, which drops sketch collisions
+    heap = []
+    kept = {}
+    for key in dump_strings(filename, size):
+        if key in kept:
+            kept[key] += 1
+            continue
+        h1 = hash(key)
+        h2 = hash(key[::-1]) | 1
+        count = min([sketch[row][(h1 + row * h2) % SKETCH_WIDTH] for row in range(SKETCH_DEPTH)])
+        if count < repeats:
+            continue
+        kept[key] = 1
+        heapq.heappush(heap, (count, key))
+        if len(heap) > counters:
+            del kept[heapq.heappop(heap)[1]]
+    for key in kept.keys():
+        if kept[key] < repeats:
+            del kept[key]
+    return kept
+
+def dump_candidates(filename, sizes = DUMP_SIZES, counters = DUMP_COUNTERS, repeats = DUMP_MIN):
+    '''Return [score, candidate] for the strings that repeat in a dump, padded to 20 bytes
+        with spaces like tools/c12_18_extract_keys.py.'''
+    found = []
+    for size in range(sizes[0], sizes[1] + 1):
+        counts = dump_counts(filename, size, counters, repeats)
+        for key in counts:
+            if len(set(key)) == 1:
+                # A run of one byte is fill, not a security code
+                continue
+            passwd = c12passwd.pad_passwd(key)
+            found.append([counts[key] * SCORE_REPEATS + structure_score(passwd), passwd])
+    found.sort(reverse = True)
+    return found
+
+def default_candidates(filename = DEFAULTS_FILE):
+    '''Return the known vendor defaults: test_passwds then meter_passwd.txt.'''
+    passwds = list(c12packet.test_passwds)
+    if filename and os.path.isfile(filename):
+        source = c12passwd.HEX_FILE(filename)
+        for passwd in source:
+            if passwd not in passwds:
+                passwds.append(passwd)
+        source.close()
+    return passwds
+
+class RANKED(c12passwd.SOURCE):
+    def __init__(self, sources = [], dumps = [], defaults = DEFAULTS_FILE, size = QUEUE_SIZE, sizes = DUMP_SIZES):
+        '''
+        Ranked candidates from vendor defaults, dump strings, and password sources. Lookups
+        by index walk the ranked stream, iterate() is the fast way through.
+        '''
+        self.sources  = sources
+        self.dumps    = dumps
+        self.defaults = default_candidates(defaults)
+        self.size     = size
+        self.sizes    = sizes
+        self.ranked   = []      # Dump candidates, best first
+        found = []
+        for dump in dumps:
+            found.extend(dump_candidates(dump, sizes))
+        found.sort(reverse = True)
+        self.early    = set(self.defaults)  # Candidates handed out before the sources
+        for score, passwd in found:
+            if passwd not in self.early:
+                self.early.add(passwd)
+                self.ranked.append([score, passwd])
+        self.base     = len(self.defaults) + len(self.ranked)
+        self.count    = self.base + sum([len(source) for source in sources])
+
+    def __len__(self):
+        return self.count
+
+    def describe(self):
+        return 'ranked:%s:%s:%d:%d-%d' % (','.join([source.describe() for source in self.sources]),
+                ','.join([os.path.abspath(dump) for dump in self.dumps]), self.size, self.sizes[0], self.sizes[1])
+
+    def digest(self):
+        '''Return a digest of the inputs and the queue size, which fix the order.'''
+        digest = hashlib.sha1(self.describe())
+        for source in self.sources:
+            digest.update(source.digest())
+        for passwd in self.defaults:
+            digest.update(passwd)
+        for score, passwd in self.ranked:
+            digest.update(passwd)
+        return digest.hexdigest()
+
+    def stream(self, start = 0):
+        '''Yield [idx, password] best first from the tier and block that hold start.'''
+        for idx in xrange(start, len(self.defaults)):
+            yield idx, self.defaults[idx]
+        for idx in xrange(max(start, len(self.defaults)), self.base):
+            yield idx, self.ranked[idx - len(self.defaults)][1]
+        base = self.base
+        for source in self.sources:
+            total = len(source)
+            if start >= base + total:
+                base += total
+                continue
+            # Blocks start at multiples of size in each source
+            first = max(0, start - base) / self.size * self.size
+            for block in xrange(first, total, self.size):
+                entries = [(-structure_score(passwd), idx, passwd) for idx, passwd in source.iterate(block, block + self.size)]
+                entries.sort()
+                for cnt in xrange(len(entries)):
+                    passwd = entries[cnt][2]
+                    if passwd not in self.early:
+                        yield base + block + cnt, passwd
+            base += total
+
+    def iterate(self, start = 0, stop = None, step = 1):
+        '''Yield [idx, password] from start to stop, every step'th candidate.'''
+        if stop == None or stop > self.count:
+            stop = self.count
+        for idx, passwd in self.stream(start):
+            if idx >= stop:
+                break
+            if idx >= start and (idx - start) % step == 0:
+                yield idx, passwd
+
+    def get(self, idx):
+        '''Return the candidate at idx, None if it was handed out in an earlier tier.'''
+        for cnt, passwd in self.iterate(idx, idx + 1):
+            return passwd
+
+    def close(self):
+        for source in self.sources:
+            source.close()
+
+def open_ranked(spec):
+    '''
+    Return ranked candidates from a spec string:
+        rank:<item>[,<item>...]
+    Each item is a c12_18_passwd_sources spec or dump:<filename>[:<min>-<max>] for a
+    firmware or memory dump. Vendor defaults always come first.
+    '''
+    sources = []
+    dumps   = []
+    sizes   = DUMP_SIZES
+    for item in spec[len('rank:'):].split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if item.startswith('dump:'):
+            name = item[5:]
+            if ':' in name:
+                name, lengths = name.rsplit(':', 1)
+                lengths = lengths.split('-')
+                sizes = (int(lengths[0]), int(lengths[-1]))
+            dumps.append(name)
+        else:
+            sources.append(c12passwd.open_source(item))
+    return RANKED(sources, dumps, sizes = sizes)
@@ -0,0 +1,342 @@
+# c12_18_scheduler.py - python module for scheduling security code attempts
+# around the lockout behavior of a meter.
+#
+# Copyright (c) 2011, InGuardians, Inc. <consulting@inguardians.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Point Of Contact:    Don C. Weber <don@inguardians.com>
+
+# Every security code attempt is classified by the meter's answer. Refused
+# codes count toward the lockout threshold. ISSS, DLK, RNO, and silence mean
+# the meter has locked the user out: the number of refusals before that is
+# the threshold and the time until the meter takes a logon again is the
+# recovery window. Once both are known the scheduler stops one attempt short
+# of the threshold and cools down for the recovery window instead of
+# tripping the lockout, which some meters extend each time it is tripped.
+# The pause between attempts shrinks while the meter keeps up and grows when
+# it answers BSY/DNR or locks out before the threshold.
+
+import os, time
+import json
+
+######################################
+# VARIABLES - These values will not change
+######################################
+# Response codes, see resp_bytes in c12_18_packet
+CODE_OK     = 0
+CODE_BSY    = 6
+CODE_DNR    = 7
+CODE_DLK    = 8
+CODE_RNO    = 9
+CODE_ISSS   = 10
+
+# Attempt outcomes
+OUTCOME_OK      = 'ok'          # Security code accepted
+OUTCOME_DENIED  = 'denied'      # Security code refused
+OUTCOME_BUSY    = 'busy'        # Meter answered BSY or DNR
+OUTCOME_LOCKED  = 'locked'      # Meter refuses the logon sequence
+OUTCOME_SILENT  = 'silent'      # Meter stopped answering
+
+LOCKOUT_CODES   = (CODE_DLK, CODE_RNO, CODE_ISSS)
+BUSY_CODES      = (CODE_BSY, CODE_DNR)
+
+# Pause between attempts
+PAUSE_START     = 0.5       # Seconds between attempts before anything is learned
+PAUSE_MIN       = 0         # Fastest pace
+PAUSE_MAX       = 30.0      # Slowest pace
+PAUSE_STEP      = 0.5       # First pause added after trouble
+PAUSE_DECAY     = 0.5       # Shrink factor after a run of clean attempts
+CLEAN_RUN       = 10        # Refused attempts without trouble before the pause shrinks
+
+# Lockout recovery
+RECOVER_START   = 5.0       # First wait after a lockout when no window is known
+RECOVER_MAX     = 3600.0    # Longest wait between recovery probes
+RECOVER_FACTOR  = 2         # Growth of the wait between recovery probes
+RECOVER_MARGIN  = 1.2       # Cool downs wait this much longer than the learned window
+EXTENDED        = 2.0       # A window this much longer than the last is an extended lockout
+THRESHOLD_SLACK = 1         # Attempts held back from the learned threshold
+######################################
+
+def classify(result):
+    '''Return the outcome of a security code attempt from its C1218_result.'''
+    if result == None or result.code == None:
+        return OUTCOME_SILENT
+    if result.code == CODE_OK:
+        return OUTCOME_OK
+    if result.code in BUSY_CODES:
+        return OUTCOME_BUSY
+    if result.code in LOCKOUT_CODES:
+        return OUTCOME_LOCKED
+    return OUTCOME_DENIED
+
+class SCHEDULER:
+    def __init__(self, key = None, pause = PAUSE_START, onf = None):
+        '''
+        Attempt scheduler for one port/meter. before() is called before each security code
+        is sent and after() with the result. When after() returns OUTCOME_LOCKED or
+        OUTCOME_SILENT, recover() waits until the meter takes a logon again.
+        '''
+        self.key        = key
+        self.pause      = pause     # Seconds between attempts
+        self.threshold  = None      # Learned refusals before a lockout
+        self.recovery   = None      # Learned seconds before the meter takes a logon again
+        self.streak     = 0         # Refusals since the last lockout or cool down
+        self.run        = 0         # Refusals since the last lockout
+        self.cooled     = False     # Cooled down since the last lockout
+        self.cooldown_on = True     # Cooling down resets the meter's count
+        self.clean      = 0         # Attempts since the last trouble
+        self.attempts   = 0         # Security codes sent
+        self.lockouts   = 0         # Lockouts tripped
+        self.extended   = 0         # Lockouts that took much longer than the one before
+        self.cooldowns  = 0         # Lockouts avoided by cooling down
+        self.locked_at  = None      # Time of the current lockout
+        self.lock_outcome = None    # Outcome that started the current lockout
+        self.lock_streak  = 0       # Refusals before the current lockout
+        self.lock_run     = 0       # Refusals before the current lockout, counting through cool downs
+        self.lock_cooled  = False   # Cooled down before the current lockout
+        self.t_last     = 0         # Time of the last attempt
+        self.started    = time.time()
+        self.onf        = onf       # Log file for scheduling decisions
+        self.debug      = False
+
+    def log(self, msg):
+        '''Record a scheduling decision.'''
+        line = "scheduler: %s: %s" % (self.key, msg)
+        if self.debug: print line
+        if self.onf: self.onf.write(time.strftime('%Y%m%d%H%M%S ') + line + "\n")
+
+    def before(self):
+        '''Wait until the next attempt is due. Cools down for the recovery window instead of
+            stepping on a known threshold. Returns the seconds waited.'''
+        if self.cooldown_on and self.threshold and self.recovery and self.streak >= max(1, self.threshold - THRESHOLD_SLACK):
+            wait = self.recovery * RECOVER_MARGIN
+            self.log("%d refusals of %d allowed, cooling down %.1f seconds" % (self.streak, self.threshold, wait))
+            time.sleep(wait)
+            self.streak = 0
+            self.cooled = True
+            self.cooldowns += 1
+            return wait
+        left = self.pause - (time.time() - self.t_last)
+        if left > 0:
+            time.sleep(left)
+            return left
+        return 0
+
+    def after(self, result):
+        '''Classify the result of an attempt and adjust the schedule. Returns the outcome.'''
+        outcome = classify(result)
+        self.attempts += 1
+        self.t_last = time.time()
+        if outcome == OUTCOME_OK:
+            self.streak = 0
+            self.calm()
+        elif outcome == OUTCOME_DENIED:
+            self.streak += 1
+            self.run += 1
+            self.calm()
+        elif outcome == OUTCOME_BUSY:
+            self.slow('meter busy')
+        else:
+            self.lockout(outcome)
+        return outcome
+
+    def calm(self):
+        '''Attempt without trouble. Speed up after a run of them.'''
+        self.clean += 1
+        if self.clean < CLEAN_RUN or self.pause <= PAUSE_MIN:
+            return
+        old = self.pause
+        self.pause = max(PAUSE_MIN, self.pause * PAUSE_DECAY)
+        if self.pause < PAUSE_STEP / 4:
+            self.pause = PAUSE_MIN
+        self.clean = 0
+        self.log("pause lowered %.2f -> %.2f" % (old, self.pause))
+
+    def slow(self, reason):
+        '''Meter had trouble keeping up. Double the pause.'''
+        self.clean = 0
+        old = self.pause
+        self.pause = min(PAUSE_MAX, max(PAUSE_STEP, self.pause * 2))
+        self.log("%s, pause raised %.2f -> %.2f" % (reason, old, self.pause))
+
+    def lockout(self, outcome):
+        '''Meter locked the user out, or stopped answering. recover() decides which.'''
+        self.lockouts    += 1
+        self.locked_at    = time.time()
+        self.lock_outcome = outcome
+        self.lock_streak  = self.streak
+        self.lock_run     = self.run
+        self.lock_cooled  = self.cooled
+        self.streak       = 0
+        self.run          = 0
+        self.cooled       = False
+        self.log("%s after %d refusals" % (outcome, self.lock_streak))
+
+    def learn(self):
+        '''The lockout was real. The refusals before it are a threshold sample.'''
+        if self.lock_cooled and self.threshold and self.lock_run >= self.threshold and self.lock_streak < self.threshold:
+            # The meter kept counting through the cool downs, they only cost time
+            self.cooldown_on = False
+            self.log("cool downs do not reset the meter's count, running to the lockout instead")
+            return
+        if not self.lock_streak:
+            return
+        if self.threshold == None or self.lock_streak < self.threshold:
+            self.threshold = self.lock_streak
+            self.log("threshold set to %d" % self.threshold)
+        elif self.lock_streak < self.threshold - THRESHOLD_SLACK:
+            # Tripped short of the threshold, the meter counts attempts over time
+            self.slow("locked out before the threshold")
+
+    def recover(self, probe, limit = None):
+        '''Wait out a lockout. probe() is called after each wait and returns True once the
+            meter takes a logon again. Gives up after limit seconds. Returns success (True)
+            or failure (False)'''
+        if self.locked_at == None:
+            self.locked_at = time.time()
+        # Silence may only be a lost packet, try once right away
+        if self.lock_outcome == OUTCOME_SILENT and probe():
+            self.log("meter answered again, not a lockout")
+            self.lockouts -= 1
+            self.streak = self.lock_streak
+            self.run    = self.lock_run
+            self.cooled = self.lock_cooled
+            self.locked_at = None
+            self.t_last = time.time()
+            return True
+        self.learn()
+        wait = self.recovery or RECOVER_START
+        while True:
+            if limit != None:
+                left = self.locked_at + limit - time.time()
+                if left <= 0:
+                    self.log("meter did not recover within %.0f seconds" % limit)
+                    return False
+                wait = min(wait, left)
+            self.log("locked out, waiting %.1f seconds" % wait)
+            if not self.debug: print "scheduler: %s: locked out, waiting %.1f seconds" % (self.key, wait)
+            time.sleep(wait)
+            if probe():
+                break
+            wait = min(RECOVER_MAX, wait * RECOVER_FACTOR)
+        window = time.time() - self.locked_at
+        if self.recovery and window > self.recovery * EXTENDED:
+            # The meter lengthens the lockout each time, hold back further from the threshold
+            self.extended += 1
+            if self.threshold and self.threshold > 1:
+                self.threshold -= 1
+            self.log("extended lockout of %.1f seconds, threshold lowered to %s" % (window, self.threshold))
+        if self.recovery == None or window > self.recovery:
+            self.recovery = window
+        self.log("recovered after %.1f seconds, window %.1f seconds" % (window, self.recovery))
+        self.locked_at = None
+        self.t_last = time.time()
+        return True
+
+    def rate(self):
+        '''Return attempts per hour so far.'''
+        elapsed = time.time() - self.started
+        if not elapsed:
+            return 0
+        return self.attempts * 3600 / elapsed
+
+    def summary(self):
+        '''Return a printable summary of what has been learned.'''
+        return "%d attempts, %.0f per hour, pause %.2f, threshold %s, recovery %s, %d lockouts (%d extended), %d cool downs" % (
+                self.attempts, self.rate(), self.pause, self.threshold,
+                self.recovery == None and None or '%.1f' % self.recovery,
+                self.lockouts, self.extended, self.cooldowns)
+
+    def profile(self):
+        '''Return the learned values for saving.'''
+        return {'pause':self.pause, 'threshold':self.threshold, 'recovery':self.recovery,
+                'lockouts':self.lockouts, 'extended':self.extended, 'cooldown_on':self.cooldown_on}
+
+    def load(self, profile):
+        '''Restore learned values.'''
+        self.pause     = min(PAUSE_MAX, profile.get('pause', PAUSE_START))
+        self.threshold = profile.get('threshold')
+        self.recovery  = profile.get('recovery')
+        self.lockouts  = profile.get('lockouts', 0)
+        self.extended  = profile.get('extended', 0)
+        self.cooldown_on = profile.get('cooldown_on', True)
+
+def attempt(scheduler, packet, ser_conn, user, passwd, table_num = None, limit = None):
+    '''Send one security code when the scheduler says it is due. With table_num, success is
+    reading that table after the security code. Lockouts are waited out, starting the logon
+    sequence over to test for recovery, and the code is sent again. Returns success (True),
+    failure (False), or None if the meter did not recover within limit seconds.'''
+    def relogon():
+        if not packet.login_setup(ser_conn):
+            return False
+        return packet.login_user(ser_conn, user)
+
+    while True:
+        scheduler.before()
+        ok = packet.login_passwd(ser_conn, passwd)
+        # Lockouts and busy answers come back on the security request, not the table read
+        security = packet.last_result
+        if ok and table_num != None:
+            ok = packet.full_table_read(ser_conn, table_num)[0]
+        outcome = scheduler.after(security)
+        if ok:
+            return True
+        if outcome not in (OUTCOME_LOCKED, OUTCOME_SILENT):
+            return False
+        if not scheduler.recover(relogon, limit):
+            return None
+
+######################################
+# Per port/meter profiles
+######################################
+SCHEDULERS = {}
+
+def get_scheduler(port = None, meter = None):
+    '''Return the scheduler for a port/meter, creating it if necessary.'''
+    key = str(port)
+    if meter:
+        key = '%s/%s' % (port, meter)
+    if key not in SCHEDULERS:
+        SCHEDULERS[key] = SCHEDULER(key = key)
+    return SCHEDULERS[key]
+
+def load_profiles(filename):
+    '''Load saved lockout profiles. Returns success (1) or failure (0)'''
+    if not os.path.isfile(filename):
+        return 0
+    try:
+        profiles = json.load(open(filename, 'r'))
+    except (IOError, ValueError):
+        print "load_profiles: Could not parse lockout profiles:", filename
+        return 0
+    for key in profiles:
+        if key not in SCHEDULERS:
+            SCHEDULERS[key] = SCHEDULER(key = key)
+        SCHEDULERS[key].load(profiles[key])
+    return 1
+
+def save_profiles(filename):
+    '''Save lockout profiles. Returns success (1) or failure (0)'''
+    profiles = {}
+    for key in SCHEDULERS:
+        profiles[key] = SCHEDULERS[key].profile()
+    try:
+        onf = open(filename, 'w')
+        json.dump(profiles, onf, indent = 1, sort_keys = True)
+        onf.close()
+    except IOError:
+        print "save_profiles: Could not write lockout profiles:", filename
+        return 0
+    return 1
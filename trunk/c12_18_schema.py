@@ -0,0 +1,343 @@
+# c12_18_schema.py - python module for decoding C12.19 tables from table
+# definitions.
+#
+# Copyright (c) 2011, InGuardians, Inc. <consulting@inguardians.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Point Of Contact:    Don C. Weber <don@inguardians.com>
+
+# Each table is a list of FIELDs. Sizes, repeat counts, and conditions can
+# name another field, either one earlier in the same table or one published
+# by a table decoded before it, such as the dimensions in Table 00 or the
+# flags in Table 11. Once those values are known the layout is compiled to
+# field offsets and struct.Struct objects and kept, so every table with the
+# same dimensions reuses it. Fields are only unpacked when they are first
+# used. A table can supply a default for a value no earlier table published,
+# such as the Table 01 serial number form when Table 00 was not decoded. To
+# decode a new table add its definition with define().
+
+import struct
+
+######################################
+# VARIABLES - These values will not change
+######################################
+# Field kinds: struct code and size in bytes. char and binary take their size from the field.
+KINDS = {
+    'u8'     : ['B', 1],
+    'u16'    : ['H', 2],
+    'u32'    : ['L', 4],
+    'char'   : ['s', None],
+    'binary' : ['s', None],
+    'record' : [None, None],
+}
+
+# FORMAT_CONTROL_1 DATA_ORDER bit in Table 00, set for big endian
+DATA_ORDER_FLAG     = 0x01
+# FORMAT_CONTROL_2 ID_FORM bit in Table 00, set for BCD(8) serial numbers instead of CHAR(16)
+ID_FORM_FLAG        = 0x20
+
+# Table 11 SOURCE_FLAGS_BFLD bits
+PF_EXCLUDE_FLAG     = 0x01
+RESET_EXCLUDE_FLAG  = 0x02
+SLIDING_DEMAND_FLAG = 0x08
+######################################
+
+SCHEMAS = {}
+STRUCTS = {}
+
+def get_struct(fmt):
+    '''Return a struct.Struct for fmt, built once per format.'''
+    if fmt not in STRUCTS:
+        STRUCTS[fmt] = struct.Struct(fmt)
+    return STRUCTS[fmt]
+
+class FIELD:
+    def __init__(self, name, kind, size = None, count = None, when = None, unless = None, fields = None):
+        '''
+        One table field. size is the byte length of char and binary fields. count repeats
+        the field, giving a list. when and unless are [name, mask] and keep the field only if
+        the named value has, or does not have, those bits set. fields holds the FIELDs of a
+        record. size and count can be numbers or the name of another field.
+        '''
+        self.name   = name
+        self.kind   = kind
+        self.size   = size
+        self.count  = count
+        self.when   = when
+        self.unless = unless
+        self.fields = fields or []
+
+    def refs(self):
+        '''Return the names of the values this field depends on.'''
+        names = [e for e in (self.size, self.count) if isinstance(e, str)]
+        for cond in (self.when, self.unless):
+            if cond:
+                names.append(cond[0])
+        return names
+
+    def code(self):
+        '''Return the struct code of a fixed size field.'''
+        if self.kind == 'record':
+            return ''.join([e.code() for e in self.fields])
+        code, size = KINDS[self.kind]
+        if size == None:
+            return '%d%s' % (self.size, code)
+        return code
+
+class SCHEMA:
+    def __init__(self, table, name, fields, provides = (), defaults = None):
+        '''
+        Definition of one table. provides lists the fields later tables may depend on.
+        defaults maps a value the table depends on to a function of the table data that
+        supplies it when no earlier table did.
+        '''
+        self.table    = table
+        self.name     = name
+        self.fields   = fields
+        self.provides = provides
+        self.defaults = defaults or {}
+        self.layouts  = {}
+
+        # The leading fields with a fixed size and no condition have fixed offsets, later
+        # fields may use them for their sizes and counts
+        self.prefix   = {}
+        offset = 0
+        for field in fields:
+            if field.refs() or field.count != None:
+                break
+            code = field.code()
+            self.prefix[field.name] = [offset, code]
+            offset += get_struct('<' + code).size
+
+        self.refs = []
+        for field in fields:
+            for name in field.refs():
+                if name not in self.refs:
+                    self.refs.append(name)
+
+    def value(self, name, order, data, context):
+        '''Return a value a layout depends on from the fixed fields of data or from context.'''
+        if name in self.prefix:
+            offset, code = self.prefix[name]
+            st = get_struct(order + code)
+            if len(data) < offset + st.size:
+                return None
+            return st.unpack_from(data, offset)[0]
+        if name not in context and name in self.defaults:
+            return self.defaults[name](data)
+        return context.get(name)
+
+    def compile(self, order, values):
+        '''Return the layout for a byte order and the values of the referenced fields:
+            [[field, offset, struct, count], ...] and the table length.'''
+        def number(e):
+            if isinstance(e, str):
+                return values[e]
+            return e
+        layout = []
+        offset = 0
+        for field in self.fields:
+            if field.when and not values[field.when[0]] & field.when[1]:
+                continue
+            if field.unless and values[field.unless[0]] & field.unless[1]:
+                continue
+            count = number(field.count)
+            if field.kind == 'record':
+                if count == None:
+                    count = 1
+                st = get_struct(order + field.code())
+                size = st.size * count
+            elif KINDS[field.kind][1] == None:
+                st = get_struct(order + '%d%s' % (number(field.size), KINDS[field.kind][0]))
+                size = st.size
+            elif count != None:
+                st = get_struct(order + '%d%s' % (count, KINDS[field.kind][0]))
+                size = st.size
+            else:
+                st = get_struct(order + KINDS[field.kind][0])
+                size = st.size
+            layout.append([field, offset, st, count])
+            offset += size
+        return [layout, offset]
+
+    def decode(self, data, context = {}):
+        '''Return a DECODED table for data or None if a dimension is not known or data is
+            shorter than the layout.'''
+        order = '<'
+        if context.get('format_cnt_1', 0) & DATA_ORDER_FLAG:
+            order = '>'
+        values = {}
+        for name in self.refs:
+            values[name] = self.value(name, order, data, context)
+            if values[name] == None:
+                return None
+        key = (order,) + tuple([values[e] for e in self.refs])
+        if key not in self.layouts:
+            self.layouts[key] = self.compile(order, values)
+        layout, length = self.layouts[key]
+        if len(data) < length:
+            return None
+        return DECODED(self, layout, data)
+
+class DECODED:
+    def __init__(self, schema, layout, data):
+        '''
+        A decoded table. Fields are unpacked on first use with table['name'] or table.name.
+        '''
+        self.schema  = schema
+        self.data    = data
+        self.entries = dict([[e[0].name, e] for e in layout])
+        self.order   = [e[0].name for e in layout]
+        self.values  = {}
+
+    def __getitem__(self, name):
+        if name not in self.values:
+            self.values[name] = self.unpack(self.entries[name])
+        return self.values[name]
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name not in self.__dict__.get('entries', {}):
+            raise AttributeError(name)
+        return self[name]
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def unpack(self, entry):
+        field, offset, st, count = entry
+        if field.kind == 'record':
+            names = [e.name for e in field.fields]
+            return [dict(zip(names, st.unpack_from(self.data, offset + e * st.size))) for e in range(count)]
+        if count != None and KINDS[field.kind][1] != None:
+            return list(st.unpack_from(self.data, offset))
+        return st.unpack_from(self.data, offset)[0]
+
+    def names(self):
+        '''Return the field names in table order.'''
+        return list(self.order)
+
+    def offset(self, name):
+        '''Return the byte offset of a field in the table.'''
+        return self.entries[name][1]
+
+    def kind(self, name):
+        '''Return the kind of a field, such as 'char' or 'binary'.'''
+        return self.entries[name][0].kind
+
+    def items(self):
+        '''Return [name, value] for every field in table order.'''
+        return [[e, self[e]] for e in self.order]
+
+def define(table, name, fields, provides = (), defaults = None):
+    '''Add a table definition.'''
+    SCHEMAS[table] = SCHEMA(table, name, fields, provides, defaults)
+    return SCHEMAS[table]
+
+def decode(table, data, context = {}):
+    '''Return a DECODED table or None if the table has no definition or does not decode.'''
+    if table not in SCHEMAS:
+        return None
+    return SCHEMAS[table].decode(data, context)
+
+class DECODER:
+    def __init__(self, context = None):
+        '''
+        Decodes tables from one meter. Values a table provides, such as the Table 00
+        dimensions, are kept for the tables decoded after it.
+        '''
+        self.context = dict(context or {})
+
+    def decode(self, table, data):
+        '''Return a DECODED table or None.'''
+        decoded = decode(table, data, self.context)
+        if decoded:
+            for name in SCHEMAS[table].provides:
+                if name in decoded:
+                    self.context[name] = decoded[name]
+        return decoded
+
+######################################
+# Table definitions
+######################################
+# Table 00 General Configuration Table
+define(0, 'General Configuration Table', [
+    FIELD('format_cnt_1', 'u8'),
+    FIELD('format_cnt_2', 'u8'),
+    FIELD('format_cnt_3', 'u8'),
+    FIELD('device_class', 'binary', 4),
+    FIELD('nameplate_type', 'u8'),
+    FIELD('default_set_used', 'u8'),
+    FIELD('max_proc_parm_len', 'u8'),
+    FIELD('max_resp_data_len', 'u8'),
+    FIELD('std_version_no', 'u8'),
+    FIELD('std_revision_no', 'u8'),
+    FIELD('dim_std_tbls_used', 'u8'),
+    FIELD('dim_mfg_tbls_used', 'u8'),
+    FIELD('dim_std_proc_used', 'u8'),
+    FIELD('dim_mfg_proc_used', 'u8'),
+    FIELD('dim_mfg_stat_used', 'u8'),
+    FIELD('nbr_pending', 'u8'),
+    FIELD('std_tbls_used', 'binary', 'dim_std_tbls_used'),
+    FIELD('mfg_tbls_used', 'binary', 'dim_mfg_tbls_used'),
+    FIELD('std_proc_used', 'binary', 'dim_std_proc_used'),
+    FIELD('mfg_proc_used', 'binary', 'dim_mfg_proc_used'),
+    FIELD('std_tbls_write', 'binary', 'dim_std_tbls_used'),
+    FIELD('mfg_tbls_write', 'binary', 'dim_mfg_tbls_used'),
+    ], provides = ('format_cnt_1', 'format_cnt_2', 'dim_std_tbls_used', 'dim_mfg_tbls_used', 'dim_std_proc_used',
+                   'dim_mfg_proc_used', 'dim_mfg_stat_used', 'nbr_pending'))
+
+# Table 01 General Manufacturer Identification Table
+def id_form(data):
+    '''Return FORMAT_CONTROL_2 for Table 01 data when Table 00 is not known. A table too
+        short for a CHAR(16) serial number has a BCD(8) one.'''
+    if len(data) < 32:
+        return ID_FORM_FLAG
+    return 0
+
+define(1, 'General Manufacturer Identification Table', [
+    FIELD('manufacturer', 'char', 4),
+    FIELD('ed_model', 'char', 8),
+    FIELD('hw_version_nm', 'u8'),
+    FIELD('hw_revision_nm', 'u8'),
+    FIELD('fw_version_nm', 'u8'),
+    FIELD('fw_revision_nm', 'u8'),
+    FIELD('mfg_serial_nm', 'char', 16, unless = ['format_cnt_2', ID_FORM_FLAG]),
+    FIELD('mfg_serial_nm', 'binary', 8, when = ['format_cnt_2', ID_FORM_FLAG]),
+    ], defaults = {'format_cnt_2':id_form})
+
+# Table 11 Actual Data Sources Limiting Table
+define(11, 'Actual Data Sources Limiting Table', [
+    FIELD('source_flags_bfld', 'u8'),
+    FIELD('nbr_uom_entries', 'u8'),
+    FIELD('nbr_demand_ctrl_entries', 'u8'),
+    FIELD('data_ctrl_length', 'u8'),
+    FIELD('nbr_data_ctrl_entries', 'u8'),
+    FIELD('nbr_constants_entries', 'u8'),
+    FIELD('constants_selector', 'u8'),
+    FIELD('nbr_sources', 'u8'),
+    ], provides = ('source_flags_bfld', 'nbr_uom_entries', 'nbr_demand_ctrl_entries', 'data_ctrl_length',
+                   'nbr_data_ctrl_entries', 'nbr_constants_entries', 'constants_selector', 'nbr_sources'))
+
+# Table 13 Demand Control Table, needs Table 11
+define(13, 'Demand Control Table', [
+    FIELD('reset_exclusion', 'u8', when = ['source_flags_bfld', RESET_EXCLUDE_FLAG]),
+    FIELD('p_fail_recogntn_tm', 'u8', when = ['source_flags_bfld', PF_EXCLUDE_FLAG]),
+    FIELD('p_fail_exclusion', 'u8', when = ['source_flags_bfld', PF_EXCLUDE_FLAG]),
+    FIELD('cold_load_pickup', 'u8', when = ['source_flags_bfld', PF_EXCLUDE_FLAG]),
+    FIELD('interval_value', 'record', count = 'nbr_demand_ctrl_entries', when = ['source_flags_bfld', SLIDING_DEMAND_FLAG],
+          fields = [FIELD('sub_int', 'u8'), FIELD('int_multiplier', 'u8')]),
+    FIELD('interval_value', 'record', count = 'nbr_demand_ctrl_entries', unless = ['source_flags_bfld', SLIDING_DEMAND_FLAG],
+          fields = [FIELD('int_length', 'u16')]),
+    ])
@@ -23,7 +23,6 @@
 import os, sys, time
 import serial
 import struct
-import crcmod
 import warnings
 
 class SERCONN:
@@ -41,6 +40,9 @@ class SERCONN:
         self.rtscts    = False
         self.stopbits  = serial.STOPBITS_ONE
         self.dsrdtr    = False
+        # Buffered reads
+        self.rbuf      = bytearray()    # Bytes drained from the port but not read yet
+        self.cur_timeout = None         # Timeout currently set on the port
         
     def serInit(self, port = None, baud=9600, timeout=5, invert=0):
         # FIXME: c12_18_serial.py: serInit: This should conduct a search for the optical probe. Should also handle OSX
@@ -71,6 +73,8 @@ class SERCONN:
             
         #self.serialport = serial.Serial(self.comm_port, self.baud, timeout=self.timeout)
         self.serialport = serial.Serial(self.comm_port, self.baud, timeout=self.timeout, parity=self.parity, bytesize=self.bytesize, xonxoff=self.xonxoff, rtscts=self.rtscts, stopbits=self.stopbits, dsrdtr=self.dsrdtr)
+        self.cur_timeout = self.timeout
+        self.rbuf = bytearray()
 
         if self.invert:
             self.serialport.setRTS(0)
@@ -82,24 +86,107 @@ class SERCONN:
 # Read Serial
 #########################################
         
+    def in_waiting(self):
+        '''Returns the number of bytes waiting in the serial driver'''
+        # pySerial 3 uses a property, older versions use a method
+        try:
+            return self.serialport.in_waiting
+        except AttributeError:
+            return self.serialport.inWaiting()
+
+    def fill(self, deadline=None):
+        '''Drain everything waiting on the port into the read buffer. If nothing is waiting
+        block for one byte until the deadline. Returns the number of bytes added.'''
+        waiting = self.in_waiting()
+        if not waiting:
+            # Only wait as long as the deadline allows
+            wait = self.timeout
+            if deadline != None:
+                wait = min(wait, max(0, deadline - time.time()))
+            if wait != self.cur_timeout:
+                self.serialport.timeout = wait
+                self.cur_timeout = wait
+            data = self.serialport.read(1)
+            if not data:
+                return 0
+            self.rbuf.extend(data)
+            waiting = self.in_waiting()
+            if not waiting:
+                return len(data)
+            data = self.serialport.read(waiting)
+            self.rbuf.extend(data)
+            return len(data) + 1
+        data = self.serialport.read(waiting)
+        self.rbuf.extend(data)
+        return len(data)
+
+    def read_exact(self, num=1, deadline=None):
+        '''Returns num bytes or fewer if the deadline passes first. The deadline is a
+        time.time() value for the whole read, default is now plus the port timeout.'''
+        if deadline == None:
+            deadline = time.time() + self.timeout
+        while len(self.rbuf) < num:
+            if not self.fill(deadline) and time.time() >= deadline:
+                break
+        tmp_bytes = str(self.rbuf[:num])
+        del self.rbuf[:num]
+        return tmp_bytes
+
+    def read_available(self, deadline=None):
+        '''Returns the buffered bytes and everything waiting on the port, blocking for the
+        first byte until the deadline. Returns an empty string if nothing arrives. Framing
+        is left to the caller, such as c12_18_packet.FrameDecoder.'''
+        if deadline == None:
+            deadline = time.time() + self.timeout
+        while not self.rbuf:
+            if not self.fill(deadline) and time.time() >= deadline:
+                return ''
+        tmp_bytes = str(self.rbuf)
+        del self.rbuf[:]
+        return tmp_bytes
+
     def read_byte(self):
         '''Returns a single byte read in from serial'''
-        return self.serialport.read(1)
+        return self.read_exact(1)
     
     def read_sbytes(self, num=1):
-        '''Returns a list of bytes read one at a time in from serial'''
-        tmp_bytes = []
-        for cnt in range(num):
-            tmp_bytes.append(self.read_byte())
-        return ''.join(tmp_bytes)
+        '''Returns num bytes read in from serial. One timeout covers all of the bytes'''
+        return self.read_exact(num)
     
     def read_fbytes(self, num=1):
         '''Returns a selected number of bytes read in from serial'''
-        return self.serialport.read(num)
+        return self.read_exact(num)
     
     def read_line(self):
         '''Returns a line of bytes read in from serial'''
-        return self.serialport.readline()
+        idx = self.rbuf.find('\n')
+        if idx >= 0:
+            tmp_bytes = str(self.rbuf[:idx + 1])
+            del self.rbuf[:idx + 1]
+            return tmp_bytes
+        tmp_bytes = str(self.rbuf)
+        del self.rbuf[:]
+        return tmp_bytes + self.serialport.readline()
+
+    def flush_input(self):
+        '''Drop buffered bytes and anything waiting on the port'''
+        del self.rbuf[:]
+        waiting = self.in_waiting()
+        if waiting:
+            self.serialport.read(waiting)
+
+    def set_baud(self, baud=9600):
+        '''Change the baud rate of the open port, such as after a negotiate. Bytes
+        buffered at the old rate are dropped. Returns success (1) or failure (0)'''
+        if self.debug: print "set_baud:", baud
+        del self.rbuf[:]
+        try:
+            self.serialport.baudrate = baud
+        except (ValueError, serial.SerialException):
+            print "set_baud: Could not set baud rate:", baud
+            return 0
+        self.baud = baud
+        return 1
 
     def close(self):
         self.serialport.close()
@@ -121,7 +208,8 @@ class SERCONN:
         return 1;
     
     def write_bytes(self, data=None, flush = True):
-        '''Write a list of bytes to serial'''
+        '''Write a list of bytes to serial. Data can be a string or a memoryview
+        of a packet built by c12_18_packet.FrameEncoder'''
         if data == None:
             return 0;
         # Should be okay to write all at the some time
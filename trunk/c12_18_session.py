@@ -0,0 +1,170 @@
+# c12_18_session.py - python module for keeping one authenticated C12.18
+# session open across several actions.
+#
+# Copyright (c) 2011, InGuardians, Inc. <consulting@inguardians.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Point Of Contact:    Don C. Weber <don@inguardians.com>
+
+# The meter drops a session after the channel traffic timeout. Between actions
+# a background timer sends the Wait service so the meter holds the session,
+# and the ident, negotiate, logon, and security exchange is only repeated
+# when the session has actually been lost.
+
+import time
+import threading
+import c12_18_pacing as c12pacing
+
+######################################
+# VARIABLES - These values will not change
+######################################
+KEEPALIVE_WAIT   = 60       # Seconds the meter is asked to hold the session
+# Send waits before the channel traffic timeout even if the meter ignores the wait time,
+# leaving time for one retransmission
+KEEPALIVE_PERIOD = c12pacing.CHANNEL_TRAFFIC_TIMEOUT - c12pacing.RESPONSE_TIMEOUT
+
+# Outcomes
+SUCCESS = True
+FAIL    = False
+######################################
+
+class SESSION:
+    def __init__(self, packet, ser_conn, keepalive = True):
+        '''
+        Authenticated session shared by actions. begin() makes sure the session is logged
+        on as the requested user, end() hands it to the keepalive until the next action.
+        '''
+        self.packet     = packet
+        self.ser_conn   = ser_conn
+        self.keepalive  = keepalive     # Send Wait service between actions
+        self.lock       = threading.RLock()
+        self.timer      = None
+        self.busy       = False         # An action is using the session
+        self.last       = 0             # Time of the last traffic with the meter
+        self.logons     = 0             # Number of times the session was authenticated
+        self.debug      = False
+
+    def active(self, user = None, passwd = None):
+        '''Return True if the meter is still logged on as user with passwd.'''
+        logon = self.packet.logon
+        if not logon:
+            return False
+        if user != None and (logon[0] != user or logon[1] != passwd):
+            return False
+        # Without waits the meter has dropped the session by now
+        if time.time() - self.last > c12pacing.CHANNEL_TRAFFIC_TIMEOUT and not self.keepalive:
+            return False
+        return True
+
+    def begin(self, user, passwd, setup = True):
+        '''Start an action. Reuses the open session if it is logged on as user, otherwise
+            logs on. Returns success (True) or failure (False)'''
+        self.lock.acquire()
+        try:
+            self.stop()
+            self.busy = True
+            if self.active(user, passwd):
+                # Make sure the meter still has the session
+                if self.packet.send_wait(self.ser_conn, KEEPALIVE_WAIT, silent = 2):
+                    self.last = time.time()
+                    if self.debug: print "session: reusing session for user", user
+                    return SUCCESS
+                if self.debug: print "session: session lost"
+                self.lost()
+            elif self.packet.logon:
+                # Logged on as someone else
+                self.packet.send_terminate(self.ser_conn)
+            return self.logon(user, passwd, setup)
+        finally:
+            self.lock.release()
+
+    def logon(self, user, passwd, setup = True):
+        '''Run ident, negotiate, logon, and security.'''
+        if setup and not self.packet.login_setup(self.ser_conn):
+            return FAIL
+        if not self.packet.login_seq_passwd(self.ser_conn, user, passwd):
+            return FAIL
+        self.last = time.time()
+        self.logons += 1
+        return SUCCESS
+
+    def hold(self):
+        '''Stop the keepalive while an action uses the serial port.'''
+        self.lock.acquire()
+        try:
+            self.stop()
+            self.busy = True
+        finally:
+            self.lock.release()
+
+    def end(self):
+        '''Finish an action and keep the session open until the next one.'''
+        self.lock.acquire()
+        try:
+            if self.busy:
+                self.last = time.time()
+            self.busy = False
+            if self.packet.logon:
+                self.start()
+        finally:
+            self.lock.release()
+
+    def lost(self):
+        '''The meter dropped the session.'''
+        self.stop()
+        self.packet.logon_user = None
+        self.packet.logon      = None
+
+    def close(self):
+        '''Terminate the session.'''
+        self.lock.acquire()
+        try:
+            self.stop()
+            if self.packet.logon:
+                self.packet.send_terminate(self.ser_conn)
+            self.lost()
+        finally:
+            self.lock.release()
+
+    def start(self):
+        '''Schedule the next wait.'''
+        if not self.keepalive:
+            return
+        self.stop()
+        self.timer = threading.Timer(KEEPALIVE_PERIOD, self.send_wait)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def stop(self):
+        '''Cancel the next wait.'''
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+
+    def send_wait(self):
+        '''Timer callback. Sends the Wait service unless an action has the session.'''
+        if not self.lock.acquire(False):
+            return
+        try:
+            if self.busy or not self.packet.logon:
+                return
+            if not self.packet.send_wait(self.ser_conn, KEEPALIVE_WAIT, silent = 2):
+                if self.debug: print "session: keepalive failed, session lost"
+                self.lost()
+                return
+            self.last = time.time()
+            self.start()
+        finally:
+            self.lock.release()
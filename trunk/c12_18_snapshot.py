@@ -0,0 +1,372 @@
+# c12_18_snapshot.py - python module for keeping every table read in a
+# queryable store.
+#
+# Copyright (c) 2011, InGuardians, Inc. <consulting@inguardians.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Point Of Contact:    Don C. Weber <don@inguardians.com>
+
+# The store is a SQLite file. Every full table read the meter answers is a
+# snapshot of (meter identity, user, table, response code, table data).
+# Table data is kept once per SHA-1 digest in the blobs table, so a table
+# read again with the same contents, on this or any other meter, only adds
+# a snapshot row. When a read returns the same answer as the last snapshot
+# of that meter, user, and table, the snapshot's last time and read count
+# are updated instead, so repeated reads and refused reads during brute
+# force runs do not grow the store.
+#
+# REAUDIT uses the snapshots of an earlier audit to skip tables that look
+# the same. Table 00 is read again first; when its dimensions changed the
+# table layouts may have moved and every table is read in full. Otherwise a
+# table is only read in full when a partial read of its first bytes or of
+# its last byte does not match the snapshot, or when it is too short for
+# the checks to save anything. Tables that were not read in full are
+# reported as matched, not as unchanged: bytes between the checks are not
+# compared.
+#
+# Stores are queried and compared from the command line:
+#   python c12_18_snapshot.py <store>                       List meters
+#   python c12_18_snapshot.py <store> <meter>               List the latest snapshot of each table
+#   python c12_18_snapshot.py <store> <meter> <table>       List every snapshot of a table
+#   python c12_18_snapshot.py <store> diff <id> <id>        Compare two snapshots
+
+import os, sys, time
+import sqlite3
+import threading
+import hashlib
+import byte_tools as bt
+import c12_18_schema as c12schema
+
+######################################
+# VARIABLES - These values will not change
+######################################
+SNAPSHOT_BATCH   = 64       # Snapshots between commits
+SNAPSHOT_TIMEOUT = 30       # Seconds to wait for another probe's commit
+
+SNAPSHOT_SCHEMA  = ['''CREATE TABLE IF NOT EXISTS snapshots (
+    id          INTEGER PRIMARY KEY,
+    meter       TEXT NOT NULL,
+    user        INTEGER,
+    tbl         INTEGER NOT NULL,
+    code        INTEGER NOT NULL,
+    digest      TEXT,
+    length      INTEGER NOT NULL DEFAULT 0,
+    reads       INTEGER NOT NULL DEFAULT 1,
+    first       REAL NOT NULL,
+    last        REAL NOT NULL)''',
+    '''CREATE INDEX IF NOT EXISTS snapshots_meter ON snapshots (meter, tbl, id)''',
+    '''CREATE INDEX IF NOT EXISTS snapshots_table ON snapshots (tbl, digest)''',
+    '''CREATE TABLE IF NOT EXISTS blobs (
+    digest      TEXT PRIMARY KEY,
+    data        BLOB NOT NULL)''']
+
+# Snapshot rows, see SNAPSHOTS.rows()
+ROW_FIELDS = ['id', 'meter', 'user', 'tbl', 'code', 'digest', 'length', 'reads', 'first', 'last']
+ANY_USER         = -1       # latest() takes the newest snapshot by any user
+
+# Re-audit
+REAUDIT_HEADER   = 32       # Bytes compared at the start of a table
+REAUDIT_SMALL    = 64       # Tables this short are read in full, the checks cost about as much
+REAUDIT_OFFSETS  = 16       # Changed offsets listed per table in the report
+REAUDIT_FULL     = [3, 23, 28, 52, 55, 63, 64, 65, 66, 67, 74, 76]    # Status, readings, clock, and logs, always read in full
+
+# Re-audit table states
+NEW       = 'new'
+CHANGED   = 'changed'
+UNCHANGED = 'unchanged'         # Read in full, same as the snapshot
+MATCHED   = 'matched'           # Not read in full, start and length match the snapshot
+FAILED    = 'failed'            # The meter did not answer the full read
+STATE_NAMES = {
+    NEW       : 'New',
+    CHANGED   : 'Changed',
+    UNCHANGED : 'Unchanged',
+    MATCHED   : 'Not transferred (header/length match)',
+    FAILED    : 'Failed',
+    }
+######################################
+
+def digest(data):
+    '''Return the blob digest of table data.'''
+    return hashlib.sha1(data).hexdigest()
+
+class SNAPSHOTS:
+    def __init__(self, filename, batch = SNAPSHOT_BATCH):
+        '''
+        Table snapshot store. record() adds a read, latest(), history(), and tables()
+        look them up, and data() returns the table data of a snapshot.
+        '''
+        self.filename = filename
+        self.batch    = batch
+        self.pending  = 0               # Snapshots since the last commit
+        self.last     = {}              # [meter, user, table] -> [id, code, digest] of the newest snapshot
+        self.lock     = threading.RLock()   # Probes record from their own threads
+        self.conn     = sqlite3.connect(filename, timeout = SNAPSHOT_TIMEOUT, check_same_thread = False)
+        self.conn.text_factory = str
+        for sql in SNAPSHOT_SCHEMA:
+            self.conn.execute(sql)
+        self.conn.commit()
+
+    def record(self, meter, user, table, code, data = None, when = None):
+        '''Add a table read. data is the table data without the response code, length, and
+            checksum, None when the meter refused the read. Returns the snapshot id.'''
+        when = when or time.time()
+        key  = digest(data) if data != None else None
+        with self.lock:
+            last = self.newest(meter, user, table)
+            if last and last[1] == code and last[2] == key:
+                self.conn.execute('UPDATE snapshots SET reads = reads + 1, last = ? WHERE id = ?', (when, last[0]))
+            else:
+                if key:
+                    self.conn.execute('INSERT OR IGNORE INTO blobs VALUES (?, ?)', (key, sqlite3.Binary(data)))
+                cur = self.conn.execute('INSERT INTO snapshots (meter, user, tbl, code, digest, length, first, last) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                        (meter, user, table, code, key, len(data or ''), when, when))
+                last = [cur.lastrowid, code, key]
+                self.last[(meter, user, table)] = last
+            self.pending += 1
+            if self.pending >= self.batch:
+                self.sync()
+        return last[0]
+
+    def newest(self, meter, user, table):
+        '''Return [id, code, digest] of the newest snapshot of a meter, user, and table.'''
+        if (meter, user, table) not in self.last:
+            row = self.conn.execute('SELECT id, code, digest FROM snapshots WHERE meter = ? AND tbl = ? AND user IS ? ORDER BY id DESC LIMIT 1',
+                    (meter, table, user)).fetchone()
+            self.last[(meter, user, table)] = row and list(row)
+        return self.last[(meter, user, table)]
+
+    def rows(self, sql, args):
+        '''Return the snapshot rows a query selects as dictionaries of ROW_FIELDS.'''
+        with self.lock:
+            return [dict(zip(ROW_FIELDS, row)) for row in self.conn.execute('SELECT ' + ', '.join(ROW_FIELDS) + ' FROM snapshots ' + sql, args)]
+
+    def get(self, snap_id):
+        '''Return a snapshot by id or None.'''
+        rows = self.rows('WHERE id = ?', (snap_id,))
+        if rows:
+            return rows[0]
+        return None
+
+    def latest(self, meter, table, user = ANY_USER):
+        '''Return the newest snapshot of a table on a meter, read by user or by any user, or None.'''
+        if user == ANY_USER:
+            rows = self.rows('WHERE meter = ? AND tbl = ? ORDER BY id DESC LIMIT 1', (meter, table))
+        else:
+            rows = self.rows('WHERE meter = ? AND tbl = ? AND user IS ? ORDER BY id DESC LIMIT 1', (meter, table, user))
+        if rows:
+            return rows[0]
+        return None
+
+    def history(self, meter, table):
+        '''Return every snapshot of a table on a meter, oldest first.'''
+        return self.rows('WHERE meter = ? AND tbl = ? ORDER BY id', (meter, table))
+
+    def tables(self, meter):
+        '''Return the newest snapshot of every table read on a meter, by table number.'''
+        return self.rows('WHERE id IN (SELECT MAX(id) FROM snapshots WHERE meter = ? GROUP BY tbl) ORDER BY tbl', (meter,))
+
+    def meters(self):
+        '''Return [meter, tables, snapshots, last read] for every meter in the store.'''
+        with self.lock:
+            return [list(row) for row in self.conn.execute('SELECT meter, COUNT(DISTINCT tbl), COUNT(*), MAX(last) FROM snapshots GROUP BY meter ORDER BY meter')]
+
+    def data(self, snapshot):
+        '''Return the table data of a snapshot, None if the meter refused the read.'''
+        if not snapshot or not snapshot['digest']:
+            return None
+        with self.lock:
+            row = self.conn.execute('SELECT data FROM blobs WHERE digest = ?', (snapshot['digest'],)).fetchone()
+        if row:
+            return str(row[0])
+        return None
+
+    def sync(self):
+        '''Commit recorded snapshots.'''
+        with self.lock:
+            if self.pending:
+                self.conn.commit()
+                self.pending = 0
+
+    def close(self):
+        self.sync()
+        self.conn.close()
+
+class REAUDIT:
+    def __init__(self, store, meter, user):
+        '''
+        Incremental audit of one meter as one user against the snapshots of earlier audits.
+        Call start() once the session is up, then read() for each table.
+        '''
+        self.store   = store
+        self.meter   = meter
+        self.user    = user
+        self.tables  = {}          # table -> [state, previous snapshot, snapshot id now]
+        self.order   = []          # Tables in the order they were checked
+        self.dims    = []          # [name, was, now] for Table 00 dimensions that changed
+        self.table00 = None        # Table 00 data read by start()
+        self.results00 = None
+        self.refused = {}          # table -> why the full read did not return the table
+
+    def start(self, packet, ser_conn):
+        '''Read Table 00 and compare its dimensions with the last audit. Returns the
+            C1218_result of the Table 00 read.'''
+        prev = self.store.latest(self.meter, 0, self.user)
+        results = packet.full_table_read(ser_conn, 0)
+        if not results[0]:
+            return results
+        self.results00 = results
+        self.table00 = packet.parse_rtn_data(results[1])[2]
+        if self.note(0, prev, results) == CHANGED:
+            old = c12schema.decode(0, self.store.data(prev) or '')
+            new = c12schema.decode(0, self.table00)
+            if not old or not new:
+                self.dims.append(['length', prev['length'], len(self.table00)])
+            else:
+                for name in c12schema.SCHEMAS[0].provides:
+                    if old[name] != new[name]:
+                        self.dims.append([name, old[name], new[name]])
+        return results
+
+    def read(self, packet, ser_conn, table):
+        '''Return [state, results] for a table. results is None when the table matched and
+            was not transferred, otherwise the C1218_result of the full read.'''
+        if table == 0 and self.results00:
+            return [self.tables[0][0], self.results00]
+        prev = self.store.latest(self.meter, table, self.user)
+        if prev and not self.dims and table not in REAUDIT_FULL and self.same(packet, ser_conn, table, prev):
+            self.tables[table] = [MATCHED, prev, prev['id']]
+            self.order.append(table)
+            return [MATCHED, None]
+        results = packet.full_table_read(ser_conn, table)
+        return [self.note(table, prev, results), results]
+
+    def note(self, table, prev, results):
+        '''Compare a full read with the previous snapshot. Returns the table state.'''
+        if not results[0]:
+            self.refused[table] = results.reason()
+        if results.snapshot == None:
+            state = FAILED
+        elif not prev:
+            state = NEW
+        elif results.snapshot == prev['id']:
+            # The store only adds a snapshot when the answer differs
+            state = UNCHANGED
+        else:
+            state = CHANGED
+        self.tables[table] = [state, prev, results.snapshot]
+        self.order.append(table)
+        return state
+
+    def same(self, packet, ser_conn, table, prev):
+        '''Return True when partial reads of the start and the end of a table match its snapshot.'''
+        if prev['code'] or prev['length'] <= REAUDIT_SMALL:
+            return False
+        data = self.store.data(prev)
+        if not data:
+            return False
+        results = packet.partial_table_read(ser_conn, table, 0, REAUDIT_HEADER)
+        if not results[0] or packet.parse_rtn_data(results[1])[2] != data[:REAUDIT_HEADER]:
+            return False
+        # Ask for one byte past the end, it only comes back if the table grew
+        results = packet.partial_table_read(ser_conn, table, len(data) - 1, 2)
+        if results[0]:
+            return packet.parse_rtn_data(results[1])[2] == data[-1:]
+        if results.code == None:
+            return False
+        # Some meters refuse any read that runs past the end of a table
+        results = packet.partial_table_read(ser_conn, table, len(data) - 1, 1)
+        return bool(results[0]) and packet.parse_rtn_data(results[1])[2] == data[-1:]
+
+    def state_tables(self, state):
+        '''Return the tables checked with a state.'''
+        return [e for e in self.order if self.tables[e][0] == state]
+
+    def lines(self):
+        '''Return the report of the audit as printable lines.'''
+        lines = ["Re-audit of meter %s as user %s" % (self.meter, self.user)]
+        if self.dims:
+            lines.append("Table 00 dimensions changed, every table was read in full:")
+            for name, was, now in self.dims:
+                lines.append("    %s: %s -> %s" % (name, was, now))
+        for state in (UNCHANGED, MATCHED, CHANGED, NEW, FAILED):
+            tables = self.state_tables(state)
+            lines.append(("%s: %d tables %s" % (STATE_NAMES[state], len(tables), ','.join([str(e) for e in tables]))).rstrip())
+            if state != CHANGED:
+                continue
+            for table in tables:
+                lines.append("    " + self.change_line(table))
+        for table in sorted(self.refused):
+            lines.append("    Table %d not read: %s" % (table, self.refused[table]))
+        return lines
+
+    def change_line(self, table):
+        '''Return what changed in a table since its previous snapshot.'''
+        state, prev, now = self.tables[table]
+        snapshot = self.store.get(now)
+        line = "Table %d: snapshot %d -> %d" % (table, prev['id'], now)
+        if snapshot['code'] != prev['code']:
+            return line + ", response code %d -> %d" % (prev['code'], snapshot['code'])
+        if snapshot['length'] != prev['length']:
+            line += ", %d -> %d bytes" % (prev['length'], snapshot['length'])
+        offsets = [str(e[0]) for e in diff_data(self.store.data(prev) or '', self.store.data(snapshot) or '')]
+        if len(offsets) > REAUDIT_OFFSETS:
+            offsets = offsets[:REAUDIT_OFFSETS] + ['...']
+        return line + ", differs at offsets " + ','.join(offsets)
+
+def snapshot_line(snapshot):
+    '''Return a printable line for a snapshot.'''
+    when = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(snapshot['last']))
+    return "%6d  table %4d  user %5s  code %2d  %5d bytes  %4d reads  %s  %s" % (snapshot['id'], snapshot['tbl'],
+            snapshot['user'], snapshot['code'], snapshot['length'], snapshot['reads'], when, snapshot['digest'] or '')
+
+def diff_data(old, new):
+    '''Return [offset, old bytes, new bytes] for every run of bytes that differ.'''
+    diffs = []
+    start = None
+    for idx in range(max(len(old), len(new)) + 1):
+        same = idx >= max(len(old), len(new)) or (idx < len(old) and idx < len(new) and old[idx] == new[idx])
+        if not same and start == None:
+            start = idx
+        elif same and start != None:
+            diffs.append([start, old[start:idx], new[start:idx]])
+            start = None
+    return diffs
+
+if __name__ == "__main__":
+
+    if len(sys.argv) < 2 or not os.path.isfile(sys.argv[1]):
+        print "Usage: %s <store> [<meter> [<table>] | diff <id> <id>]" % sys.argv[0]
+        sys.exit()
+    store = SNAPSHOTS(sys.argv[1])
+    if len(sys.argv) == 2:
+        for meter, tables, snaps, last in store.meters():
+            print "%s: %d tables, %d snapshots, last read %s" % (meter, tables, snaps, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(last)))
+    elif sys.argv[2] == 'diff' and len(sys.argv) == 5:
+        old = store.get(int(sys.argv[3]))
+        new = store.get(int(sys.argv[4]))
+        if not old or not new:
+            print "c12_18_snapshot.py: No such snapshot"
+            sys.exit()
+        print snapshot_line(old)
+        print snapshot_line(new)
+        for offset, was, now in diff_data(store.data(old) or '', store.data(new) or ''):
+            print "    offset %d: %s -> %s" % (offset, bt.print_data(was), bt.print_data(now))
+    elif len(sys.argv) == 3:
+        for snapshot in store.tables(sys.argv[2]):
+            print snapshot_line(snapshot)
+    else:
+        for snapshot in store.history(sys.argv[2], int(sys.argv[3])):
+            print snapshot_line(snapshot)
+    store.close()
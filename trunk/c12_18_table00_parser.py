@@ -17,77 +17,120 @@
 
 # Point Of Contact:    Don C. Weber <don@inguardians.com>
 
-# TODO: c12_18_table00_parser: Fix this so that it is not so complicated to use.
+
+# Table 00 ends in bit sets where bit n of the set means table or procedure
+# base + n is used or writable. The table layout is defined in c12_18_schema.
+# Each set is decoded once with a bitarray search for the set bits, and TABLE00
+# keeps the results as lists for printing and as sets for membership tests in
+# the read and fuzz loops.
 
 from bitarray import bitarray
 import sys
+import byte_tools as bt
+import c12_18_schema as c12schema
 
 std_base = 0
 mfg_base = 2040
 mfg_proc_base = 2048
 
+ONE = bitarray('1')
+
+def set_bits(data, base):
+    '''Return the numbers of the set bits in data bytes. Bit 0 of the first byte is base.'''
+    bits = bitarray(endian='little')
+    bits.frombytes(data)
+    # search() gives longs on python 2, keep the lists printing as plain numbers
+    return [int(e) + base for e in bits.search(ONE)]
+
 def get_procs(data,base):
-    '''Return a list of tables from data bytes.'''
+    '''Return a list of procedures from data bytes.'''
+    return set_bits(data, base)
 
-    tmp = bitarray(endian='little')
-    tmp.frombytes(data)
-    plist = tmp.tolist()
-    tlist = []
-    for e in range(len(tmp.tolist())):
-        if tmp[e]:
-            tlist.append(int(str(e+base)))
-    return tlist
-    
 def get_tables(data,base):
     '''Return a list of tables from data bytes.'''
-
-    tmp = bitarray(endian='little')
-    tmp.frombytes(data)
-    tlist = []
-    for e in range(len(tmp.tolist())):
-        if tmp[e]:
-            tlist.append(int(str(e+base)))
-    return tlist
+    return set_bits(data, base)
 
 def sget_procs(data,base):
-    '''Return a list of tables from string data.'''
+    '''Return a list of procedures from string data.'''
+    return set_bits(data, base)
 
-    tmp = bitstring(endian='little')
-    tmp.frombytes(data)
-    plist = tmp.tolist()
-    tlist = []
-    for e in range(len(tmp.tolist())):
-        if tmp[e]:
-            tlist.append(int(str(e+base)))
-    return tlist
-    
 def sget_tables(data,base):
     '''Return a list of tables from string data.'''
+    return set_bits(data, base)
+
+class TABLE00:
+    def __init__(self, fields):
+        '''
+        Decoded Configuration Table. fields is Table 00 decoded by c12_18_schema, see
+        parse_table00().
+        '''
+        self.fields = fields
+
+        self.std_tables       = set_bits(fields['std_tbls_used'], std_base)
+        self.mfg_tables       = set_bits(fields['mfg_tbls_used'], mfg_base)
+        self.std_procs        = set_bits(fields['std_proc_used'], std_base)
+        self.mfg_procs        = set_bits(fields['mfg_proc_used'], mfg_proc_base)
+        self.std_write_tables = set_bits(fields['std_tbls_write'], std_base)
+        self.mfg_write_tables = set_bits(fields['mfg_tbls_write'], mfg_base)
+
+        self.tables   = set(self.std_tables + self.mfg_tables)
+        self.procs    = set(self.std_procs + self.mfg_procs)
+        self.writable = set(self.std_write_tables + self.mfg_write_tables)
+
+    def __getitem__(self, name):
+        return self.fields[name]
+
+    def is_readable(self, table):
+        '''Return True if Table 00 lists table as used.'''
+        return table in self.tables
+
+    def is_writable(self, table):
+        '''Return True if Table 00 lists table as writable.'''
+        return table in self.writable
+
+    def is_proc(self, proc):
+        '''Return True if Table 00 lists procedure proc as used.'''
+        return proc in self.procs
 
-    tmp = bitarray(endian='little')
-    tmp.fromstring(data)
-    tlist = []
-    for e in range(len(tmp.tolist())):
-        if tmp[e]:
-            tlist.append(int(str(e+base)))
-    return tlist
+def parse_table00(data):
+    '''Return a TABLE00 for table data or None if data is too short for the header and
+        the bit sets it describes.'''
+    fields = c12schema.decode(0, data)
+    if not fields:
+        return None
+    return TABLE00(fields)
 
 if __name__ == "__main__":
 
+    # Usage: c12_18_table00_parser.py <print option> <hex data>
+    # For print_table the data is Table 00 without the response code, length, and checksum.
+    # The other options take a single bit set.
     try:
-        indata = sys.argv[2]
+        indata = bt.str2hex(sys.argv[2])
     except:
         print 'User must provide information using string data'
+        sys.exit()
 
+    if sys.argv[1] == 'print_table':
+        table00 = parse_table00(indata)
+        if not table00:
+            print 'Table 00 data is too short'
+            sys.exit()
+        print 'Standard Tables',table00.std_tables
+        print 'Manufacturer Tables',table00.mfg_tables
+        print 'Standard Procedures',table00.std_procs
+        print 'Manufacturer Procedures',table00.mfg_procs
+        print 'Standard Writable Tables',table00.std_write_tables
+        print 'Manufacturer Writable Tables',table00.mfg_write_tables
     if sys.argv[1] == 'print_std_tables':
-        print 'Standard Tables',sget_tables(std_tbls_used,c12tbl00.std_base)
+        print 'Standard Tables',sget_tables(indata,std_base)
     if sys.argv[1] == 'print_mfg_tables':
-        print 'Manufacturer Tables',sget_tables(indata,c12tbl00.mfg_base)
+        print 'Manufacturer Tables',sget_tables(indata,mfg_base)
     if sys.argv[1] == 'print_std_procs':
-        print 'Standard Procedures',sget_procs(std_proc_used,c12tbl00.std_base)
+        print 'Standard Procedures',sget_procs(indata,std_base)
     if sys.argv[1] == 'print_mfg_procs':
-        print 'Manufacturer Procedures',sget_procs(mfg_proc_used,c12tbl00.mfg_proc_base)
+        print 'Manufacturer Procedures',sget_procs(indata,mfg_proc_base)
     if sys.argv[1] == 'print_std_rw_tables':
-        print 'Standard Writable Tables',sget_tables(std_tbls_write,c12tbl00.std_base)
+        print 'Standard Writable Tables',sget_tables(indata,std_base)
     if sys.argv[1] == 'print_mfg_rw_tables':
-        print 'Manufacturer Writable Tables',sget_tables(mfg_tbls_write,c12tbl00.mfg_base)
+        print 'Manufacturer Writable Tables',sget_tables(indata,mfg_base)